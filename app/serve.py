@@ -0,0 +1,84 @@
+"""Запуск приложения в продакшене: несколько процессов uvicorn.
+
+Настройки берутся из переменных окружения (см. settings.py, WEB_*).
+Цикл событий uvloop и парсер HTTP httptools используются, если
+установлены. По SIGTERM/SIGINT процессы перестают принимать соединения,
+ждут завершения текущих запросов не дольше WEB_GRACEFUL_TIMEOUT секунд
+и выполняют shutdown приложения (сброс счётчиков лайков, закрытие пула).
+
+До запуска процессов схема БД сверяется с моделями, а схема OpenAPI
+сохраняется в OPENAPI_SCHEMA_PATH, поэтому старт и перезапуск процесса
+не создают таблицы и не строят схему.
+
+    python serve.py
+"""
+
+import asyncio
+import importlib.util
+import logging
+import os
+from typing import Any, Dict
+
+import uvicorn
+
+APP = "src.api.app:app"
+
+
+def get_server_options() -> Dict[str, Any]:
+    from src.settings import (
+        WEB_BACKLOG,
+        WEB_GRACEFUL_TIMEOUT,
+        WEB_HOST,
+        WEB_KEEPALIVE_TIMEOUT,
+        WEB_PORT,
+        WEB_WORKERS,
+    )
+
+    return dict(
+        host=WEB_HOST,
+        port=WEB_PORT,
+        # 0 - по процессу на ядро
+        workers=WEB_WORKERS or os.cpu_count(),
+        loop="uvloop" if importlib.util.find_spec("uvloop") else "asyncio",
+        http="httptools" if importlib.util.find_spec("httptools") else "h11",
+        timeout_keep_alive=WEB_KEEPALIVE_TIMEOUT,
+        timeout_graceful_shutdown=WEB_GRACEFUL_TIMEOUT,
+        backlog=WEB_BACKLOG,
+        # Запросы логирует nginx перед приложением
+        access_log=False,
+        proxy_headers=True,
+    )
+
+
+async def init_database() -> None:
+    """Проверяет схему БД один раз до запуска процессов, чтобы их
+    lifespan не создавал таблицы одновременно"""
+    from src.db import database, indexes, schema
+
+    engine = database.get_engine()
+    async with engine.begin() as conn:
+        if await schema.ensure_schema(conn):
+            await conn.run_sync(indexes.check_indexes)
+    await engine.dispose()
+
+
+def init_openapi() -> None:
+    from src.api.app import app
+    from src.api.customopenapi import save_openapi
+    from src.settings import OPENAPI_SCHEMA_PATH
+
+    if OPENAPI_SCHEMA_PATH:
+        save_openapi(app, OPENAPI_SCHEMA_PATH)
+
+
+if __name__ == "__main__":
+    options = get_server_options()
+    asyncio.run(init_database())
+    init_openapi()
+    logging.warning(
+        "Starting %s workers (loop=%s, http=%s)",
+        options["workers"],
+        options["loop"],
+        options["http"],
+    )
+    uvicorn.run(APP, **options)
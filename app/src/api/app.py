@@ -1,20 +1,67 @@
+import logging
 from contextlib import asynccontextmanager
-from typing import Annotated
-
-from fastapi import FastAPI, File, Path, Request, UploadFile, status
+from functools import partial
+from typing import Annotated, Optional
+
+from fastapi import (
+    BackgroundTasks,
+    FastAPI,
+    File,
+    Path,
+    Query,
+    Request,
+    UploadFile,
+    status,
+)
 from fastapi.exceptions import (
     HTTPException,
     RequestValidationError,
     StarletteHTTPException,
 )
-from fastapi.responses import JSONResponse
-
-from ..settings import DEBUG
+from fastapi.responses import JSONResponse, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..settings import (
+    CACHE_TTL,
+    DB_REPEATED_QUERY_THRESHOLD,
+    DEBUG,
+    FEED_LIKERS_SAMPLE,
+    FEED_MAX_PAGE_SIZE,
+    FEED_PAGE_SIZE,
+    FOLLOWS_MAX_PAGE_SIZE,
+    FOLLOWS_PAGE_SIZE,
+    LEGACY_FULL_PROFILE,
+    PROFILE_FOLLOWS_PREVIEW,
+    SEARCH_CANDIDATES,
+    SEARCH_MAX_QUERY_LENGTH,
+    SEARCH_WINDOW,
+    TIMELINE_MODE,
+    UPLOAD_MAX_SIZE,
+)
 from . import schemas
-from ..db import crud, models, database
-from .app_depends import Session, Static_image_path, User
+from ..db import crud, database, indexes, loaders, models, schema
+from .app_depends import (
+    Session,
+    Session_maker,
+    Static_image_path,
+    User,
+    get_auth_cache,
+    get_cache_backend,
+    get_like_counter,
+    get_metrics,
+    get_query_metrics,
+)
 from .customopenapi import custom_openapi
-from ..services.file_service import write_to_disk
+from .middlewares import ContentLengthLimitMiddleware, RequestScopeMiddleware
+from ..services.etag import etag_matches, make_etag
+from ..services.file_service import (
+    FileTooLarge,
+    remove_file,
+    write_to_disk,
+)
+from ..services.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from ..services import image_service, timeline_service
+from ..services.pagination import InvalidCursor, decode_cursor, encode_cursor
 
 tags_metadata = [
     {
@@ -31,30 +78,43 @@ tags_metadata = [
     },
 ]
 description = "API for twitter-clone"
+# Запас на заголовки multipart/form-data сверх размера самого файла
+MULTIPART_OVERHEAD = 64 * 1024
 
 
 @asynccontextmanager
 async def database_init(app: FastAPI):
     engine = database.get_engine()
     async with engine.begin() as conn:
-        await conn.run_sync(models.Base.metadata.create_all)
+        # При неизменных моделях - один запрос версии схемы вместо
+        # create_all; индексы сверяются после изменения схемы
+        if await schema.ensure_schema(conn) or DEBUG:
+            await conn.run_sync(indexes.check_indexes)
+    get_like_counter().start(database.get_db_session())
     yield
+    await get_like_counter().stop(database.get_db_session())
+    image_service.shutdown_process_pool()
+    cache = get_cache_backend()
+    if cache is not None:
+        await cache.close()
+    for replica in database.get_replica_engines():
+        await replica.dispose()
     await engine.dispose()
 
 
-app = FastAPI(
-    tags_metadata=tags_metadata, debug=DEBUG, lifespan=database_init
+app = FastAPI(tags_metadata=tags_metadata, debug=DEBUG, lifespan=database_init)
+app.add_middleware(
+    ContentLengthLimitMiddleware,
+    max_size=UPLOAD_MAX_SIZE + MULTIPART_OVERHEAD,
+    paths={"/medias"},
+)
+app.add_middleware(
+    RequestScopeMiddleware,
+    debug_headers=DEBUG,
+    query_metrics=get_query_metrics(),
+    repeated_query_threshold=DB_REPEATED_QUERY_THRESHOLD,
+    metrics=get_metrics(),
 )
-
-
-@app.middleware("http")
-async def session_close(request: Request, call_next):
-    response = await call_next(request)
-    try:
-        await request.state.session.close()
-    except AttributeError:
-        ...
-    return response
 
 
 @app.exception_handler(RequestValidationError)
@@ -78,6 +138,16 @@ async def http_instance_not_exist_exception_handler(request, exc):
     return JSONResponse(answer.model_dump(), status.HTTP_404_NOT_FOUND)
 
 
+@app.exception_handler(FileTooLarge)
+async def http_file_too_large_exception_handler(request, exc):
+    answer = schemas.Error(
+        result=False, error_type=exc.__class__.__name__, error_message=str(exc)
+    )
+    return JSONResponse(
+        answer.model_dump(), status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    )
+
+
 @app.exception_handler(crud.CRUDException)
 async def http_crud_exception_handler(request, exc):
     answer = schemas.Error(
@@ -109,6 +179,109 @@ async def http_all_exception_handler(request, exc):
     return JSONResponse(answer.model_dump(), code, headers=exc.headers)
 
 
+def etag_headers(etag: str) -> dict:
+    # Ответ зависит от пользователя, клиент проверяет его при каждом запросе
+    return {
+        "ETag": etag,
+        "Cache-Control": "private, no-cache",
+        "Vary": "api-key",
+    }
+
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """Ответ 304 без тела, если клиент прислал актуальный ETag"""
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED,
+            headers=etag_headers(etag),
+        )
+    return None
+
+
+async def cache_get(name: str, key: str) -> Optional[bytes]:
+    """Запись кэша ответов или None. Ошибка кэша (например, Redis
+    недоступен) - промах: ответ собирается без кэша"""
+    cache = get_cache_backend()
+    if cache is None:
+        return None
+    try:
+        cached = await cache.get(key)
+    except Exception:
+        logging.warning("Cache %s lookup failed", name, exc_info=True)
+        get_metrics().cache_error(name)
+        return None
+    get_metrics().cache_lookup(name, cached is not None)
+    return cached
+
+
+async def cache_set(name: str, key: str, value: bytes) -> None:
+    cache = get_cache_backend()
+    if cache is None:
+        return
+    try:
+        await cache.set(key, value, CACHE_TTL)
+    except Exception:
+        logging.warning("Cache %s store failed", name, exc_info=True)
+        get_metrics().cache_error(name)
+
+
+async def get_profile(
+    user_id: int, session: AsyncSession
+) -> schemas.UserExtensive:
+    """Профиль пользователя: счётчики и первые PROFILE_FOLLOWS_PREVIEW
+    подписчиков и подписок. При LEGACY_FULL_PROFILE - полные списки"""
+    if LEGACY_FULL_PROFILE:
+        profile = await crud.get_by_id(
+            models.User,
+            user_id,
+            session,
+            populate_existing=True,
+            options=loaders.USER_PROFILE,
+        )
+        return schemas.UserExtensive.model_validate(profile)
+    profile = await crud.get_user_counts(user_id, session)
+    followers = await crud.get_follows(
+        user_id, session, True, PROFILE_FOLLOWS_PREVIEW
+    )
+    following = await crud.get_follows(
+        user_id, session, False, PROFILE_FOLLOWS_PREVIEW
+    )
+    return schemas.UserExtensive(
+        id=profile.id,
+        name=profile.name,
+        followers=[schemas.User.model_validate(row) for row in followers],
+        following=[schemas.User.model_validate(row) for row in following],
+        followers_count=profile.followers_count,
+        following_count=profile.following_count,
+    )
+
+
+async def get_profile_response(
+    request: Request, user_id: int, session: AsyncSession
+) -> Response:
+    """Ответ с профилем с учётом If-None-Match. Версия профиля читается
+    одним запросом по первичному ключу, профиль с этой версией берётся
+    из кэша ответов, если он включён. Ключ содержит версию, поэтому
+    запись, сохранённая запросом, который читал БД до подписки,
+    не будет выдана после неё"""
+    version = await crud.get_user_version(user_id, session)
+    etag = make_etag("profile", user_id, version, LEGACY_FULL_PROFILE)
+    if response := not_modified(request, etag):
+        return response
+    key = f"profile:{user_id}:{etag}"
+    cached = await cache_get("profile", key)
+    if cached is not None:
+        content = cached.decode()
+    else:
+        user_schema = await get_profile(user_id, session)
+        result = schemas.UserResult(result=True, user=user_schema)
+        content = result.model_dump_json(exclude_none=True)
+        await cache_set("profile", key, content.encode())
+    return Response(
+        content, media_type="application/json", headers=etag_headers(etag)
+    )
+
+
 @app.get(
     "/users/me",
     response_model=schemas.UserResult,
@@ -120,9 +293,9 @@ async def http_all_exception_handler(request, exc):
 async def get_me(
     request: Request, session: Session, user: User
 ) -> schemas.UserResult:
-    """Endpoint for get the information about an authenticated users"""
-    user_schema = schemas.UserExtensive.model_validate(user)
-    return schemas.UserResult(result=True, user=user_schema)
+    """Endpoint for get the information about an authenticated users.
+    Supports conditional requests with If-None-Match"""
+    return await get_profile_response(request, user.id, session)
 
 
 @app.post(
@@ -133,16 +306,27 @@ async def get_me(
     responses=schemas.error_responses,
 )
 async def post_tweet(
-    request: Request, tweet: schemas.TweetCreate, session: Session, user: User
+    request: Request,
+    tweet: schemas.TweetCreate,
+    session: Session,
+    user: User,
+    session_maker: Session_maker,
+    background_tasks: BackgroundTasks,
 ) -> schemas.TweetCreateResult:
     """Endpoint for create a tweet"""
-    new_tweet = models.Tweet(
-        content=tweet.tweet_data,
-        author=user,
-        images=tweet.tweet_media_ids if tweet.tweet_media_ids else [],
-    )
+    new_tweet = models.Tweet(content=tweet.tweet_data, author_id=user.id)
     tweet_id = await crud.save(new_tweet, session)
+    await crud.add_tweet_images(tweet_id, tweet.tweet_media_ids, session)
+    await crud.bump_versions([user.id], session)
     await session.commit()
+    if TIMELINE_MODE != "pull":
+        background_tasks.add_task(
+            timeline_service.fan_out_tweet,
+            session_maker,
+            tweet_id,
+            user.id,
+            TIMELINE_MODE,
+        )
     return schemas.TweetCreateResult(result=True, tweet_id=tweet_id)
 
 
@@ -159,17 +343,68 @@ async def post_image(
         UploadFile, File(..., description="image file", title="FILE")
     ],
     session: Session,
+    session_maker: Session_maker,
     user: User,
     static_path: Static_image_path,
+    background_tasks: BackgroundTasks,
 ) -> schemas.MediaPostResult:
-    """Endpoint for post an image"""
-    path = await write_to_disk(user, file, static_path)
-    new_image = models.Image(path=path)
-    media_id = await crud.save(new_image, session)
+    """Endpoint for post an image. Identical files are stored once
+    and share one media id. Thumbnails are made in the background"""
+    stored = await write_to_disk(file, static_path)
+    get_metrics().observe_upload(stored.size)
+    image = await crud.get_or_create_image(stored.path, stored.hash, session)
     await session.commit()
+    media_id = image.id
+    if stored.created and image.path != stored.path:
+        # Запись уже указывает на другой файл с тем же содержимым
+        await remove_file(static_path, stored.path)
+    background_tasks.add_task(
+        image_service.process_image, session_maker, media_id, static_path
+    )
     return schemas.MediaPostResult(result=True, media_id=media_id)
 
 
+async def render_feed_page(
+    user_id: int,
+    session: AsyncSession,
+    limit: int,
+    before_id: Optional[int],
+    after_id: Optional[int],
+) -> str:
+    """Тело ответа GET /tweets"""
+    tweets = await crud.get_following_tweet_documents(
+        user_id,
+        session,
+        limit + 1,
+        before_id=before_id,
+        after_id=after_id,
+        mode=TIMELINE_MODE,
+        likers=FEED_LIKERS_SAMPLE,
+    )
+    next_cursor = None
+    if len(tweets) > limit:
+        if after_id is not None and before_id is None:
+            tweets = tweets[1:]
+            next_cursor = encode_cursor("after", tweets[0].id)
+        else:
+            tweets = tweets[:limit]
+            next_cursor = encode_cursor("before", tweets[-1].id)
+    return tweets_content(tweets, next_cursor)
+
+
+def tweets_content(tweets, next_cursor: Optional[str]) -> str:
+    """Тело ответа schemas.TweetsResult из строк с документами твитов.
+    Документы уже собраны в БД в формате schemas.Tweet, поэтому ответ
+    склеивается без валидации pydantic"""
+    content = '{"result":true,"tweets":['
+    content += ",".join(tweet.document for tweet in tweets)
+    content += "]"
+    if next_cursor is not None:
+        content += f',"next_cursor":"{next_cursor}"'
+    content += "}"
+    return content
+
+
 @app.get(
     "/tweets",
     response_model=schemas.TweetsResult,
@@ -178,14 +413,144 @@ async def post_image(
     responses=schemas.error_responses,
 )
 async def get_tweets(
-    request: Request, session: Session, user: User
+    request: Request,
+    session: Session,
+    user: User,
+    limit: Annotated[
+        int,
+        Query(
+            ge=1,
+            le=FEED_MAX_PAGE_SIZE,
+            description="Max number of tweets on the page",
+        ),
+    ] = FEED_PAGE_SIZE,
+    before_id: Annotated[
+        Optional[int],
+        Query(ge=1, description="Return tweets older than this tweet id"),
+    ] = None,
+    after_id: Annotated[
+        Optional[int],
+        Query(ge=0, description="Return tweets newer than this tweet id"),
+    ] = None,
+    cursor: Annotated[
+        Optional[str],
+        Query(description="next_cursor value from the previous page"),
+    ] = None,
 ) -> schemas.TweetsResult:
-    """Endpoint for get all tweets"""
-    tweets = await crud.get_following_tweets(user, session)
-    tweets_schema = [
-        schemas.Tweet.model_validate(tweet) for tweet in tweets.unique()
-    ]
-    return schemas.TweetsResult(result=True, tweets=tweets_schema)
+    """Endpoint for get a page of tweets, from newest to oldest.
+    Supports conditional requests with If-None-Match"""
+    if cursor is not None:
+        try:
+            direction, tweet_id = decode_cursor(cursor)
+        except (InvalidCursor, ValueError):
+            raise HTTPException(400, "Invalid cursor")
+        if not isinstance(tweet_id, int):
+            raise HTTPException(400, "Invalid cursor")
+        if direction == "before":
+            before_id = tweet_id
+        elif direction == "after":
+            after_id = tweet_id
+        else:
+            raise HTTPException(400, "Invalid cursor")
+    # Версия ленты проверяется до её сборки, опрос без изменений
+    # стоит одного запроса
+    authors, version, own_version = await crud.get_feed_version(
+        user.id, session
+    )
+    etag = make_etag(
+        "feed",
+        user.id,
+        authors,
+        version,
+        own_version,
+        TIMELINE_MODE,
+        FEED_LIKERS_SAMPLE,
+        limit,
+        before_id,
+        after_id,
+    )
+    if response := not_modified(request, etag):
+        return response
+    # Ключ содержит ETag, поэтому записи устаревают вместе с версиями
+    # авторов ленты без удаления из кэша
+    key = f"feed:{user.id}:{etag}"
+    cached = await cache_get("feed", key)
+    if cached is not None:
+        content = cached.decode()
+    else:
+        content = await render_feed_page(
+            user.id, session, limit, before_id, after_id
+        )
+        await cache_set("feed", key, content.encode())
+    return Response(
+        content, media_type="application/json", headers=etag_headers(etag)
+    )
+
+
+@app.get(
+    "/tweets/search",
+    response_model=schemas.TweetsResult,
+    response_model_exclude_none=True,
+    tags=["TWEETS"],
+    responses=schemas.error_responses,
+)
+async def search_tweets(
+    session: Session,
+    user: User,
+    q: Annotated[
+        str,
+        Query(
+            min_length=1,
+            max_length=SEARCH_MAX_QUERY_LENGTH,
+            description="Words to search for in tweets",
+        ),
+    ],
+    limit: Annotated[
+        int,
+        Query(
+            ge=1,
+            le=FEED_MAX_PAGE_SIZE,
+            description="Max number of tweets on the page",
+        ),
+    ] = FEED_PAGE_SIZE,
+    cursor: Annotated[
+        Optional[str],
+        Query(description="next_cursor value from the previous page"),
+    ] = None,
+) -> schemas.TweetsResult:
+    """Endpoint for full-text search over tweets, best matches first.
+    Only the most recent matches are ranked"""
+    upto = after = None
+    if cursor is not None:
+        try:
+            upto, score, tweet_id = decode_cursor(cursor)
+        except (InvalidCursor, ValueError):
+            raise HTTPException(400, "Invalid cursor")
+        if not (
+            isinstance(upto, int)
+            and isinstance(tweet_id, int)
+            and isinstance(score, (int, float))
+        ):
+            raise HTTPException(400, "Invalid cursor")
+        after = (score, tweet_id)
+    tweets = await crud.search_tweet_documents(
+        q,
+        session,
+        limit + 1,
+        SEARCH_CANDIDATES,
+        SEARCH_WINDOW,
+        upto=upto,
+        after=after,
+        likers=FEED_LIKERS_SAMPLE,
+    )
+    next_cursor = None
+    if len(tweets) > limit:
+        tweets = tweets[:limit]
+        last = tweets[-1]
+        next_cursor = encode_cursor(last.upto, last.score, last.id)
+    return Response(
+        tweets_content(tweets, next_cursor), media_type="application/json"
+    )
 
 
 @app.delete(
@@ -211,7 +576,8 @@ async def delete_tweet(
     ],
 ) -> schemas.Result:
     """Endpoint for delete the tweet. Only author can delete the tweet"""
-    await crud.delete_tweet(tweet_id, user, session)
+    await crud.delete_tweet(tweet_id, user.id, session)
+    await crud.bump_versions([user.id], session)
     await session.commit()
     return schemas.Result(result=True)
 
@@ -239,12 +605,108 @@ async def get_user(
         ),
     ],
 ) -> schemas.UserResult:
-    """Endpoint for get the information about the user by user's id."""
-    find_user = await crud.get_by_id(
-        models.User, user_id, session, populate_existing=True
+    """Endpoint for get the information about the user by user's id.
+    Supports conditional requests with If-None-Match"""
+    return await get_profile_response(request, user_id, session)
+
+
+async def get_follows_page(
+    user_id: int,
+    session: AsyncSession,
+    followers: bool,
+    limit: int,
+    cursor: Optional[str],
+) -> schemas.UsersResult:
+    before_id = None
+    if cursor is not None:
+        try:
+            direction, before_id = decode_cursor(cursor)
+        except (InvalidCursor, ValueError):
+            raise HTTPException(400, "Invalid cursor")
+        if direction != "before" or not isinstance(before_id, int):
+            raise HTTPException(400, "Invalid cursor")
+    rows = await crud.get_follows(
+        user_id, session, followers, limit + 1, before_id
     )
-    user_schema = schemas.UserExtensive.model_validate(find_user)
-    return schemas.UserResult(result=True, user=user_schema)
+    if not rows and before_id is None:
+        # пустой список отличается от отсутствующего пользователя
+        await crud.get_user_counts(user_id, session)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor("before", rows[-1].follow_id)
+    return schemas.UsersResult(
+        result=True,
+        users=[schemas.User.model_validate(row) for row in rows],
+        next_cursor=next_cursor,
+    )
+
+
+FollowsLimit = Annotated[
+    int,
+    Query(
+        ge=1,
+        le=FOLLOWS_MAX_PAGE_SIZE,
+        description="Max number of users on the page",
+    ),
+]
+FollowsCursor = Annotated[
+    Optional[str],
+    Query(description="next_cursor value from the previous page"),
+]
+UserId = Annotated[
+    int,
+    Path(
+        ...,
+        alias="id",
+        title="Id of the user.",
+        description="Номер пользователя",
+    ),
+]
+
+
+@app.get(
+    "/users/{id}/followers",
+    response_model=schemas.UsersResult,
+    response_model_exclude_none=True,
+    tags=["USERS"],
+    responses=schemas.error_responses.update(
+        {status.HTTP_404_NOT_FOUND: {"models": schemas.Error}}
+    ),
+)
+async def get_user_followers(
+    request: Request,
+    session: Session,
+    user: User,
+    user_id: UserId,
+    limit: FollowsLimit = FOLLOWS_PAGE_SIZE,
+    cursor: FollowsCursor = None,
+) -> schemas.UsersResult:
+    """Endpoint for get a page of the user's followers,
+    from the latest to the earliest"""
+    return await get_follows_page(user_id, session, True, limit, cursor)
+
+
+@app.get(
+    "/users/{id}/following",
+    response_model=schemas.UsersResult,
+    response_model_exclude_none=True,
+    tags=["USERS"],
+    responses=schemas.error_responses.update(
+        {status.HTTP_404_NOT_FOUND: {"models": schemas.Error}}
+    ),
+)
+async def get_user_following(
+    request: Request,
+    session: Session,
+    user: User,
+    user_id: UserId,
+    limit: FollowsLimit = FOLLOWS_PAGE_SIZE,
+    cursor: FollowsCursor = None,
+) -> schemas.UsersResult:
+    """Endpoint for get a page of users followed by the user,
+    from the latest to the earliest"""
+    return await get_follows_page(user_id, session, False, limit, cursor)
 
 
 @app.post(
@@ -273,16 +735,10 @@ async def like_tweet(
 ) -> schemas.Result:
     """Endpoint for like the tweet. it will cause an error message
     if user will like the tweet repeatedly"""
-    tweet = await crud.get_by_id(models.Tweet, tweet_id, session)
-    try:
-        await crud.get_one(
-            models.Like, session, user_id=user.id, tweet_id=tweet.id
-        )
+    if await crud.add_like(tweet_id, user.id, session) is None:
         raise HTTPException(400, "Like is already exist")
-    except crud.CRUDException:
-        new_like = models.Like(user_id=user.id, tweet_id=tweet.id)
-    await crud.save(new_like, session)
     await session.commit()
+    get_like_counter().add(tweet_id, 1)
     return schemas.Result(result=True)
 
 
@@ -310,12 +766,9 @@ async def delete_like_tweet(
     ],
 ) -> schemas.Result:
     """Endpoint for delete user's like to the tweet."""
-    tweet = await crud.get_by_id(models.Tweet, tweet_id, session)
-    like = await crud.get_one(
-        models.Like, session, user_id=user.id, tweet_id=tweet.id
-    )
-    await crud.delete(like, session)
+    await crud.delete_like(tweet_id, user.id, session)
     await session.commit()
+    get_like_counter().add(tweet_id, -1)
     return schemas.Result(result=True)
 
 
@@ -333,6 +786,8 @@ async def follow_user(
     request: Request,
     session: Session,
     user: User,
+    session_maker: Session_maker,
+    background_tasks: BackgroundTasks,
     following_user_id: Annotated[
         int,
         Path(
@@ -345,23 +800,22 @@ async def follow_user(
 ) -> schemas.Result:
     """Endpoint for following the user.
     it will cause an error message if user will follow the user repeatedly"""
-    following_user = await crud.get_by_id(
-        models.User, following_user_id, session
-    )
-    if user == following_user:
+    if user.id == following_user_id:
         raise HTTPException(400, "You can't following self")
-    try:
-        follower = await crud.get_one(
-            models.Follower,
-            session,
-            user_id=user.id,
-            following_id=following_user.id,
-        )
+    if await crud.add_follower(user.id, following_user_id, session) is None:
         raise HTTPException(400, "You are already following")
-    except crud.CRUDException:
-        follower = models.Follower(user=user, following=following_user)
-    await crud.save(follower, session)
+    await crud.bump_versions([user.id, following_user_id], session)
     await session.commit()
+    get_auth_cache().invalidate_user(user.id)
+    get_auth_cache().invalidate_user(following_user_id)
+    if TIMELINE_MODE != "pull":
+        background_tasks.add_task(
+            timeline_service.backfill_following,
+            session_maker,
+            user.id,
+            following_user_id,
+            TIMELINE_MODE,
+        )
     return schemas.Result(result=True)
 
 
@@ -378,6 +832,8 @@ async def delete_follow_user(
     request: Request,
     session: Session,
     user: User,
+    session_maker: Session_maker,
+    background_tasks: BackgroundTasks,
     following_user_id: Annotated[
         int,
         Path(
@@ -389,18 +845,42 @@ async def delete_follow_user(
     ],
 ) -> schemas.Result:
     """Endpoint for stop following the user."""
-    following_user = await crud.get_by_id(
-        models.User, following_user_id, session
-    )
-    follower = await crud.get_one(
-        models.Follower,
-        session,
-        user_id=user.id,
-        following_id=following_user.id,
-    )
-    await crud.delete(follower, session)
+    await crud.delete_follower(user.id, following_user_id, session)
+    await crud.bump_versions([user.id, following_user_id], session)
     await session.commit()
+    get_auth_cache().invalidate_user(user.id)
+    get_auth_cache().invalidate_user(following_user_id)
+    if TIMELINE_MODE != "pull":
+        background_tasks.add_task(
+            timeline_service.prune_following,
+            session_maker,
+            user.id,
+            following_user_id,
+        )
     return schemas.Result(result=True)
 
 
-custom_openapi(app)
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics_text() -> Response:
+    """Metrics of this worker in the Prometheus text format"""
+    pool_stats = database.get_pool_stats(database.get_engine().pool)
+    content = get_metrics().render(pool_stats, get_query_metrics().snapshot())
+    return Response(content, media_type=METRICS_CONTENT_TYPE)
+
+
+if DEBUG:
+
+    @app.get("/debug/pool", include_in_schema=False)
+    async def get_pool_stats(session: Session) -> dict:
+        """Connection pool state of this worker"""
+        return database.get_pool_stats(session.bind.pool)
+
+    @app.get("/debug/queries", include_in_schema=False)
+    async def get_query_stats() -> dict:
+        """Database queries per route of this worker"""
+        return get_query_metrics().snapshot()
+
+
+# Схема OpenAPI строится или читается из файла при первом запросе
+# /openapi.json, а не при импорте
+app.openapi = partial(custom_openapi, app)
@@ -1,23 +1,102 @@
-from typing import Annotated
+import math
+import time
+from functools import lru_cache, partial
+from typing import Annotated, Optional
 
-from fastapi import Depends, Header, HTTPException
+from fastapi import Depends, Header, HTTPException, Request
+from sqlalchemy.orm import sessionmaker
 
-from ..db import crud, models
-from ..db.database import AsyncSession, get_db_session
+from ..db import crud, loaders
+from ..db.database import AsyncSession, get_db_session, get_session_router
+from ..db.instrumentation import QueryMetrics
+from ..services.cache import ApiKeyCache, CacheBackend, make_cache_backend
+from ..services.like_counter import LikeCounter
+from ..services.metrics import Metrics
+from . import schemas
+from .middlewares import RequestScope
 
 STATIC_PATH = "static"
 
 
-async def get_session():
-    # print("session start")
-    session = get_db_session()()
+# Cookie со временем последней записи клиента, чтобы его следующие
+# чтения шли в основную БД в любом процессе (WEB_WORKERS > 1)
+WRITE_COOKIE = "db_write"
+
+
+def last_write(request: Request) -> Optional[float]:
     try:
+        return float(request.cookies[WRITE_COOKIE])
+    except (KeyError, ValueError):
+        return None
+
+
+async def get_session(request: Request) -> AsyncSession:
+    """Сессия запроса: GET и HEAD читают с реплики, остальные методы
+    пишут в основную БД и на время закрепляют чтения пользователя
+    за основной БД: отметкой в процессе и cookie WRITE_COOKIE.
+    Сессию закрывает RequestScopeMiddleware"""
+    request_scope: RequestScope = request.state.request_scope
+    if request_scope.session is None:
+        router = get_session_router()
+        api_key = request.headers.get("api-key")
+        if request.method in ("GET", "HEAD"):
+            request_scope.session = router.for_read(
+                api_key, last_write(request)
+            )()
+        else:
+            request_scope.session = router.for_write()()
+            request_scope.call_on_close(partial(router.mark_write, api_key))
+            if router.replicas:
+                # Время округляется вниз: округлённое вверх оказалось бы
+                # в будущем, и router.is_recent его не учёл бы
+                written = math.floor(time.time() * 1000) / 1000
+                request_scope.response_headers.append(
+                    (
+                        "Set-Cookie",
+                        f"{WRITE_COOKIE}={written:.3f}; "
+                        f"Max-Age={math.ceil(router.sticky_seconds)}; "
+                        "Path=/; HttpOnly; SameSite=Lax",
+                    )
+                )
+    return request_scope.session
+
+
+async def get_session_maker():
+    """Фабрика сессий для фоновых задач, которые выполняются
+    после закрытия сессии запроса"""
+    return get_db_session()
+
+
+@lru_cache
+def get_auth_cache() -> ApiKeyCache:
+    from ..settings import AUTH_CACHE_SIZE, AUTH_CACHE_TTL
+
+    return ApiKeyCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+
 
-        # with session.begin():
-        yield session
-    # print("close_session")
-    finally:
-        await session.close()
+@lru_cache
+def get_cache_backend() -> Optional[CacheBackend]:
+    """Кэш отрендеренных лент и профилей, None - кэш выключен"""
+    from ..settings import CACHE_SIZE, CACHE_URL
+
+    return make_cache_backend(CACHE_URL, CACHE_SIZE)
+
+
+@lru_cache
+def get_query_metrics() -> QueryMetrics:
+    return QueryMetrics()
+
+
+@lru_cache
+def get_metrics() -> Metrics:
+    return Metrics()
+
+
+@lru_cache
+def get_like_counter() -> LikeCounter:
+    from ..settings import LIKE_FLUSH_INTERVAL_MS
+
+    return LikeCounter(interval=LIKE_FLUSH_INTERVAL_MS / 1000)
 
 
 async def get_user(
@@ -25,12 +104,22 @@ async def get_user(
         str, Header(..., description="api-key for user authentication")
     ],
     session: Annotated[AsyncSession, Depends(get_session)],
-):
-
+) -> schemas.User:
+    """Аутентифицирует пользователя по api-key. Возвращает только id и имя,
+    найденные пользователи кэшируются в памяти процесса на AUTH_CACHE_TTL"""
+    auth_cache = get_auth_cache()
+    user = auth_cache.get(api_key)
+    get_metrics().cache_lookup("auth", user is not None)
+    if user is not None:
+        return user
     try:
-        user = await crud.get_one(models.User, session, api_key=api_key)
+        found_user = await crud.get_user_by_api_key(
+            api_key, session, options=loaders.AUTH
+        )
     except crud.CRUDException:
         raise HTTPException(status_code=401, detail="Wrong api-key")
+    user = schemas.User.model_validate(found_user)
+    auth_cache.set(api_key, user)
     return user
 
 
@@ -41,5 +130,6 @@ async def get_static_image_path():
 
 
 Session = Annotated[AsyncSession, Depends(get_session)]
-User = Annotated[models.User, Depends(get_user)]
+Session_maker = Annotated[sessionmaker, Depends(get_session_maker)]
+User = Annotated[schemas.User, Depends(get_user)]
 Static_image_path = Annotated[str, Depends(get_static_image_path)]
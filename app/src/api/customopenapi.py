@@ -1,6 +1,14 @@
+import hashlib
+import json
+import logging
+from pathlib import Path
+from typing import Optional
+
+import fastapi
+import pydantic
 from fastapi.openapi.utils import get_openapi
 
-from ..settings import API_ROUTE
+from ..settings import API_ROUTE, OPENAPI_SCHEMA_PATH, Settings
 
 title = "Twitter-clone API"
 description = "API for twitter-clone"
@@ -53,9 +61,7 @@ def add_api_prefix(openapi_schema, prefix):
     openapi_schema["paths"] = new_paths
 
 
-def custom_openapi(app):
-    if app.openapi_schema:
-        return app.openapi_schema
+def build_openapi(app) -> dict:
     openapi_schema = get_openapi(
         title=title,
         version=version,
@@ -79,5 +85,68 @@ def custom_openapi(app):
     # openapi_schema["info"]["x-logo"] = {
     #     "url": "https://fastapi.tiangolo.com/img/logo-margin/logo-teal.png"
     # }
+    return openapi_schema
+
+
+def openapi_fingerprint(app) -> str:
+    """Хэш всего, от чего зависит схема: маршрутов, исходного кода
+    пакета приложения (обработчики, схемы запросов и ответов,
+    зависимости), настроек (кроме доступа к БД) и версий FastAPI
+    и pydantic. Считается за миллисекунды, без построения схемы"""
+    digest = hashlib.blake2b(digest_size=16)
+    for route in app.routes:
+        endpoint = getattr(route, "endpoint", None)
+        methods = sorted(getattr(route, "methods", None) or ())
+        name = getattr(endpoint, "__qualname__", None)
+        digest.update(repr((route.path, methods, name)).encode())
+    # Все файлы пакета на диске, а не загруженные модули: набор модулей
+    # зависит от ленивых импортов и отличался бы между процессами
+    package = Path(__file__).resolve().parents[1]
+    for module_file in sorted(package.rglob("*.py")):
+        digest.update(str(module_file.relative_to(package)).encode())
+        digest.update(module_file.read_bytes())
+    settings = {
+        key: value
+        for key, value in Settings.items()
+        if not key.startswith("database")
+    }
+    digest.update(json.dumps(settings, sort_keys=True, default=str).encode())
+    digest.update(fastapi.__version__.encode())
+    digest.update(pydantic.__version__.encode())
+    return digest.hexdigest()
+
+
+def save_openapi(app, path: str) -> dict:
+    """Строит схему и сохраняет её с отпечатком в файл path"""
+    openapi_schema = build_openapi(app)
+    document = {
+        "fingerprint": openapi_fingerprint(app),
+        "schema": openapi_schema,
+    }
+    Path(path).write_text(json.dumps(document))
+    return openapi_schema
+
+
+def load_openapi(app, path: str) -> Optional[dict]:
+    """Схема из файла path, если он есть и построен для этого же кода
+    и настроек, иначе None"""
+    try:
+        document = json.loads(Path(path).read_text())
+    except (OSError, ValueError):
+        return None
+    if document.get("fingerprint") != openapi_fingerprint(app):
+        logging.warning("OpenAPI schema %s is outdated, rebuilding", path)
+        return None
+    return document["schema"]
+
+
+def custom_openapi(app):
+    if app.openapi_schema:
+        return app.openapi_schema
+    openapi_schema = None
+    if OPENAPI_SCHEMA_PATH:
+        openapi_schema = load_openapi(app, OPENAPI_SCHEMA_PATH)
+    if openapi_schema is None:
+        openapi_schema = build_openapi(app)
     app.openapi_schema = openapi_schema
     return app.openapi_schema
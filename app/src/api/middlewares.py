@@ -0,0 +1,227 @@
+import logging
+import time
+from typing import Callable, Container, Dict, List, Optional, Tuple
+
+from fastapi import status
+from fastapi.responses import JSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.datastructures import MutableHeaders
+
+from ..db.instrumentation import QueryMetrics, QueryStats, track_queries
+from ..services.metrics import Metrics
+from . import schemas
+
+
+class RequestScope:
+    """Состояние одного запроса: сессия БД, которая создаётся при первом
+    обращении (см. app_depends.get_session), время начала запроса,
+    запросы к БД и заголовки, которые добавляются к любому ответу"""
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.session: Optional[AsyncSession] = None
+        self.queries = QueryStats()
+        self.response_headers: List[Tuple[str, str]] = []
+        self._on_close: List[Callable[[], None]] = []
+
+    @property
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def call_on_close(self, callback: Callable[[], None]) -> None:
+        self._on_close.append(callback)
+
+    async def close(self) -> None:
+        session, self.session = self.session, None
+        callbacks, self._on_close = self._on_close, []
+        if session is not None:
+            await session.close()
+        for callback in callbacks:
+            callback()
+
+
+class RequestScopeMiddleware:
+    """ASGI middleware: создаёт RequestScope запроса в scope["state"]
+    (доступен как request.state.request_scope), добавляет к ответу
+    заголовок Server-Timing со временем обработки и закрывает сессию
+    перед отправкой последней части тела ответа. В отличие от
+    @app.middleware("http") не создаёт задачу и поток для тела ответа.
+
+    Запросы к БД учитываются в request_scope.queries и после ответа
+    добавляются к query_metrics по маршруту. С debug_headers число
+    запросов, строк и время в БД отдаются в заголовках X-DB-Queries,
+    X-DB-Rows и Server-Timing (db). Запросы, повторённые
+    repeated_query_threshold раз (N+1), пишутся в лог, 0 - не проверять.
+    В metrics записываются число запросов по маршрутам и кодам ответа,
+    время до отправки ответа и запросы в обработке"""
+
+    def __init__(
+        self,
+        app,
+        debug_headers: bool = False,
+        query_metrics: Optional[QueryMetrics] = None,
+        repeated_query_threshold: int = 0,
+        metrics: Optional[Metrics] = None,
+    ) -> None:
+        self.app = app
+        self.debug_headers = debug_headers
+        self.query_metrics = query_metrics
+        self.repeated_query_threshold = repeated_query_threshold
+        self.metrics = metrics
+        self._route_paths: Dict[Callable, str] = {}
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request_scope = RequestScope()
+        scope.setdefault("state", {})["request_scope"] = request_scope
+        queries = request_scope.queries
+        # Код и время ответа; 500, если ответ не был отправлен
+        response_status = 500
+        duration: Optional[float] = None
+
+        async def send_wrapper(message) -> None:
+            nonlocal response_status, duration
+            last_body = False
+            if message["type"] == "http.response.start":
+                response_status = message["status"]
+                headers = MutableHeaders(scope=message)
+                for name, value in request_scope.response_headers:
+                    headers.append(name, value)
+                headers.append(
+                    "Server-Timing", f"app;dur={request_scope.elapsed_ms:.1f}"
+                )
+                if self.debug_headers:
+                    headers.append("X-DB-Queries", str(queries.queries))
+                    headers.append("X-DB-Rows", str(queries.rows))
+                    headers.append(
+                        "Server-Timing", f"db;dur={queries.duration_ms:.1f}"
+                    )
+            elif message["type"] == "http.response.body":
+                last_body = not message.get("more_body", False)
+                if last_body:
+                    await request_scope.close()
+            await send(message)
+            if last_body:
+                duration = time.perf_counter() - request_scope.started
+
+        if self.metrics is not None:
+            self.metrics.request_started()
+        try:
+            with track_queries(queries):
+                await self.app(scope, receive, send_wrapper)
+        finally:
+            await request_scope.close()
+            if duration is None:
+                duration = time.perf_counter() - request_scope.started
+            self.observe(scope, queries, response_status, duration)
+
+    def route_path(self, scope) -> str:
+        """Шаблон пути маршрута, например /users/{id}"""
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "<unmatched>"
+        path = self._route_paths.get(endpoint)
+        if path is None:
+            path = next(
+                (
+                    route.path
+                    for route in scope["app"].router.routes
+                    if getattr(route, "endpoint", None) is endpoint
+                ),
+                endpoint.__name__,
+            )
+            self._route_paths[endpoint] = path
+        return path
+
+    def observe(
+        self, scope, queries: QueryStats, status: int, duration: float
+    ) -> None:
+        path = self.route_path(scope)
+        if self.metrics is not None:
+            self.metrics.request_finished(
+                scope["method"], path, status, duration
+            )
+        if self.query_metrics is None and not self.repeated_query_threshold:
+            return
+        route = f"{scope['method']} {path}"
+        if self.query_metrics is not None:
+            self.query_metrics.observe(route, queries)
+        if self.repeated_query_threshold:
+            for statement, count in queries.repeated(
+                self.repeated_query_threshold
+            ):
+                logging.warning(
+                    "Possible N+1 in %s: query executed %s times: %s",
+                    route,
+                    count,
+                    statement,
+                )
+
+
+class ContentLengthLimitMiddleware:
+    """ASGI middleware: отклоняет запросы к paths больше max_size байт.
+    Запрос с заголовком Content-Length больше max_size отклоняется до
+    чтения тела. Тело без заголовка (chunked) считается по мере чтения:
+    как только прочитано больше max_size, клиенту отправляется 413,
+    а приложение получает http.disconnect и дальше не читает"""
+
+    def __init__(self, app, max_size: int, paths: Container[str]) -> None:
+        self.app = app
+        self.max_size = max_size
+        self.paths = paths
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                if value.isdigit() and int(value) > self.max_size:
+                    response = self.too_large()
+                    await response(scope, receive, send)
+                    return
+                break
+        received = 0
+        started = rejected = False
+
+        async def receive_limited():
+            nonlocal received, rejected
+            if rejected:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_size:
+                    rejected = True
+                    if not started:
+                        await self.too_large()(scope, receive, send)
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def send_unless_rejected(message) -> None:
+            nonlocal started
+            if rejected:
+                return
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive_limited, send_unless_rejected)
+        except Exception:
+            # Ответ 413 уже отправлен, ошибка чтения тела в приложении
+            # (ClientDisconnect) ожидаема
+            if not rejected:
+                raise
+
+    def too_large(self) -> JSONResponse:
+        answer = schemas.Error(
+            result=False,
+            error_type="FileTooLarge",
+            error_message=f"Request is larger than {self.max_size} bytes",
+        )
+        return JSONResponse(
+            answer.model_dump(), status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+        )
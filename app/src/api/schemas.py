@@ -1,4 +1,4 @@
-from typing import Annotated, List
+from typing import Annotated, List, Optional
 
 from fastapi import Body, File, UploadFile, status
 from pydantic import BaseModel, ConfigDict
@@ -40,8 +40,18 @@ class MediaID(BaseModel):
 class UserExtensive(User):
     """Extensive information about the user"""
 
-    followers: List["User"] = Body([], description="User's followers list")
-    following: List["User"] = Body([], description="User's following list")
+    followers: List["User"] = Body(
+        [], description="Latest followers, see /users/{id}/followers"
+    )
+    following: List["User"] = Body(
+        [], description="Latest followings, see /users/{id}/following"
+    )
+    followers_count: Optional[int] = Body(
+        None, ge=0, description="Number of user's followers"
+    )
+    following_count: Optional[int] = Body(
+        None, ge=0, description="Number of users the user follows"
+    )
 
 
 class Result(BaseModel):
@@ -104,6 +114,20 @@ class TweetsResult(Result):
     """Tweets list"""
 
     tweets: List["Tweet"] = Body([], description="Tweets list")
+    next_cursor: Optional[str] = Body(
+        None,
+        description="Cursor of the next page. Absent on the last page",
+    )
+
+
+class UsersResult(Result):
+    """Users list"""
+
+    users: List["User"] = Body([], description="Users list")
+    next_cursor: Optional[str] = Body(
+        None,
+        description="Cursor of the next page. Absent on the last page",
+    )
 
 
 class User_v2(BaseModel):
@@ -124,6 +148,21 @@ class User_v2(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
+class Media(BaseModel):
+    """Media file with its resized variants"""
+
+    id: int = Body(..., ge=1, description="Media file's identifier")
+    path: str = Body(..., description="Original media file")
+    status: str = Body(
+        ...,
+        description="Variants processing status",
+        examples=["pending", "processing", "ready", "failed"],
+    )
+    thumb_path: Optional[str] = Body(None, description="Thumbnail variant")
+    medium_path: Optional[str] = Body(None, description="Medium variant")
+    model_config = ConfigDict(from_attributes=True)
+
+
 class Tweet(BaseModel):
     """Information about the tweet"""
 
@@ -145,9 +184,17 @@ class Tweet(BaseModel):
         description="list of links to media files",
         examples=[["/static/1/some image.jpg"]],
     )
+    media: List["Media"] = Body(
+        [],
+        validation_alias="images",
+        description="Media files with thumbnail and medium variants",
+    )
     author: "User" = Body(..., description="Author of tweet")
+    like_count: int = Body(
+        0, ge=0, description="Number of likes, updated in batches"
+    )
     likes: List["User_v2"] = Body(
-        [], description="List of users who liked the tweet"
+        [], description="Latest users who liked the tweet"
     )
     model_config = ConfigDict(from_attributes=True)
 
@@ -1,10 +1,40 @@
-from typing import Union, Type
+import re
+from typing import Dict, List, NamedTuple, Optional, Sequence, Type, Union
 
-from sqlalchemy import select, ScalarResult
+from sqlalchemy import (
+    Float,
+    Insert,
+    Integer,
+    Select,
+    String,
+    bindparam,
+    case,
+    cast,
+    column,
+    func,
+    literal,
+    literal_column,
+    delete as sql_delete,
+    insert as sql_insert,
+    select,
+    table,
+    true,
+    union,
+    update,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Row
 from sqlalchemy.exc import MultipleResultsFound
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
 
 from . import models
+from .functions import (
+    as_json,
+    build_json_object,
+    json_array_agg,
+    json_strip_nulls,
+)
 
 Model = Union[
     models.Follower,
@@ -45,9 +75,12 @@ async def get_by_id(
     return instance
 
 
-async def get_one(model: ModelType, session: AsyncSession, **kwargs) -> Model:
+async def get_one(
+    model: ModelType, session: AsyncSession, options: Sequence = (), **kwargs
+) -> Model:
     """Получает объект из БД по его уникальному набору полей,
-    если объект не найдет или подходящих объектов больше вызывает ошибку"""
+    если объект не найдет или подходящих объектов больше вызывает ошибку.
+    options - профиль загрузки связей из loaders"""
     fields = {c.name: c for c in model.__table__.columns}
     search_kwargs = {}
     for k, v in kwargs.items():
@@ -56,7 +89,9 @@ async def get_one(model: ModelType, session: AsyncSession, **kwargs) -> Model:
         else:
             raise CRUDException(f"{model.__name__} has not column {k}")
     instance = await session.scalars(
-        select(model).where(*(k == v for k, v in search_kwargs.items()))
+        select(model)
+        .options(*options)
+        .where(*(k == v for k, v in search_kwargs.items()))
     )
     try:
         one_instance: Model = instance.unique().one_or_none()
@@ -74,25 +109,706 @@ async def get_one(model: ModelType, session: AsyncSession, **kwargs) -> Model:
     return one_instance
 
 
+def insert(model: ModelType, session: AsyncSession) -> Insert:
+    """INSERT диалекта сессии, для PostgreSQL и SQLite
+    с поддержкой ON CONFLICT"""
+    dialect = session.bind.dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(model)
+    if dialect == "sqlite":
+        return sqlite.insert(model)
+    return sql_insert(model)
+
+
+async def get_or_create_image(
+    path: str, file_hash: str, session: AsyncSession
+) -> Row:
+    """Возвращает (id, path) изображения с данным hash, создавая запись
+    только если такого изображения ещё нет. Путь существующей записи
+    может отличаться от path (файлы, сохранённые до определения
+    расширения по содержимому)"""
+    result = await session.execute(
+        insert(models.Image, session)
+        .values(path=path, hash=file_hash)
+        .on_conflict_do_nothing(index_elements=[models.Image.hash])
+        .returning(models.Image.id, models.Image.path)
+    )
+    image = result.one_or_none()
+    if image is None:
+        result = await session.execute(
+            select(models.Image.id, models.Image.path).where(
+                models.Image.hash == file_hash
+            )
+        )
+        image = result.one()
+    return image
+
+
+async def add_like(
+    tweet_id: int, user_id: int, session: AsyncSession
+) -> Optional[int]:
+    """Ставит лайк одним запросом INSERT ... SELECT ... ON CONFLICT DO
+    NOTHING RETURNING, без гонки между проверкой и вставкой. Возвращает
+    id лайка или None, если лайк уже есть. Если твита нет, вызывает
+    исключение"""
+    like_id = await session.scalar(
+        insert(models.Like, session)
+        .from_select(
+            ["tweet_id", "user_id"],
+            select(models.Tweet.id, literal(user_id, Integer)).where(
+                models.Tweet.id == tweet_id
+            ),
+        )
+        .on_conflict_do_nothing(
+            index_elements=[models.Like.tweet_id, models.Like.user_id]
+        )
+        .returning(models.Like.id)
+    )
+    if like_id is None:
+        await _check_exists(models.Tweet, tweet_id, session)
+    return like_id
+
+
+async def add_follower(
+    user_id: int, following_id: int, session: AsyncSession
+) -> Optional[int]:
+    """Подписывает user_id на following_id одним запросом, аналогично
+    add_like. Возвращает id подписки или None, если она уже есть.
+    Если пользователя following_id нет, вызывает исключение"""
+    follower_id = await session.scalar(
+        insert(models.Follower, session)
+        .from_select(
+            ["user_id", "following_id"],
+            select(literal(user_id, Integer), models.User.id).where(
+                models.User.id == following_id
+            ),
+        )
+        .on_conflict_do_nothing(
+            index_elements=[
+                models.Follower.user_id,
+                models.Follower.following_id,
+            ]
+        )
+        .returning(models.Follower.id)
+    )
+    if follower_id is None:
+        await _check_exists(models.User, following_id, session)
+    return follower_id
+
+
+async def _check_exists(
+    model: ModelType, instance_id: int, session: AsyncSession
+) -> None:
+    """Отличает отсутствующую цель от дубликата только после
+    неудачной вставки, чтобы не тратить запрос на основном пути"""
+    exists = await session.scalar(
+        select(model.id).where(model.id == instance_id)
+    )
+    if exists is None:
+        raise InstanceNotExists(f"{model.__name__} does not exists")
+
+
+async def get_user_by_api_key(
+    api_key: str, session: AsyncSession, options: Sequence = ()
+) -> models.User:
+    """Получает пользователя по api-key, если пользователь не найден
+    вызывает исключение"""
+    user = await session.scalar(
+        select(models.User)
+        .options(*options)
+        .where(models.User.api_key == api_key)
+    )
+    if user is None:
+        raise InstanceNotExists("User does not exists")
+    return user
+
+
+def is_ascending(
+    before_id: Optional[int] = None, after_id: Optional[int] = None
+) -> bool:
+    """Страница после after_id выбирается по возрастанию ключа"""
+    return after_id is not None and before_id is None
+
+
+def keyset(
+    stmt: Select,
+    column,
+    limit: int,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    ascending: Optional[bool] = None,
+) -> Select:
+    """Добавляет к запросу keyset-условие и порядок по column. Если задан
+    только after_id, порядок возрастающий, иначе убывающий"""
+    if before_id is not None:
+        stmt = stmt.where(column < before_id)
+    if after_id is not None:
+        stmt = stmt.where(column > after_id)
+    if ascending is None:
+        ascending = is_ascending(before_id, after_id)
+    order = column.asc() if ascending else column.desc()
+    return stmt.order_by(order).limit(limit)
+
+
+def stmt_authors_tweet_ids(
+    authors: Select,
+    dialect: str,
+    limit: int,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+) -> Select:
+    """Запрос id твитов авторов из authors (колонка author_id).
+    В PostgreSQL для каждого автора берётся не больше limit твитов
+    по индексу (author_id, id DESC) через LATERAL, поэтому стоимость
+    страницы не зависит от числа твитов и глубины прокрутки"""
+    if dialect != "postgresql":
+        return keyset(
+            models.Tweet.stmt_get_tweets(authors),
+            models.Tweet.id,
+            limit,
+            before_id,
+            after_id,
+        )
+    authors = authors.subquery("authors")
+    author_tweets = keyset(
+        select(models.Tweet.id).where(
+            models.Tweet.author_id == authors.c.author_id
+        ),
+        models.Tweet.id,
+        limit,
+        before_id,
+        after_id,
+    ).lateral("author_tweets")
+    return keyset(
+        select(author_tweets.c.id)
+        .select_from(authors)
+        .join(author_tweets, true()),
+        author_tweets.c.id,
+        limit,
+        ascending=is_ascending(before_id, after_id),
+    )
+
+
+def stmt_feed_ids(
+    user_id: int,
+    dialect: str,
+    limit: int,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    mode: str = "pull",
+) -> Select:
+    """Запрос id твитов страницы ленты пользователя.
+    pull - твиты пользователя и его подписок выбираются при чтении;
+    push - лента читается из timeline_entries одним диапазоном индекса;
+    hybrid - timeline_entries плюс твиты популярных авторов при чтении"""
+    if mode == "pull":
+        return stmt_authors_tweet_ids(
+            models.Follower.stmt_feed_authors(user_id),
+            dialect,
+            limit,
+            before_id,
+            after_id,
+        )
+    timeline = keyset(
+        select(models.TimelineEntry.tweet_id.label("id")).where(
+            models.TimelineEntry.user_id == user_id
+        ),
+        models.TimelineEntry.tweet_id,
+        limit,
+        before_id,
+        after_id,
+    )
+    if mode == "push":
+        return timeline
+    popular = stmt_authors_tweet_ids(
+        models.Follower.stmt_popular_following(user_id),
+        dialect,
+        limit,
+        before_id,
+        after_id,
+    )
+    feed = union(
+        select(timeline.subquery().c.id), select(popular.subquery().c.id)
+    ).subquery("feed")
+    return keyset(
+        select(feed.c.id),
+        feed.c.id,
+        limit,
+        ascending=is_ascending(before_id, after_id),
+    )
+
+
 async def get_following_tweets(
-    user: models.User, session: AsyncSession
-) -> ScalarResult[models.Tweet]:
-    """Получает ленту твитов"""
-    following_id = [following.id for following in user.following]
-    following_id.append(user.id)
-    stmt = select(models.Tweet).distinct().order_by(models.Tweet.id.desc())
-    return await session.scalars(stmt)
+    user_id: int,
+    session: AsyncSession,
+    limit: int,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    mode: str = "pull",
+    options: Sequence = (),
+) -> List[models.Tweet]:
+    """Получает страницу ленты твитов пользователя и его подписок.
+    Твиты возвращаются от новых к старым. Если задан только after_id,
+    выбираются ближайшие к нему более новые твиты"""
+    ids = stmt_feed_ids(
+        user_id, session.bind.dialect.name, limit, before_id, after_id, mode
+    )
+    stmt = (
+        select(models.Tweet)
+        .options(*options)
+        .where(models.Tweet.id.in_(ids))
+        .order_by(models.Tweet.id.desc())
+    )
+    tweets = await session.scalars(stmt)
+    return list(tweets.unique())
 
 
-async def delete_tweet(
-    tweet_id: int, user: models.User, session: AsyncSession
+async def add_like_counts(
+    deltas: Dict[int, int], session: AsyncSession
+) -> None:
+    """Прибавляет к like_count твитов накопленные изменения одним
+    executemany, в порядке id, чтобы параллельные сбросы не взаимно
+    блокировались. Счётчик не опускается ниже нуля: снятие лайка,
+    поставленного до появления столбца, не делает его отрицательным,
+    если столбец не пересчитан (models.COLUMN_BACKFILL). Версии авторов
+    растут и при нулевом изменении: список лайкнувших в ленте всё равно
+    мог поменяться"""
+    if not deltas:
+        return
+    params = [
+        {"tweet_id": tweet_id, "delta": delta}
+        for tweet_id, delta in sorted(deltas.items())
+        if delta
+    ]
+    table = models.Tweet.__table__
+    like_count = table.c.like_count + bindparam("delta", type_=Integer)
+    if params:
+        await session.execute(
+            update(table)
+            .where(table.c.id == bindparam("tweet_id"))
+            .values(like_count=case((like_count < 0, 0), else_=like_count)),
+            params,
+        )
+    await bump_versions(
+        select(models.Tweet.author_id).where(
+            models.Tweet.id.in_(sorted(deltas))
+        ),
+        session,
+    )
+
+
+async def bump_versions(
+    user_ids: Union[Sequence[int], Select], session: AsyncSession
 ) -> None:
-    """Удаляет твит по id, если user не является author
-    то вызывает исключение"""
-    tweet: models.Tweet = await get_by_id(models.Tweet, tweet_id, session)
-    if not tweet:
-        raise InstanceNotExists("Tweet does not exists")
-    if user == tweet.author:
-        await delete(tweet, session)
+    """Увеличивает версии пользователей, чтобы ETag их профилей и лент,
+    в которые попадают их твиты, изменились. Вызывается в транзакции
+    изменения"""
+    if isinstance(user_ids, Sequence):
+        user_ids = sorted(set(user_ids))
+    await session.execute(
+        update(models.User)
+        .where(models.User.id.in_(user_ids))
+        .values(version=models.User.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def get_feed_version(user_id: int, session: AsyncSession) -> Row:
+    """Версия ленты пользователя: (число авторов, сумма их версий,
+    версия самого пользователя) по нему и его подпискам. Меняется при
+    любом изменении твитов, лайков и подписок авторов ленты и дешевле
+    сборки самой ленты. Сумма растёт, пока набор авторов не меняется,
+    а набор меняется только подпиской или отпиской, которые увеличивают
+    версию пользователя. Поэтому она - отдельная часть, иначе замена
+    одной подписки на другую может дать прежнюю сумму"""
+    result = await session.execute(
+        select(
+            func.count(),
+            func.coalesce(func.sum(models.User.version), 0),
+            func.max(case((models.User.id == user_id, models.User.version))),
+        ).where(models.User.id.in_(models.Follower.stmt_feed_authors(user_id)))
+    )
+    return result.one()
+
+
+async def get_user_version(user_id: int, session: AsyncSession) -> int:
+    """Версия профиля пользователя, если пользователь не найден
+    вызывает исключение"""
+    version = await session.scalar(
+        select(models.User.version).where(models.User.id == user_id)
+    )
+    if version is None:
+        raise InstanceNotExists("User does not exists")
+    return version
+
+
+async def get_user_counts(user_id: int, session: AsyncSession) -> Row:
+    """Получает (id, name, followers_count, following_count) пользователя,
+    если пользователь не найден вызывает исключение"""
+    followers_count = (
+        select(func.count())
+        .where(models.Follower.following_id == models.User.id)
+        .scalar_subquery()
+    )
+    following_count = (
+        select(func.count())
+        .where(models.Follower.user_id == models.User.id)
+        .scalar_subquery()
+    )
+    result = await session.execute(
+        select(
+            models.User.id,
+            models.User.name,
+            followers_count.label("followers_count"),
+            following_count.label("following_count"),
+        ).where(models.User.id == user_id)
+    )
+    user = result.one_or_none()
+    if user is None:
+        raise InstanceNotExists("User does not exists")
+    return user
+
+
+async def get_follows(
+    user_id: int,
+    session: AsyncSession,
+    followers: bool,
+    limit: int,
+    before_id: Optional[int] = None,
+) -> List[Row]:
+    """Страница подписчиков (followers=True) или подписок пользователя,
+    от новых подписок к старым. Строки (id, name, follow_id), где
+    follow_id - ключ пагинации"""
+    if followers:
+        user_column = models.Follower.user_id
+        owner_column = models.Follower.following_id
+    else:
+        user_column = models.Follower.following_id
+        owner_column = models.Follower.user_id
+    stmt = keyset(
+        select(
+            models.User.id,
+            models.User.name,
+            models.Follower.id.label("follow_id"),
+        )
+        .join(models.Follower, user_column == models.User.id)
+        .where(owner_column == user_id),
+        models.Follower.id,
+        limit,
+        before_id,
+    )
+    result = await session.execute(stmt)
+    return list(result.all())
+
+
+def stmt_documents(likers: int) -> Select:
+    """Запрос пар (id, JSON-документ твита в формате schemas.Tweet)
+    без условий и порядка. Документ собирается в БД только из нужных
+    столбцов и возвращается текстом, без разбора. Из лайкнувших
+    выбираются последние likers пользователей"""
+    author = aliased(models.User)
+    last_likes = (
+        select(models.Like.user_id, models.User.name)
+        .join(models.User, models.User.id == models.Like.user_id)
+        .where(models.Like.tweet_id == models.Tweet.id)
+        .order_by(models.Like.id.desc())
+        .limit(likers)
+        .correlate(models.Tweet)
+        .subquery()
+    )
+    likes = select(
+        json_array_agg(
+            build_json_object(
+                user_id=last_likes.c.user_id, name=last_likes.c.name
+            )
+        )
+    ).scalar_subquery()
+    images = (
+        select(models.TweetsImage)
+        .join(models.Image, models.Image.id == models.TweetsImage.image_id)
+        .where(models.TweetsImage.tweet_id == models.Tweet.id)
+        .correlate(models.Tweet)
+    )
+    attachments = images.with_only_columns(
+        json_array_agg(models.Image.path), maintain_column_froms=False
+    ).scalar_subquery()
+    media = images.with_only_columns(
+        json_array_agg(
+            json_strip_nulls(
+                build_json_object(
+                    id=models.Image.id,
+                    path=models.Image.path,
+                    status=models.Image.status,
+                    thumb_path=models.Image.thumb_path,
+                    medium_path=models.Image.medium_path,
+                )
+            )
+        ),
+        maintain_column_froms=False,
+    ).scalar_subquery()
+    document = build_json_object(
+        id=models.Tweet.id,
+        content=models.Tweet.content,
+        attachments=as_json(attachments),
+        media=as_json(media),
+        author=build_json_object(id=author.id, name=author.name),
+        like_count=models.Tweet.like_count,
+        likes=as_json(likes),
+    )
+    return select(
+        models.Tweet.id, cast(document, String).label("document")
+    ).join(author, author.id == models.Tweet.author_id)
+
+
+def stmt_tweet_documents(ids: Select, likers: int) -> Select:
+    """Запрос пар (id, документ) для твитов из ids, от новых к старым,
+    см. stmt_documents"""
+    return (
+        stmt_documents(likers)
+        .where(models.Tweet.id.in_(ids))
+        .order_by(models.Tweet.id.desc())
+    )
+
+
+async def get_following_tweet_documents(
+    user_id: int,
+    session: AsyncSession,
+    limit: int,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    mode: str = "pull",
+    likers: int = 10,
+) -> List[Row]:
+    """То же, что get_following_tweets, но без ORM: возвращает строки
+    (id, document) с готовым JSON каждого твита"""
+    ids = stmt_feed_ids(
+        user_id, session.bind.dialect.name, limit, before_id, after_id, mode
+    )
+    result = await session.execute(stmt_tweet_documents(ids, likers))
+    return list(result.all())
+
+
+def fts5_query(query: str) -> str:
+    """Запрос FTS5 из слов строки поиска: каждое слово в кавычках,
+    чтобы операторы и спецсимволы FTS5 не разбирались. Слова
+    объединяются через AND, как в websearch_to_tsquery PostgreSQL"""
+    return " ".join(f'"{word}"' for word in re.findall(r"\w+", query))
+
+
+class SearchResult(NamedTuple):
+    id: int
+    # JSON-документ твита в формате schemas.Tweet
+    document: str
+    score: float
+    # наибольший id твитов, среди которых выполнялся поиск
+    upto: int
+
+
+def stmt_search_candidates(
+    query: str, dialect: str, candidates: int, upto: int, low: int = 0
+) -> Select:
+    """Запрос (id, score) не больше candidates самых новых твитов
+    с id больше low и не больше upto, подходящих под query. Чем больше
+    score, тем лучше совпадение"""
+    if dialect == "sqlite":
+        fts = table("tweets_fts", column("rowid", Integer))
+        stmt = select(
+            fts.c.rowid.label("id"),
+            (-func.bm25(literal_column("tweets_fts"), type_=Float)).label(
+                "score"
+            ),
+        ).where(literal_column("tweets_fts").op("MATCH")(fts5_query(query)))
+        tweet_id = fts.c.rowid
     else:
+        search_vector = literal_column("tweets.search_vector")
+        tsquery = func.websearch_to_tsquery(
+            literal_column("'simple'::regconfig"), query
+        )
+        stmt = select(
+            models.Tweet.id,
+            func.ts_rank(search_vector, tsquery, type_=Float).label("score"),
+        ).where(search_vector.op("@@")(tsquery))
+        tweet_id = models.Tweet.id
+    return (
+        stmt.where(tweet_id > low, tweet_id <= upto)
+        .order_by(tweet_id.desc())
+        .limit(candidates)
+    )
+
+
+def stmt_set_local(**settings: str) -> Select:
+    """Запрос, меняющий настройки PostgreSQL до конца транзакции"""
+    return select(
+        *(
+            func.set_config(name, value, true())
+            for name, value in settings.items()
+        )
+    )
+
+
+async def search_candidates(
+    query: str, session: AsyncSession, candidates: int, window: int, upto: int
+) -> List[Row]:
+    """Строки (id, score) не больше candidates самых новых твитов с id
+    не больше upto, подходящих под query. Совпадения собираются окнами id
+    от новых к старым, стоимость каждого запроса ограничена его окном,
+    а не числом подходящих твитов. Первое окно размером window
+    планировщик обходит как угодно: частые слова быстрее найти обходом
+    первичного ключа. Если окно не дало нужного числа совпадений, слова
+    редкие, и в PostgreSQL дальше используется только GIN-индекс (битовая
+    карта совпадений, пересечённая с диапазоном id окна): оценка
+    селективности нескольких частых слов, редко встречающихся вместе,
+    бывает ошибочна в тысячи раз, и обход первичного ключа по ней читает
+    всю таблицу. По той же причине план строится для каждого запроса
+    заново, а не берётся общий план подготовленного запроса. Размер
+    следующего окна - вдвое больше ожидаемого по уже найденной плотности
+    совпадений, но не больше чем в 16 раз больше предыдущего. В конце
+    настройки планировщика возвращаются к значениям по умолчанию"""
+    dialect = session.bind.dialect.name
+    postgresql = dialect == "postgresql"
+    if postgresql:
+        await session.execute(
+            stmt_set_local(plan_cache_mode="force_custom_plan")
+        )
+    found = []
+    high = upto
+    bitmap_only = False
+    while high > 0 and len(found) < candidates:
+        if postgresql and high < upto and not bitmap_only:
+            await session.execute(
+                stmt_set_local(enable_indexscan="off", enable_seqscan="off")
+            )
+            bitmap_only = True
+        low = max(high - window, 0)
+        result = await session.execute(
+            stmt_search_candidates(
+                query, dialect, candidates - len(found), high, low
+            )
+        )
+        found += result.all()
+        expected = window * 16
+        if found:
+            expected = 2 * (upto - low) * (candidates - len(found))
+            expected //= len(found)
+        window, high = min(max(window, expected), window * 16), low
+    if postgresql:
+        await session.execute(
+            stmt_set_local(
+                plan_cache_mode="auto",
+                enable_indexscan="on",
+                enable_seqscan="on",
+            )
+        )
+    return found
+
+
+async def search_tweet_documents(
+    query: str,
+    session: AsyncSession,
+    limit: int,
+    candidates: int,
+    window: int,
+    upto: Optional[int] = None,
+    after: Optional[Sequence] = None,
+    likers: int = 10,
+) -> List[SearchResult]:
+    """Полнотекстовый поиск твитов от лучших совпадений к худшим,
+    при равном score - от новых к старым. Ранжируются candidates самых
+    новых совпадений с id не больше upto, по умолчанию - наибольшего id
+    твитов (см. search_candidates), поэтому стоимость поиска не зависит
+    от числа подходящих твитов. upto запоминается в курсоре, вместе с ним
+    набор не меняется между страницами. after - пара (score, id)
+    последнего твита предыдущей страницы. ts_rank PostgreSQL зависит
+    только от самого твита, bm25 SQLite - ещё и от статистики всей
+    таблицы, поэтому в SQLite страницы поиска могут сместиться, если
+    между запросами добавлены твиты"""
+    if session.bind.dialect.name == "sqlite" and not fts5_query(query):
+        return []
+    if upto is None:
+        upto = await session.scalar(select(func.max(models.Tweet.id)))
+        if upto is None:
+            return []
+    found = await search_candidates(query, session, candidates, window, upto)
+    ranked = sorted(found, key=lambda row: (row.score, row.id), reverse=True)
+    if after is not None:
+        ranked = [row for row in ranked if (row.score, row.id) < tuple(after)]
+    page = ranked[:limit]
+    if not page:
+        return []
+    result = await session.execute(
+        stmt_documents(likers).where(
+            models.Tweet.id.in_([row.id for row in page])
+        )
+    )
+    documents = dict(result.all())
+    return [
+        SearchResult(row.id, documents[row.id], row.score, upto)
+        for row in page
+        if row.id in documents
+    ]
+
+
+async def delete_tweet(
+    tweet_id: int, user_id: int, session: AsyncSession
+) -> None:
+    """Удаляет твит одним запросом DELETE ... RETURNING, автор
+    проверяется в WHERE, зависимые строки удаляет ON DELETE CASCADE.
+    Если твита нет или пользователь user_id не является автором,
+    вызывает исключение"""
+    deleted = await session.scalar(
+        sql_delete(models.Tweet)
+        .where(models.Tweet.id == tweet_id, models.Tweet.author_id == user_id)
+        .returning(models.Tweet.id)
+    )
+    if deleted is None:
+        await _check_exists(models.Tweet, tweet_id, session)
         raise CRUDException("User is not tweet author")
+
+
+async def delete_like(
+    tweet_id: int, user_id: int, session: AsyncSession
+) -> None:
+    """Снимает лайк одним запросом, если лайка нет вызывает исключение"""
+    deleted = await session.scalar(
+        sql_delete(models.Like)
+        .where(
+            models.Like.tweet_id == tweet_id, models.Like.user_id == user_id
+        )
+        .returning(models.Like.id)
+    )
+    if deleted is None:
+        raise InstanceNotExists("Like does not exists")
+
+
+async def delete_follower(
+    user_id: int, following_id: int, session: AsyncSession
+) -> None:
+    """Отписывает user_id от following_id одним запросом,
+    если подписки нет вызывает исключение"""
+    deleted = await session.scalar(
+        sql_delete(models.Follower)
+        .where(
+            models.Follower.user_id == user_id,
+            models.Follower.following_id == following_id,
+        )
+        .returning(models.Follower.id)
+    )
+    if deleted is None:
+        raise InstanceNotExists("Follower does not exists")
+
+
+async def add_tweet_images(
+    tweet_id: int, image_ids: Sequence[int], session: AsyncSession
+) -> None:
+    """Прикрепляет к твиту изображения одним запросом INSERT ... SELECT,
+    несуществующие id изображений пропускаются"""
+    if not image_ids:
+        return
+    await session.execute(
+        insert(models.TweetsImage, session).from_select(
+            ["tweet_id", "image_id"],
+            select(literal(tweet_id, Integer), models.Image.id).where(
+                models.Image.id.in_(set(image_ids))
+            ),
+        )
+    )
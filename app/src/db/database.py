@@ -1,8 +1,21 @@
+import itertools
 import logging
+import time
 from functools import lru_cache
+from typing import Any, Dict, Hashable, Optional, Sequence, Tuple
 
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy import Engine, event, make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    create_async_engine,
+)
 from sqlalchemy.orm import DeclarativeBase, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, Pool
+
+from ..services.cache import TTLCache
+from .instrumentation import instrument_engine
 
 
 class Base(DeclarativeBase):
@@ -12,12 +25,16 @@ class Base(DeclarativeBase):
 def get_database():
     from ..settings import (
         DATABASE,
+        DATABASE_DSN,
         DATABASE_PASSWORD,
         DATABASE_USER,
         DATABASE_URL,
     )
 
-    if DATABASE and DATABASE_USER and DATABASE_PASSWORD and DATABASE_URL:
+    if DATABASE_DSN:
+        # Полный DSN, например для нагрузочных тестов на отдельной БД
+        database_connection = DATABASE_DSN
+    elif DATABASE and DATABASE_USER and DATABASE_PASSWORD and DATABASE_URL:
         database_connection = (
             f"postgresql+asyncpg://"
             f"{DATABASE_USER}:{DATABASE_PASSWORD}"
@@ -31,10 +48,127 @@ def get_database():
 # DATABASE_URL = f"sqlite+aiosqlite:///test.db"
 
 
+def enable_foreign_keys(engine: Engine) -> None:
+    """SQLite не проверяет внешние ключи и не выполняет ON DELETE CASCADE,
+    пока это не включено для каждого соединения. Удаления полагаются
+    на каскады БД"""
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def foreign_keys_on(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Пул соединений, который считает время получения соединения:
+    ожидание свободного соединения в очереди, открытие нового
+    и pre-ping. Счётчики обновляются без await и блокировок"""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.wait_count = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.timeouts = 0
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except PoolTimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            wait_time = time.perf_counter() - start
+            self.wait_count += 1
+            self.wait_time_total += wait_time
+            self.wait_time_max = max(self.wait_time_max, wait_time)
+
+
+def get_pool_stats(pool: Pool) -> Dict[str, Any]:
+    """Состояние пула: размер, выданные и свободные соединения,
+    переполнение и, для TimedQueuePool, время получения соединения"""
+    stats: Dict[str, Any] = {"pool": pool.__class__.__name__}
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        method = getattr(pool, name, None)
+        if method is not None:
+            stats[name] = method()
+    if isinstance(pool, TimedQueuePool):
+        stats["wait_count"] = pool.wait_count
+        stats["wait_time_total_ms"] = pool.wait_time_total * 1000
+        stats["wait_time_max_ms"] = pool.wait_time_max * 1000
+        stats["wait_time_avg_ms"] = (
+            pool.wait_time_total * 1000 / pool.wait_count
+            if pool.wait_count
+            else 0.0
+        )
+        stats["timeouts"] = pool.timeouts
+    return stats
+
+
+def get_connect_args(
+    dsn: str, prepared_statement_cache_size: int, statement_timeout_ms: int
+) -> Dict[str, Any]:
+    """Параметры соединения asyncpg. statement_timeout задаётся
+    на сервере для каждого соединения, 0 - без ограничения. Другие
+    драйверы (aiosqlite при DATABASE_DSN=sqlite+aiosqlite://...) этих
+    параметров не принимают и получают пустой словарь"""
+    if make_url(dsn).get_driver_name() != "asyncpg":
+        return {}
+    connect_args: Dict[str, Any] = {
+        "prepared_statement_cache_size": prepared_statement_cache_size
+    }
+    if statement_timeout_ms:
+        connect_args["server_settings"] = {
+            "statement_timeout": str(statement_timeout_ms)
+        }
+    return connect_args
+
+
+def make_engine(dsn: str) -> AsyncEngine:
+    """Движок с настройками пула и соединений из settings"""
+    from ..settings import (
+        DB_MAX_OVERFLOW,
+        DB_POOL_PRE_PING,
+        DB_POOL_RECYCLE,
+        DB_POOL_SIZE,
+        DB_POOL_TIMEOUT,
+        DB_PREPARED_STATEMENT_CACHE_SIZE,
+        DB_STATEMENT_TIMEOUT_MS,
+    )
+
+    engine = create_async_engine(
+        dsn,
+        echo=False,
+        poolclass=TimedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        connect_args=get_connect_args(
+            dsn, DB_PREPARED_STATEMENT_CACHE_SIZE, DB_STATEMENT_TIMEOUT_MS
+        ),
+    )
+    enable_foreign_keys(engine.sync_engine)
+    instrument_engine(engine.sync_engine)
+    return engine
+
+
 @lru_cache
 def get_engine():
     logging.warning("get_engine_func_start")
-    return create_async_engine(get_database(), echo=False)
+    return make_engine(get_database())
+
+
+@lru_cache
+def get_replica_engines() -> Tuple[AsyncEngine, ...]:
+    from ..settings import DATABASE_REPLICAS
+
+    return tuple(make_engine(dsn) for dsn in DATABASE_REPLICAS)
 
 
 @lru_cache
@@ -42,3 +176,65 @@ def get_db_session():
     return sessionmaker(
         get_engine(), expire_on_commit=True, class_=AsyncSession
     )
+
+
+class SessionRouter:
+    """Выбирает фабрику сессий запроса: чтение идёт на реплики по кругу,
+    запись - в основную БД. После записи чтения sticky_seconds идут
+    в основную БД, чтобы пользователь видел свои изменения несмотря
+    на отставание реплик. Время последней записи приходит от клиента
+    (last_write, см. app_depends.get_session), поэтому учитывается
+    любым процессом. Отметки по ключу (api-key) в памяти процесса -
+    запасной вариант для клиентов, которые его не возвращают"""
+
+    def __init__(
+        self,
+        primary: sessionmaker,
+        replicas: Sequence[sessionmaker] = (),
+        sticky_seconds: float = 5,
+        sticky_size: int = 100000,
+    ) -> None:
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.sticky_seconds = sticky_seconds
+        self._replicas = itertools.cycle(self.replicas)
+        self._sticky = TTLCache(maxsize=sticky_size, ttl=sticky_seconds)
+
+    def for_read(
+        self,
+        key: Optional[Hashable] = None,
+        last_write: Optional[float] = None,
+    ) -> sessionmaker:
+        if not self.replicas:
+            return self.primary
+        if self.is_recent(last_write):
+            return self.primary
+        if key is not None and self._sticky.get(key):
+            return self.primary
+        return next(self._replicas)
+
+    def for_write(self) -> sessionmaker:
+        return self.primary
+
+    def mark_write(self, key: Optional[Hashable]) -> None:
+        if key is not None:
+            self._sticky.set(key, True)
+
+    def is_recent(self, last_write: Optional[float]) -> bool:
+        """Запись в last_write (unix time) была меньше sticky_seconds
+        назад. Время из будущего не учитывается: значение приходит
+        от клиента и не должно закреплять его за основной БД навсегда"""
+        if last_write is None:
+            return False
+        return 0 <= time.time() - last_write < self.sticky_seconds
+
+
+@lru_cache
+def get_session_router() -> SessionRouter:
+    from ..settings import REPLICA_STICKY_SECONDS
+
+    replicas = [
+        sessionmaker(engine, expire_on_commit=True, class_=AsyncSession)
+        for engine in get_replica_engines()
+    ]
+    return SessionRouter(get_db_session(), replicas, REPLICA_STICKY_SECONDS)
@@ -0,0 +1,88 @@
+"""JSON-функции SQL, которые компилируются под PostgreSQL и SQLite.
+
+Позволяют собрать документ ответа прямо в запросе, минуя ORM
+и валидацию pydantic"""
+
+from sqlalchemy import String, literal_column
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+
+
+class json_object(FunctionElement):
+    """JSON-объект из пар ключ-значение, см. build_json_object"""
+
+    type = String()
+    inherit_cache = True
+
+
+class json_array_agg(FunctionElement):
+    """Агрегирует значения в JSON-массив, для пустой выборки - []"""
+
+    type = String()
+    inherit_cache = True
+
+
+class as_json(FunctionElement):
+    """Помечает текст скалярного подзапроса как JSON, чтобы он
+    вкладывался в json_object как значение, а не как строка"""
+
+    type = String()
+    inherit_cache = True
+
+
+class json_strip_nulls(FunctionElement):
+    """Удаляет из JSON-объекта ключи со значением null"""
+
+    type = String()
+    inherit_cache = True
+
+
+def build_json_object(**fields) -> json_object:
+    args = []
+    for key, value in fields.items():
+        args += [literal_column(f"'{key}'"), value]
+    return json_object(*args)
+
+
+@compiles(json_object)
+def _json_object(element, compiler, **kw):
+    return f"json_object({compiler.process(element.clauses, **kw)})"
+
+
+@compiles(json_object, "postgresql")
+def _json_object_postgresql(element, compiler, **kw):
+    return f"json_build_object({compiler.process(element.clauses, **kw)})"
+
+
+@compiles(json_array_agg)
+def _json_array_agg(element, compiler, **kw):
+    return f"json_group_array({compiler.process(element.clauses, **kw)})"
+
+
+@compiles(json_array_agg, "postgresql")
+def _json_array_agg_postgresql(element, compiler, **kw):
+    return (
+        f"coalesce(json_agg({compiler.process(element.clauses, **kw)}), "
+        f"'[]'::json)"
+    )
+
+
+@compiles(as_json)
+def _as_json(element, compiler, **kw):
+    return f"json({compiler.process(element.clauses, **kw)})"
+
+
+@compiles(as_json, "postgresql")
+def _as_json_postgresql(element, compiler, **kw):
+    return compiler.process(element.clauses, **kw)
+
+
+@compiles(json_strip_nulls)
+def _json_strip_nulls(element, compiler, **kw):
+    # По RFC 7396 null в патче удаляет ключ
+    return f"json_patch('{{}}', {compiler.process(element.clauses, **kw)})"
+
+
+@compiles(json_strip_nulls, "postgresql")
+def _json_strip_nulls_postgresql(element, compiler, **kw):
+    return f"json_strip_nulls({compiler.process(element.clauses, **kw)})"
@@ -0,0 +1,75 @@
+import logging
+from typing import List, NamedTuple, Sequence
+
+from sqlalchemy import Connection, MetaData, inspect, text
+from sqlalchemy.schema import CreateIndex
+
+from .models import Base
+
+# Индексы, которые ни разу не использовались планировщиком с момента
+# последнего сброса статистики, хотя таблицу уже читали. Уникальные
+# индексы и первичные ключи не учитываются: они нужны для ограничений
+STMT_UNUSED_INDEXES = text(
+    "SELECT s.relname, s.indexrelname "
+    "FROM pg_stat_user_indexes AS s "
+    "JOIN pg_index AS i ON i.indexrelid = s.indexrelid "
+    "JOIN pg_stat_user_tables AS t ON t.relid = s.relid "
+    "WHERE s.idx_scan = 0 AND NOT i.indisunique AND NOT i.indisprimary "
+    "AND t.n_live_tup > 0 "
+    "AND t.seq_scan + coalesce(t.idx_scan, 0) > 0 "
+    "ORDER BY s.relname, s.indexrelname"
+)
+
+
+class IndexReport(NamedTuple):
+    # Индексы моделей, которых нет в БД, с DDL для их создания
+    missing: List[str]
+    # Внешние ключи, не являющиеся началом ни одного индекса в БД
+    unindexed_foreign_keys: List[str]
+    # Индексы БД без единого сканирования (только PostgreSQL)
+    unused: List[str]
+
+
+def _is_prefix(columns: Sequence[str], indexed: Sequence[str]) -> bool:
+    return list(indexed[: len(columns)]) == list(columns)
+
+
+def check_indexes(
+    connection: Connection, metadata: MetaData = Base.metadata
+) -> IndexReport:
+    """Сравнивает индексы моделей с индексами БД и пишет в лог
+    отсутствующие, неиспользуемые и непокрытые внешние ключи.
+    Вызывается через AsyncConnection.run_sync при старте приложения"""
+    inspector = inspect(connection)
+    existing_tables = set(inspector.get_table_names())
+    report = IndexReport([], [], [])
+    for table in metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        indexes = inspector.get_indexes(table.name)
+        unique = inspector.get_unique_constraints(table.name)
+        primary = inspector.get_pk_constraint(table.name)
+        names = {index["name"] for index in indexes}
+        for index in table.indexes:
+            if index.name not in names:
+                ddl = CreateIndex(index).compile(dialect=connection.dialect)
+                report.missing.append(str(ddl).strip())
+        indexed = [index["column_names"] for index in indexes]
+        indexed += [constraint["column_names"] for constraint in unique]
+        indexed.append(primary["constrained_columns"])
+        for foreign_key in inspector.get_foreign_keys(table.name):
+            columns = foreign_key["constrained_columns"]
+            if not any(_is_prefix(columns, other) for other in indexed):
+                report.unindexed_foreign_keys.append(
+                    f"{table.name}({', '.join(columns)})"
+                )
+    if connection.dialect.name == "postgresql":
+        for table_name, index_name in connection.execute(STMT_UNUSED_INDEXES):
+            report.unused.append(f"{table_name}.{index_name}")
+    for ddl in report.missing:
+        logging.warning("Missing index, create it with: %s", ddl)
+    for foreign_key in report.unindexed_foreign_keys:
+        logging.warning("Foreign key without index: %s", foreign_key)
+    for index_name in report.unused:
+        logging.warning("Index has never been scanned: %s", index_name)
+    return report
@@ -0,0 +1,138 @@
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import Engine, event
+
+
+class QueryStats:
+    """Запросы к БД: число, полученные строки, время в БД и число
+    выполнений каждого текста запроса. Экземпляр - слушатель события
+    after_cursor_execute, см. instrument_engine"""
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        self.queries = 0
+        self.rows = 0
+        self.duration = 0.0
+        self.statements: Counter = Counter()
+
+    @property
+    def duration_ms(self) -> float:
+        return self.duration * 1000
+
+    def record(self, statement: str, rows: int, duration: float) -> None:
+        self.queries += 1
+        self.rows += rows
+        self.duration += duration
+        self.statements[statement] += 1
+
+    def repeated(self, threshold: int) -> List[Tuple[str, int]]:
+        """Запросы, выполненные не меньше threshold раз: признак N+1,
+        когда связанные объекты загружаются по одному"""
+        return [
+            (statement, count)
+            for statement, count in self.statements.most_common()
+            if count >= threshold
+        ]
+
+    def __call__(self, conn, cursor, statement, parameters, context, many):
+        self.record(statement, result_rows(cursor), elapsed(context))
+
+
+# Статистика текущего HTTP-запроса, задаётся RequestScopeMiddleware.
+# SQLAlchemy выполняет события в greenlet с контекстом вызывающей задачи
+_current: ContextVar[Optional[QueryStats]] = ContextVar(
+    "query_stats", default=None
+)
+
+
+def get_query_stats() -> Optional[QueryStats]:
+    return _current.get()
+
+
+@contextmanager
+def track_queries(stats: Optional[QueryStats] = None) -> Iterator[QueryStats]:
+    """Запросы инструментированных движков внутри блока (в том числе
+    в порождённых задачах) учитываются в stats"""
+    stats = QueryStats() if stats is None else stats
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+def start_timer(conn, cursor, statement, parameters, context, many) -> None:
+    if context is not None:
+        context._query_started = time.perf_counter()
+
+
+def elapsed(context) -> float:
+    started = getattr(context, "_query_started", None)
+    return time.perf_counter() - started if started is not None else 0.0
+
+
+def result_rows(cursor) -> int:
+    """Число строк, полученных запросом, по rowcount DB-API (asyncpg
+    сообщает его в статусе команды, для RETURNING - тоже). Запросы без
+    результата (description is None) строк не возвращают. Если драйвер
+    число не сообщает (-1, например SELECT в sqlite3), значение
+    приблизительное: берётся длина буфера результата асинхронного
+    адаптера SQLAlchemy, а без буфера - 0"""
+    if cursor.description is None:
+        return 0
+    rowcount = getattr(cursor, "rowcount", -1)
+    if rowcount is not None and rowcount >= 0:
+        return rowcount
+    return len(getattr(cursor, "_rows", None) or ())
+
+
+def record_current(conn, cursor, statement, parameters, context, many):
+    stats = _current.get()
+    if stats is not None:
+        stats.record(statement, result_rows(cursor), elapsed(context))
+
+
+def instrument_engine(engine: Engine) -> None:
+    """Учитывает запросы движка в статистике текущего запроса.
+    Повторный вызов для того же движка ничего не делает"""
+    if event.contains(engine, "before_cursor_execute", start_timer):
+        return
+    event.listen(engine, "before_cursor_execute", start_timer)
+    event.listen(engine, "after_cursor_execute", record_current)
+
+
+class QueryMetrics:
+    """Суммарные запросы к БД по маршрутам в памяти процесса"""
+
+    def __init__(self) -> None:
+        self._routes: Dict[str, Dict[str, Any]] = defaultdict(
+            lambda: {
+                "requests": 0,
+                "queries": 0,
+                "rows": 0,
+                "duration_ms": 0.0,
+                "max_queries": 0,
+            }
+        )
+
+    def observe(self, route: str, stats: QueryStats) -> None:
+        metrics = self._routes[route]
+        metrics["requests"] += 1
+        metrics["queries"] += stats.queries
+        metrics["rows"] += stats.rows
+        metrics["duration_ms"] += stats.duration_ms
+        metrics["max_queries"] = max(metrics["max_queries"], stats.queries)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            route: dict(metrics) for route, metrics in self._routes.items()
+        }
+
+    def clear(self) -> None:
+        self._routes.clear()
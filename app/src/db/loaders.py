@@ -0,0 +1,31 @@
+"""Профили загрузки связей для эндпоинтов.
+
+Все связи в models.py по умолчанию lazy="raise": обращение к не
+загруженной связи вызывает ошибку вместо скрытого запроса. Каждый
+эндпоинт явно передаёт в crud профиль с тем, что ему нужно загрузить.
+Коллекции грузятся selectinload (один запрос на коллекцию для всей
+страницы), а связи многие-к-одному - joinedload.
+"""
+
+from sqlalchemy.orm import joinedload, load_only, raiseload, selectinload
+
+from .models import Follower, Like, Tweet, TweetsImage, User
+
+# Лента: автор, лайкнувшие пользователи и пути вложений твитов
+FEED = (
+    joinedload(Tweet.author),
+    selectinload(Tweet.likes_association).joinedload(Like.user),
+    selectinload(Tweet.images_association).joinedload(TweetsImage.image),
+)
+
+# Профиль пользователя: подписчики и подписки
+USER_PROFILE = (
+    selectinload(User.followers_association).joinedload(Follower.user),
+    selectinload(User.following_association).joinedload(Follower.following),
+)
+
+# Аутентификация: только id и имя пользователя
+AUTH = (load_only(User.id, User.name), raiseload("*"))
+
+# Изменение данных: только колонки самой сущности
+WRITE_PATH = (raiseload("*"),)
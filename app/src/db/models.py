@@ -1,11 +1,17 @@
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 
 from sqlalchemy import (
+    DDL,
     CheckConstraint,
     ForeignKey,
+    Index,
     String,
     UniqueConstraint,
+    false,
+    literal,
+    event,
     select,
+    union_all,
 )
 from sqlalchemy.ext.associationproxy import AssociationProxy, association_proxy
 from sqlalchemy.ext.asyncio import AsyncAttrs
@@ -18,10 +24,23 @@ class Image(AsyncAttrs, Base):
     __tablename__ = "images"
     id: Mapped[int] = mapped_column(primary_key=True)
     path: Mapped[str] = mapped_column(String())
+    # sha256 содержимого файла, одинаковые загрузки используют одну запись
+    hash: Mapped[Optional[str]] = mapped_column(String(64), unique=True)
+    # Уменьшенные копии создаются в фоне, status отражает ход обработки
+    PENDING = "pending"
+    PROCESSING = "processing"
+    READY = "ready"
+    FAILED = "failed"
+    status: Mapped[str] = mapped_column(
+        String(16), default=PENDING, server_default=PENDING
+    )
+    thumb_path: Mapped[Optional[str]] = mapped_column(String())
+    medium_path: Mapped[Optional[str]] = mapped_column(String())
     tweets_association: Mapped[List["TweetsImage"]] = relationship(
         back_populates="image",
         cascade="all, delete-orphan",
-        lazy="joined",
+        lazy="raise",
+        passive_deletes=True,
     )
     tweets: AssociationProxy[List["Tweet"]] = association_proxy(
         "tweets_association",
@@ -36,12 +55,17 @@ class Tweet(AsyncAttrs, Base):
     author_id: Mapped["int"] = mapped_column(
         ForeignKey("users.id", onupdate="CASCADE", ondelete="CASCADE")
     )
-    author: Mapped["User"] = relationship(lazy="joined")
+    # Обновляется пакетами из services/like_counter.py, а не при каждом
+    # лайке, поэтому может отставать от likes на интервал сброса.
+    # В существующей БД после добавления столбца пересчитывается
+    # COLUMN_BACKFILL
+    like_count: Mapped[int] = mapped_column(default=0, server_default="0")
+    author: Mapped["User"] = relationship(lazy="raise")
     likes_association: Mapped[List["Like"]] = relationship(
         back_populates="tweet",
         cascade="all, delete-orphan",
-        lazy="joined",
-        join_depth=2,
+        lazy="raise",
+        passive_deletes=True,
     )
     likes: AssociationProxy[List["User"]] = association_proxy(
         "likes_association",
@@ -50,8 +74,8 @@ class Tweet(AsyncAttrs, Base):
     images_association: Mapped[List["TweetsImage"]] = relationship(
         back_populates="tweet",
         cascade="all, delete-orphan",
-        lazy="joined",
-        join_depth=2,
+        lazy="raise",
+        passive_deletes=True,
     )
     attachments: AssociationProxy[List[str]] = association_proxy(
         "images_association",
@@ -64,28 +88,85 @@ class Tweet(AsyncAttrs, Base):
     )
 
     @classmethod
-    def stmt_get_tweets(cls, user: "User"):
-        following_id = [following.id for following in user.following]
-        following_id.append(user.id)
-        return (
-            select(Tweet).filter(Tweet.author_id.in_(following_id)).distinct()
+    def stmt_get_tweets(cls, authors):
+        return select(Tweet.id).where(Tweet.author_id.in_(authors))
+
+
+Index("ix_tweets_author_id_id", Tweet.author_id, Tweet.id.desc())
+
+# Заполнение столбцов, добавленных к существующим таблицам: значение
+# по умолчанию неверно для уже существующих строк
+# (см. schema.missing_columns)
+COLUMN_BACKFILL = {
+    ("tweets", "like_count"): (
+        "UPDATE tweets SET like_count = "
+        "(SELECT count(*) FROM likes WHERE likes.tweet_id = tweets.id)"
+    ),
+}
+
+# Полнотекстовый поиск по Tweet.content. В PostgreSQL - генерируемый
+# столбец tsvector с GIN-индексом, в SQLite - внешняя таблица FTS5
+# с триггерами. Столбца нет в модели: он нужен только в WHERE поиска
+# и не должен попадать в SELECT и INSERT. Команды идемпотентны,
+# schema.ensure_schema выполняет их и для уже существующей таблицы
+TWEETS_SEARCH_DDL = {
+    "postgresql": [
+        "ALTER TABLE tweets ADD COLUMN IF NOT EXISTS search_vector tsvector "
+        "GENERATED ALWAYS AS (to_tsvector('simple', content)) STORED",
+        "CREATE INDEX IF NOT EXISTS ix_tweets_search_vector "
+        "ON tweets USING gin (search_vector)",
+    ],
+    "sqlite": [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS tweets_fts "
+        "USING fts5(content, content='tweets', content_rowid='id')",
+        "CREATE TRIGGER IF NOT EXISTS tweets_fts_insert "
+        "AFTER INSERT ON tweets BEGIN "
+        "INSERT INTO tweets_fts (rowid, content) "
+        "VALUES (new.id, new.content); END",
+        "CREATE TRIGGER IF NOT EXISTS tweets_fts_delete "
+        "AFTER DELETE ON tweets BEGIN "
+        "INSERT INTO tweets_fts (tweets_fts, rowid, content) "
+        "VALUES ('delete', old.id, old.content); END",
+        "CREATE TRIGGER IF NOT EXISTS tweets_fts_update "
+        "AFTER UPDATE OF content ON tweets BEGIN "
+        "INSERT INTO tweets_fts (tweets_fts, rowid, content) "
+        "VALUES ('delete', old.id, old.content); "
+        "INSERT INTO tweets_fts (rowid, content) "
+        "VALUES (new.id, new.content); END",
+        # Индексирует строки, добавленные до создания таблицы FTS5
+        "INSERT INTO tweets_fts (tweets_fts) VALUES ('rebuild')",
+    ],
+}
+for _dialect, _statements in TWEETS_SEARCH_DDL.items():
+    for _statement in _statements:
+        event.listen(
+            Tweet.__table__,
+            "after_create",
+            DDL(_statement).execute_if(dialect=_dialect),
         )
+event.listen(
+    Tweet.__table__,
+    "before_drop",
+    DDL("DROP TABLE IF EXISTS tweets_fts").execute_if(dialect="sqlite"),
+)
 
 
 class TweetsImage(AsyncAttrs, Base):
     __tablename__ = "tweetsimages"
     id: Mapped[int] = mapped_column(primary_key=True)
     tweet_id: Mapped[int] = mapped_column(
-        ForeignKey("tweets.id", onupdate="CASCADE", ondelete="CASCADE")
+        ForeignKey("tweets.id", onupdate="CASCADE", ondelete="CASCADE"),
+        index=True,
     )
     tweet: Mapped["Tweet"] = relationship(
-        back_populates="images_association", lazy="joined", join_depth=2
+        back_populates="images_association", lazy="raise"
     )
     image_id: Mapped[int] = mapped_column(
-        ForeignKey("images.id", onupdate="CASCADE", ondelete="CASCADE")
+        ForeignKey("images.id", onupdate="CASCADE", ondelete="CASCADE"),
+        index=True,
     )
     image: Mapped["Image"] = relationship(
-        back_populates="tweets_association", lazy="joined", join_depth=2
+        back_populates="tweets_association", lazy="raise"
     )
 
     @property
@@ -97,12 +178,19 @@ class User(AsyncAttrs, Base):
     __tablename__ = "users"
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str]
-    api_key: Mapped[str]
+    api_key: Mapped[str] = mapped_column(index=True, unique=True)
+    # Твиты популярных авторов не раскладываются по лентам подписчиков
+    # (timeline_entries), а подмешиваются в ленту при чтении
+    is_popular: Mapped[bool] = mapped_column(
+        default=False, server_default=false()
+    )
+    # Растёт при изменении твитов, лайков и подписок пользователя,
+    # из него строятся ETag ленты и профиля (см. crud.bump_versions)
+    version: Mapped[int] = mapped_column(default=0, server_default="0")
     followers_association: Mapped[List["Follower"]] = relationship(
         back_populates="following",
         foreign_keys="Follower.following_id",
-        lazy="joined",
-        join_depth=2,
+        lazy="raise",
     )
     followers: AssociationProxy[List["User"]] = association_proxy(
         "followers_association",
@@ -111,15 +199,14 @@ class User(AsyncAttrs, Base):
     following_association: Mapped[List["Follower"]] = relationship(
         back_populates="user",
         foreign_keys="Follower.user_id",
-        lazy="joined",
-        join_depth=2,
+        lazy="raise",
     )
     following: AssociationProxy[List["User"]] = association_proxy(
         "following_association",
         "following",
     )
     likes_association: Mapped[List["Like"]] = relationship(
-        back_populates="user", lazy="joined", join_depth=2
+        back_populates="user", lazy="raise"
     )
 
     @property
@@ -136,9 +223,13 @@ class User(AsyncAttrs, Base):
 
 class Follower(AsyncAttrs, Base):
     __tablename__ = "followers"
-    __table_args__ = UniqueConstraint(
-        "user_id", "following_id"
-    ), CheckConstraint("user_id <> following_id")
+    __table_args__ = (
+        UniqueConstraint("user_id", "following_id"),
+        CheckConstraint("user_id <> following_id"),
+        # Подписчики автора по порядку id, частями при раскладке твита
+        # (timeline_service.fan_out_tweet)
+        Index("ix_followers_following_id_user_id", "following_id", "user_id"),
+    )
     id: Mapped[int] = mapped_column(primary_key=True)
     user_id: Mapped[int] = mapped_column(
         ForeignKey("users.id", onupdate="CASCADE", ondelete="CASCADE")
@@ -146,21 +237,40 @@ class Follower(AsyncAttrs, Base):
     following: Mapped["User"] = relationship(
         back_populates="followers_association",
         foreign_keys="Follower.following_id",
-        lazy="joined",
-        join_depth=2,
+        lazy="raise",
         overlaps="following_association",
     )
+    # user_id и following_id покрыты уникальным ограничением
+    # (user_id, following_id) и индексом (following_id, user_id)
     following_id: Mapped[int] = mapped_column(
         ForeignKey("users.id", onupdate="CASCADE", ondelete="CASCADE")
     )
     user: Mapped["User"] = relationship(
         back_populates="following_association",
         foreign_keys="Follower.user_id",
-        lazy="joined",
-        join_depth=2,
+        lazy="raise",
         overlaps="followers_association",
     )
 
+    @classmethod
+    def stmt_feed_authors(cls, user_id: int):
+        """Авторы ленты пользователя: он сам и те, на кого он подписан"""
+        return union_all(
+            select(Follower.following_id.label("author_id")).where(
+                Follower.user_id == user_id
+            ),
+            select(literal(user_id).label("author_id")),
+        )
+
+    @classmethod
+    def stmt_popular_following(cls, user_id: int):
+        """Популярные авторы, на которых подписан пользователь"""
+        return (
+            select(Follower.following_id.label("author_id"))
+            .join(User, User.id == Follower.following_id)
+            .where(Follower.user_id == user_id, User.is_popular)
+        )
+
     @classmethod
     def stmt_follower_by_user_following(cls, user_id, following_id):
         return select(Follower).where(
@@ -176,13 +286,15 @@ class Like(AsyncAttrs, Base):
         ForeignKey("tweets.id", onupdate="CASCADE", ondelete="CASCADE")
     )
     tweet: Mapped["Tweet"] = relationship(
-        back_populates="likes_association", lazy="joined", join_depth=2
+        back_populates="likes_association", lazy="raise"
     )
+    # tweet_id покрыт уникальным ограничением (tweet_id, user_id)
     user_id: Mapped[int] = mapped_column(
-        ForeignKey("users.id", onupdate="CASCADE", ondelete="CASCADE")
+        ForeignKey("users.id", onupdate="CASCADE", ondelete="CASCADE"),
+        index=True,
     )
     user: Mapped["User"] = relationship(
-        back_populates="likes_association", lazy="joined", join_depth=2
+        back_populates="likes_association", lazy="raise"
     )
 
     @classmethod
@@ -190,3 +302,26 @@ class Like(AsyncAttrs, Base):
         return select(Like).where(
             Like.tweet_id == tweet_id, Like.user_id == user_id
         )
+
+
+class TimelineEntry(Base):
+    """Материализованная лента: твит tweet_id в ленте пользователя user_id"""
+
+    __tablename__ = "timeline_entries"
+    user_id: Mapped[int] = mapped_column(
+        ForeignKey("users.id", onupdate="CASCADE", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    tweet_id: Mapped[int] = mapped_column(
+        ForeignKey("tweets.id", onupdate="CASCADE", ondelete="CASCADE"),
+        primary_key=True,
+        index=True,
+    )
+
+
+class SchemaVersion(Base):
+    """Отпечаток моделей, по которым создана схема БД (см. schema.py).
+    Таблица в тех же метаданных, поэтому drop_all удаляет и её"""
+
+    __tablename__ = "schema_version"
+    version: Mapped[str] = mapped_column(String(32), primary_key=True)
@@ -0,0 +1,129 @@
+import hashlib
+import logging
+from typing import List
+
+from sqlalchemy import Connection, Dialect, MetaData, delete, inspect, select
+from sqlalchemy.ext.asyncio import AsyncConnection
+from sqlalchemy.schema import CreateColumn, CreateIndex, CreateTable
+
+from .models import (
+    COLUMN_BACKFILL,
+    TWEETS_SEARCH_DDL,
+    Base,
+    SchemaVersion,
+    Tweet,
+)
+
+# Поиск для существующей таблицы твитов в PostgreSQL. ALTER TABLE
+# переписывает всю таблицу под ACCESS EXCLUSIVE, а обычный CREATE INDEX
+# блокирует запись, поэтому при старте они не выполняются, а пишутся
+# в лог для ручного запуска (индекс - CONCURRENTLY, вне транзакции)
+TWEETS_SEARCH_MANUAL = [
+    statement.replace("CREATE INDEX", "CREATE INDEX CONCURRENTLY")
+    for statement in TWEETS_SEARCH_DDL["postgresql"]
+]
+
+
+class SchemaMismatch(Exception): ...  # noqa E701
+
+
+def schema_fingerprint(
+    dialect: Dialect, metadata: MetaData = Base.metadata
+) -> str:
+    """Хэш DDL таблиц и индексов моделей для диалекта БД. Меняется
+    при любом изменении моделей, которое затрагивает схему БД"""
+    digest = hashlib.blake2b(digest_size=16)
+    for table in metadata.sorted_tables:
+        digest.update(
+            str(CreateTable(table).compile(dialect=dialect)).encode()
+        )
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            ddl = CreateIndex(index).compile(dialect=dialect)
+            digest.update(str(ddl).encode())
+    for statement in TWEETS_SEARCH_DDL.get(dialect.name, ()):
+        digest.update(statement.encode())
+    return digest.hexdigest()
+
+
+def missing_columns(
+    connection: Connection, metadata: MetaData = Base.metadata
+) -> List[str]:
+    """Команды ALTER TABLE для столбцов моделей, которых нет в таблицах
+    БД. create_all не изменяет существующие таблицы, поэтому столбцы,
+    добавленные в модели позже, нужно добавить вручную. После ALTER
+    TABLE идёт заполнение столбца из COLUMN_BACKFILL, если оно есть"""
+    inspector = inspect(connection)
+    statements = []
+    for table in metadata.sorted_tables:
+        existing = {
+            column["name"] for column in inspector.get_columns(table.name)
+        }
+        for column in table.columns:
+            if column.name not in existing:
+                ddl = CreateColumn(column).compile(dialect=connection.dialect)
+                statements.append(f"ALTER TABLE {table.name} ADD COLUMN {ddl}")
+                backfill = COLUMN_BACKFILL.get((table.name, column.name))
+                if backfill is not None:
+                    statements.append(backfill)
+    return statements
+
+
+def add_search(connection: Connection) -> bool:
+    """Добавляет полнотекстовый поиск к существующей таблице твитов.
+    В SQLite выполняет TWEETS_SEARCH_DDL. В PostgreSQL только проверяет
+    столбец и индекс и, если их нет, пишет в лог TWEETS_SEARCH_MANUAL.
+    Возвращает True, если поиск готов"""
+    dialect = connection.dialect.name
+    if dialect != "postgresql":
+        for statement in TWEETS_SEARCH_DDL.get(dialect, ()):
+            connection.exec_driver_sql(statement)
+        return True
+    inspector = inspect(connection)
+    columns = {column["name"] for column in inspector.get_columns("tweets")}
+    indexes = {index["name"] for index in inspector.get_indexes("tweets")}
+    if "search_vector" in columns and "ix_tweets_search_vector" in indexes:
+        return True
+    logging.warning(
+        "Full-text search is not set up, GET /tweets/search will fail. "
+        "Run during maintenance: %s",
+        "; ".join(TWEETS_SEARCH_MANUAL),
+    )
+    return False
+
+
+async def ensure_schema(
+    conn: AsyncConnection, metadata: MetaData = Base.metadata
+) -> bool:
+    """Сверяет версию схемы в БД с моделями: если совпадает, это всё,
+    что делается при старте. Иначе создаёт недостающие таблицы и индексы
+    (create_all, существующие таблицы не изменяются), добавляет
+    к существующей таблице твитов поиск (add_search) и записывает
+    версию. Если в существующих таблицах нет столбцов моделей, версия
+    не записывается и вызывается SchemaMismatch с командами ALTER TABLE.
+    Пока поиск в PostgreSQL не создан вручную, версия не записывается,
+    и напоминание пишется в лог при каждом старте.
+    Возвращает True, если схема создавалась"""
+    version = schema_fingerprint(conn.dialect, metadata)
+    tables = await conn.run_sync(
+        lambda sync_conn: inspect(sync_conn).get_table_names()
+    )
+    if SchemaVersion.__tablename__ in tables:
+        current = await conn.scalar(select(SchemaVersion.version))
+        if current == version:
+            return False
+    await conn.run_sync(metadata.create_all)
+    missing = await conn.run_sync(missing_columns, metadata)
+    if missing:
+        raise SchemaMismatch(
+            "Database tables lack model columns, add them with: "
+            + "; ".join(missing)
+        )
+    # Новая таблица твитов создаётся вместе с поиском (after_create)
+    if Tweet.__tablename__ in tables:
+        if not await conn.run_sync(add_search):
+            return True
+    await conn.execute(delete(SchemaVersion))
+    await conn.execute(
+        SchemaVersion.__table__.insert().values(version=version)
+    )
+    return True
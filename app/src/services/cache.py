@@ -0,0 +1,156 @@
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Set, Tuple
+
+
+class TTLCache:
+    """LRU-кэш в памяти процесса с ограниченным размером и временем жизни
+    записей. Методы не содержат await, поэтому безопасны в event loop
+    без блокировок"""
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, Tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return default
+        expires, value = item
+        if expires < time.monotonic():
+            self._remove(key)
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(
+        self, key: Hashable, value: Any, ttl: Optional[float] = None
+    ) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._remove(next(iter(self._data)))
+
+    def delete(self, key: Hashable) -> None:
+        self._remove(key)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _remove(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+
+class ApiKeyCache(TTLCache):
+    """Кэш api-key -> пользователь (объект с атрибутом id)
+    с инвалидацией всех ключей пользователя"""
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        super().__init__(maxsize, ttl)
+        self._keys_by_user: Dict[int, Set[Hashable]] = {}
+
+    def set(self, key: Hashable, value: Any) -> None:
+        # Ключ мог быть закэширован для другого пользователя
+        self._remove(key)
+        self._keys_by_user.setdefault(value.id, set()).add(key)
+        super().set(key, value)
+
+    def invalidate_user(self, user_id: int) -> None:
+        for key in self._keys_by_user.pop(user_id, ()):
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        super().clear()
+        self._keys_by_user.clear()
+
+    def _remove(self, key: Hashable) -> None:
+        item = self._data.pop(key, None)
+        if item is None:
+            return
+        keys = self._keys_by_user.get(item[1].id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[item[1].id]
+
+
+class CacheBackend(ABC):
+    """Хранилище отрендеренных ответов: ключ - строка, значение - байты.
+    Реализации: InMemoryCacheBackend (в памяти процесса) и
+    RedisCacheBackend (общий для всех процессов)"""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[bytes]:
+        """Значение или None, если ключа нет или срок жизни истёк"""
+
+    @abstractmethod
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        """Сохраняет значение на ttl секунд"""
+
+    @abstractmethod
+    async def delete(self, *keys: str) -> None:
+        """Удаляет ключи, отсутствующие пропускаются"""
+
+    async def close(self) -> None:
+        pass
+
+
+class InMemoryCacheBackend(CacheBackend):
+    """LRU в памяти процесса, у каждого процесса своя копия"""
+
+    def __init__(self, maxsize: int) -> None:
+        self._cache = TTLCache(maxsize=maxsize, ttl=0)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return self._cache.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        self._cache.set(key, value, ttl)
+
+    async def delete(self, *keys: str) -> None:
+        for key in keys:
+            self._cache.delete(key)
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+
+class RedisCacheBackend(CacheBackend):
+    """Кэш в Redis (или совместимом сервере), общий для всех процессов.
+    client - клиент redis.asyncio; ключи получают префикс prefix"""
+
+    def __init__(self, client, prefix: str = "social-net:") -> None:
+        self.client = client
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.client.get(self.prefix + key)
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        await self.client.set(self.prefix + key, value, px=int(ttl * 1000))
+
+    async def delete(self, *keys: str) -> None:
+        if keys:
+            await self.client.delete(*(self.prefix + key for key in keys))
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+def make_cache_backend(url: str, maxsize: int) -> Optional[CacheBackend]:
+    """Бэкенд по CACHE_URL: пустая строка - кэш выключен,
+    memory:// - в памяти процесса, redis://... - Redis"""
+    if not url:
+        return None
+    if url.startswith("memory://"):
+        return InMemoryCacheBackend(maxsize)
+    # redis нужен только при кэше в Redis
+    from redis.asyncio import Redis
+
+    return RedisCacheBackend(Redis.from_url(url))
@@ -0,0 +1,24 @@
+import hashlib
+from typing import Optional
+
+
+def make_etag(*parts) -> str:
+    """ETag из версий данных и параметров запроса"""
+    digest = hashlib.blake2b(repr(parts).encode(), digest_size=8)
+    return f'"{digest.hexdigest()}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Проверяет заголовок If-None-Match. Сравнение слабое (RFC 9110),
+    потому что nginx при сжатии ответа делает ETag слабым"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
@@ -1,21 +1,104 @@
+import hashlib
 from pathlib import Path
+from typing import NamedTuple, Optional
+from uuid import uuid4
 
 import aiofiles
+import aiofiles.os
 from fastapi import UploadFile
 
-from ..db.models import User
+from ..settings import UPLOAD_CHUNK_SIZE, UPLOAD_MAX_SIZE
 
+# Файлы хранятся по sha256 содержимого и никогда не перезаписываются,
+# поэтому nginx отдаёт их с бессрочным кэшированием
+CONTENT_PATH = Path("images/sha256")
 
-async def write_to_disk(user: User, file: UploadFile, static_path: str) -> str:
 
-    path = Path(f"images/{user.id}")
-    absolute_path = Path(static_path).absolute() / path
-    absolute_path.mkdir(exist_ok=True, parents=True)
-    if file.filename:
-        file_path = path / file.filename
-    else:
-        file_path = path / "UPLOAD"
-    content = await file.read()
-    async with aiofiles.open(static_path / file_path, mode="wb") as f:
-        await f.write(content)
-    return str(file_path)
+class FileTooLarge(Exception): ...  # noqa E701
+
+
+# Сигнатуры начала файла и расширения, под которыми nginx отдаёт файл
+# с типом изображения. Остальные файлы сохраняются без расширения
+# и отдаются как application/octet-stream
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"GIF87a", ".gif"),
+    (b"GIF89a", ".gif"),
+)
+SIGNATURE_SIZE = 12
+
+
+class StoredFile(NamedTuple):
+    path: str
+    hash: str
+    size: int
+    # False, если файл с таким содержимым уже был на диске
+    created: bool = False
+
+
+def image_suffix(head: bytes) -> str:
+    """Расширение по первым SIGNATURE_SIZE байтам файла, а не по имени
+    от клиента: одинаковое содержимое всегда получает один путь"""
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    for signature, suffix in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return suffix
+    return ""
+
+
+def content_path(file_hash: str, suffix: str = "") -> Path:
+    """Путь файла относительно статики: images/sha256/ab/cd/abcd...ext"""
+    return CONTENT_PATH / file_hash[:2] / file_hash[2:4] / (file_hash + suffix)
+
+
+async def remove_file(static_path: str, path: str) -> None:
+    await aiofiles.os.remove(Path(static_path) / path)
+
+
+async def write_to_disk(
+    file: UploadFile,
+    static_path: str,
+    max_size: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+) -> StoredFile:
+    """Сохраняет загруженный файл частями по chunk_size байт во временный
+    файл, считая sha256, и переносит его по адресу содержимого (хэш
+    и расширение по сигнатуре, см. image_suffix). Если такой файл уже
+    есть, временный файл удаляется. Если файл больше max_size байт,
+    вызывает FileTooLarge"""
+    max_size = UPLOAD_MAX_SIZE if max_size is None else max_size
+    chunk_size = chunk_size or UPLOAD_CHUNK_SIZE
+    static_path = Path(static_path).absolute()
+    tmp_dir = static_path / CONTENT_PATH
+    tmp_dir.mkdir(exist_ok=True, parents=True)
+    tmp_path = tmp_dir / f".{uuid4().hex}.part"
+    file_hash = hashlib.sha256()
+    size = 0
+    head = b""
+    created = False
+    try:
+        async with aiofiles.open(tmp_path, mode="wb") as f:
+            while chunk := await file.read(chunk_size):
+                size += len(chunk)
+                if size > max_size:
+                    raise FileTooLarge(
+                        f"File is larger than {max_size} bytes"
+                    )
+                if len(head) < SIGNATURE_SIZE:
+                    head += chunk[: SIGNATURE_SIZE - len(head)]
+                file_hash.update(chunk)
+                await f.write(chunk)
+        file_path = content_path(file_hash.hexdigest(), image_suffix(head))
+        absolute_path = static_path / file_path
+        if absolute_path.exists():
+            await aiofiles.os.remove(tmp_path)
+        else:
+            absolute_path.parent.mkdir(exist_ok=True, parents=True)
+            await aiofiles.os.replace(tmp_path, absolute_path)
+            created = True
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return StoredFile(str(file_path), file_hash.hexdigest(), size, created)
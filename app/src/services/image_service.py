@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Dict
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import sessionmaker
+
+from ..db import crud, models
+
+# Варианты изображения: имя -> максимальные ширина и высота
+VARIANTS = {"thumb": (160, 160), "medium": (800, 800)}
+
+
+@lru_cache
+def get_process_pool() -> ProcessPoolExecutor:
+    # Настройки читаются при первом обращении: рабочие процессы
+    # импортируют этот модуль, но пул им не нужен
+    from ..settings import IMAGE_WORKERS
+
+    return ProcessPoolExecutor(
+        max_workers=IMAGE_WORKERS, mp_context=get_context("spawn")
+    )
+
+
+def shutdown_process_pool() -> None:
+    if get_process_pool.cache_info().currsize:
+        get_process_pool().shutdown(cancel_futures=True)
+        get_process_pool.cache_clear()
+
+
+def make_variants(path: str, static_path: str) -> Dict[str, str]:
+    """Создаёт уменьшенные копии изображения без метаданных (EXIF, ICC)
+    рядом с оригиналом. Выполняется в отдельном процессе"""
+    # Pillow нужен только процессам пула, не при старте приложения
+    from PIL import Image, ImageOps
+
+    source = Path(static_path) / path
+    variants = {}
+    with Image.open(source) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode in ("RGBA", "LA", "PA") or (
+            image.mode == "P" and "transparency" in image.info
+        ):
+            # В JPEG нет прозрачности: без подложки прозрачные
+            # области при convert("RGB") становятся чёрными
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, "white")
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        elif image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        for name, size in VARIANTS.items():
+            variant = image.copy()
+            variant.thumbnail(size)
+            variant.info.clear()
+            variant_path = Path(path).with_suffix(f".{name}.jpg")
+            tmp_path = Path(static_path) / variant_path.with_suffix(".part")
+            variant.save(tmp_path, format="JPEG", quality=85, optimize=True)
+            os.replace(tmp_path, Path(static_path) / variant_path)
+            variants[name] = str(variant_path)
+    return variants
+
+
+async def process_image(
+    session_maker: sessionmaker, image_id: int, static_path: str
+) -> None:
+    """Фоновая задача: создаёт варианты изображения в пуле процессов
+    и сохраняет их пути и статус обработки в images"""
+    async with session_maker() as session:
+        path = await session.scalar(
+            update(models.Image)
+            .where(
+                models.Image.id == image_id,
+                models.Image.status == models.Image.PENDING,
+            )
+            .values(status=models.Image.PROCESSING)
+            .returning(models.Image.path)
+        )
+        await session.commit()
+        if path is None:
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            variants = await loop.run_in_executor(
+                get_process_pool(), make_variants, path, str(static_path)
+            )
+        except Exception:
+            logging.exception("Image %s processing failed", image_id)
+            values = {"status": models.Image.FAILED}
+        else:
+            values = {
+                "status": models.Image.READY,
+                "thumb_path": variants["thumb"],
+                "medium_path": variants["medium"],
+            }
+        await session.execute(
+            update(models.Image)
+            .where(models.Image.id == image_id)
+            .values(**values)
+        )
+        # Изображение могли прикрепить к твиту до окончания обработки
+        await crud.bump_versions(
+            select(models.Tweet.author_id)
+            .join(models.TweetsImage)
+            .where(models.TweetsImage.image_id == image_id),
+            session,
+        )
+        await session.commit()
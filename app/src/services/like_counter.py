@@ -0,0 +1,66 @@
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Dict, Optional
+
+from sqlalchemy.orm import sessionmaker
+
+from ..db import crud
+
+
+class LikeCounter:
+    """Write-behind агрегатор счётчиков лайков. Лайк и снятие лайка
+    только добавляют изменение в память процесса, а фоновая задача
+    раз в interval секунд прибавляет накопленные изменения к
+    tweets.like_count одним пакетом. Так частые лайки популярного твита
+    не ждут блокировку его строки. При аварийной остановке процесса
+    изменения за последний интервал теряются"""
+
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self._deltas: Dict[int, int] = defaultdict(int)
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, tweet_id: int, delta: int) -> None:
+        self._deltas[tweet_id] += delta
+
+    def clear(self) -> None:
+        self._deltas.clear()
+
+    async def flush(self, session_maker: sessionmaker) -> None:
+        """Сбрасывает накопленные изменения в БД. При ошибке изменения
+        возвращаются в очередь до следующего сброса"""
+        if not self._deltas:
+            return
+        deltas, self._deltas = self._deltas, defaultdict(int)
+        try:
+            async with session_maker() as session:
+                await crud.add_like_counts(deltas, session)
+                await session.commit()
+        except Exception:
+            for tweet_id, delta in deltas.items():
+                self._deltas[tweet_id] += delta
+            raise
+
+    async def run(self, session_maker: sessionmaker) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush(session_maker)
+            except Exception:
+                logging.exception("Like counters flush failed")
+
+    def start(self, session_maker: sessionmaker) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self.run(session_maker))
+
+    async def stop(self, session_maker: sessionmaker) -> None:
+        """Останавливает фоновую задачу и сбрасывает остаток"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush(session_maker)
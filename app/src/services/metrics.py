@@ -0,0 +1,246 @@
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Any, Dict, Iterable, Iterator, List, Sequence, Tuple
+
+# Границы корзин задержки в секундах и размера загрузки в байтах
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+SIZE_BUCKETS = (
+    1024,
+    10 * 1024,
+    100 * 1024,
+    512 * 1024,
+    1024 * 1024,
+    5 * 1024 * 1024,
+    10 * 1024 * 1024,
+    50 * 1024 * 1024,
+)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    """Гистограмма Prometheus: число значений по корзинам, сумма
+    и количество. observe - поиск корзины и три сложения"""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self.buckets = buckets
+        # Последняя ячейка - значения больше всех границ (+Inf)
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name: str, labels: str) -> Iterator[str]:
+        prefix = labels + "," if labels else ""
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}'
+        yield f'{name}_bucket{{{prefix}le="+Inf"}} {self.count}'
+        labels = f"{{{labels}}}" if labels else ""
+        yield f"{name}_sum{labels} {self.sum}"
+        yield f"{name}_count{labels} {self.count}"
+
+
+def escape(value: Any) -> str:
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace('"', '\\"')
+        .replace("\n", "\\n")
+    )
+
+
+def format_labels(**labels: Any) -> str:
+    return ",".join(
+        f'{name}="{escape(value)}"' for name, value in labels.items()
+    )
+
+
+def metric(
+    name: str, kind: str, help_text: str, samples: Iterable[str]
+) -> List[str]:
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", *samples]
+
+
+class Metrics:
+    """Метрики HTTP-запросов, загрузок и кэшей в памяти процесса.
+    Запись - сложения в словарях без await и блокировок (процесс
+    обслуживает запросы в одном потоке event loop), формат Prometheus
+    собирается только при чтении /metrics. У каждого процесса
+    (WEB_WORKERS) свои значения"""
+
+    def __init__(self) -> None:
+        self.started = time.time()
+        self.in_flight = 0
+        self.requests: Dict[Tuple[str, str, int], int] = defaultdict(int)
+        self.latency: Dict[Tuple[str, str], Histogram] = {}
+        self.upload_sizes = Histogram(SIZE_BUCKETS)
+        self.cache_lookups: Dict[Tuple[str, str], int] = defaultdict(int)
+
+    def request_started(self) -> None:
+        self.in_flight += 1
+
+    def request_finished(
+        self, method: str, route: str, status: int, duration: float
+    ) -> None:
+        self.in_flight -= 1
+        self.requests[method, route, status] += 1
+        histogram = self.latency.get((method, route))
+        if histogram is None:
+            histogram = self.latency[method, route] = Histogram(
+                LATENCY_BUCKETS
+            )
+        histogram.observe(duration)
+
+    def observe_upload(self, size: int) -> None:
+        self.upload_sizes.observe(size)
+
+    def cache_lookup(self, cache: str, hit: bool) -> None:
+        self.cache_lookups[cache, "hit" if hit else "miss"] += 1
+
+    def cache_error(self, cache: str) -> None:
+        self.cache_lookups[cache, "error"] += 1
+
+    def clear(self) -> None:
+        self.in_flight = 0
+        self.requests.clear()
+        self.latency.clear()
+        self.upload_sizes = Histogram(SIZE_BUCKETS)
+        self.cache_lookups.clear()
+
+    def render(
+        self,
+        pool_stats: Dict[str, Any],
+        query_metrics: Dict[str, Dict[str, Any]],
+    ) -> str:
+        """Текст для Prometheus. pool_stats - database.get_pool_stats
+        основной БД, query_metrics - QueryMetrics.snapshot()"""
+        lines = metric(
+            "http_requests_total",
+            "counter",
+            "HTTP requests by route and status.",
+            (
+                f"http_requests_total{{"
+                f"{format_labels(method=method, route=route, status=status)}"
+                f"}} {count}"
+                for (method, route, status), count in self.requests.items()
+            ),
+        )
+        lines += metric(
+            "http_request_duration_seconds",
+            "histogram",
+            "HTTP request latency by route.",
+            (
+                sample
+                for (method, route), histogram in self.latency.items()
+                for sample in histogram.samples(
+                    "http_request_duration_seconds",
+                    format_labels(method=method, route=route),
+                )
+            ),
+        )
+        lines += metric(
+            "http_requests_in_flight",
+            "gauge",
+            "HTTP requests being processed.",
+            [f"http_requests_in_flight {self.in_flight}"],
+        )
+        lines += metric(
+            "upload_size_bytes",
+            "histogram",
+            "Sizes of uploaded files, the sum is the uploaded bytes.",
+            self.upload_sizes.samples("upload_size_bytes", ""),
+        )
+        lines += metric(
+            "cache_lookups_total",
+            "counter",
+            "Cache lookups by cache and result (hit, miss or error).",
+            (
+                f"cache_lookups_total{{"
+                f"{format_labels(cache=cache, result=result)}}} {count}"
+                for (cache, result), count in self.cache_lookups.items()
+            ),
+        )
+        for key, name, kind, help_text in (
+            ("size", "db_pool_size", "gauge", "Configured pool size."),
+            ("checkedout", "db_pool_checkedout", "gauge", "In use."),
+            ("checkedin", "db_pool_checkedin", "gauge", "Idle in the pool."),
+            ("overflow", "db_pool_overflow", "gauge", "Over the pool size."),
+            ("wait_count", "db_pool_checkouts_total", "counter", "Checkouts."),
+            ("timeouts", "db_pool_timeouts_total", "counter", "Timeouts."),
+        ):
+            if key in pool_stats:
+                lines += metric(
+                    name, kind, help_text, [f"{name} {pool_stats[key]}"]
+                )
+        if "wait_time_total_ms" in pool_stats:
+            lines += metric(
+                "db_pool_wait_seconds_total",
+                "counter",
+                "Time spent getting connections from the pool.",
+                [
+                    "db_pool_wait_seconds_total "
+                    f"{pool_stats['wait_time_total_ms'] / 1000}"
+                ],
+            )
+        # Маршруты QueryMetrics - "METHOD /path"
+        routes = []
+        for name, stats in query_metrics.items():
+            method, _, route = name.partition(" ")
+            routes.append((format_labels(method=method, route=route), stats))
+        lines += metric(
+            "db_queries_total",
+            "counter",
+            "Database queries by route.",
+            (
+                f"db_queries_total{{{labels}}} {stats['queries']}"
+                for labels, stats in routes
+            ),
+        )
+        lines += metric(
+            "db_rows_total",
+            "counter",
+            "Rows returned by the database by route.",
+            (
+                f"db_rows_total{{{labels}}} {stats['rows']}"
+                for labels, stats in routes
+            ),
+        )
+        lines += metric(
+            "db_query_seconds_total",
+            "counter",
+            "Time spent in database queries by route.",
+            (
+                f"db_query_seconds_total{{{labels}}} "
+                f"{stats['duration_ms'] / 1000}"
+                for labels, stats in routes
+            ),
+        )
+        lines += metric(
+            "process_start_time_seconds",
+            "gauge",
+            "Start time of the process since unix epoch in seconds.",
+            [f"process_start_time_seconds {self.started}"],
+        )
+        return "\n".join(lines) + "\n"
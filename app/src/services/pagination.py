@@ -0,0 +1,24 @@
+import base64
+import json
+from typing import Tuple
+
+
+class InvalidCursor(ValueError): ...  # noqa E701
+
+
+def encode_cursor(*values) -> str:
+    """Упаковывает значения ключа пагинации в непрозрачную строку"""
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple:
+    """Распаковывает строку курсора, при ошибке вызывает InvalidCursor"""
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(cursor + padding))
+    except (ValueError, TypeError):
+        raise InvalidCursor("Invalid cursor")
+    if not isinstance(values, list) or not values:
+        raise InvalidCursor("Invalid cursor")
+    return tuple(values)
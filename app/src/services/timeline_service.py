@@ -0,0 +1,140 @@
+from sqlalchemy import Insert, Select, delete, func, literal, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from ..db import crud, models
+from ..settings import (
+    FANOUT_BATCH_SIZE,
+    FANOUT_FOLLOWERS_LIMIT,
+    TIMELINE_BACKFILL_SIZE,
+)
+
+
+def insert_entries(session: AsyncSession, rows: Select) -> Insert:
+    """INSERT строк (user_id, tweet_id) в timeline_entries, уже
+    существующие записи пропускаются: твит может попасть в ленту
+    одновременно при раскладке и при подписке на автора"""
+    return (
+        crud.insert(models.TimelineEntry, session)
+        .from_select(["user_id", "tweet_id"], rows)
+        .on_conflict_do_nothing(
+            index_elements=[
+                models.TimelineEntry.user_id,
+                models.TimelineEntry.tweet_id,
+            ]
+        )
+    )
+
+
+async def fan_out_tweet(
+    session_maker: sessionmaker, tweet_id: int, author_id: int, mode: str
+) -> None:
+    """Раскладывает твит по лентам (timeline_entries) автора и его
+    подписчиков. Подписчики обрабатываются частями по FANOUT_BATCH_SIZE
+    в порядке id, каждая часть - в своей транзакции, поэтому раскладка
+    твита автора с миллионами подписчиков не держит одну большую
+    транзакцию. В режиме hybrid твиты авторов, у которых подписчиков
+    не меньше FANOUT_FOLLOWERS_LIMIT, попадают только в ленту автора,
+    а сам автор помечается популярным и подмешивается в ленты при чтении.
+    Пометка не снимается, если подписчиков стало меньше: его прежние
+    твиты не разложены по лентам и без неё пропали бы из них"""
+    async with session_maker() as session:
+        # id твита выбирается из tweets, чтобы пропустить уже удалённый твит
+        await session.execute(
+            insert_entries(
+                session,
+                select(literal(author_id), models.Tweet.id).where(
+                    models.Tweet.id == tweet_id
+                ),
+            )
+        )
+        if mode == "hybrid":
+            followers_count = await session.scalar(
+                select(func.count()).where(
+                    models.Follower.following_id == author_id
+                )
+            )
+            if followers_count >= FANOUT_FOLLOWERS_LIMIT:
+                await session.execute(
+                    update(models.User)
+                    .where(models.User.id == author_id)
+                    .values(is_popular=True)
+                )
+                await crud.bump_versions([author_id], session)
+                await session.commit()
+                return
+        await session.commit()
+        followers = select(models.Follower.user_id).where(
+            models.Follower.following_id == author_id
+        )
+        after = 0
+        while after is not None:
+            # Последний подписчик части, None - до конца списка
+            last = await session.scalar(
+                followers.where(models.Follower.user_id > after)
+                .order_by(models.Follower.user_id)
+                .offset(FANOUT_BATCH_SIZE - 1)
+                .limit(1)
+            )
+            batch = followers.where(models.Follower.user_id > after)
+            if last is not None:
+                batch = batch.where(models.Follower.user_id <= last)
+            await session.execute(
+                insert_entries(
+                    session,
+                    batch.join(
+                        models.Tweet, models.Tweet.id == tweet_id
+                    ).with_only_columns(
+                        models.Follower.user_id, models.Tweet.id
+                    ),
+                )
+            )
+            # Ленты подписчиков изменились уже после ответа на публикацию
+            await crud.bump_versions([author_id], session)
+            await session.commit()
+            after = last
+
+
+async def backfill_following(
+    session_maker: sessionmaker, user_id: int, following_id: int, mode: str
+) -> None:
+    """Добавляет в ленту пользователя последние твиты нового автора"""
+    async with session_maker() as session:
+        if mode == "hybrid":
+            is_popular = await session.scalar(
+                select(models.User.is_popular).where(
+                    models.User.id == following_id
+                )
+            )
+            if is_popular:
+                return
+        await session.execute(
+            insert_entries(
+                session,
+                select(literal(user_id), models.Tweet.id)
+                .where(models.Tweet.author_id == following_id)
+                .order_by(models.Tweet.id.desc())
+                .limit(TIMELINE_BACKFILL_SIZE),
+            )
+        )
+        await crud.bump_versions([user_id], session)
+        await session.commit()
+
+
+async def prune_following(
+    session_maker: sessionmaker, user_id: int, following_id: int
+) -> None:
+    """Убирает из ленты пользователя твиты автора, от которого он отписался"""
+    async with session_maker() as session:
+        await session.execute(
+            delete(models.TimelineEntry).where(
+                models.TimelineEntry.user_id == user_id,
+                models.TimelineEntry.tweet_id.in_(
+                    select(models.Tweet.id).where(
+                        models.Tweet.author_id == following_id
+                    )
+                ),
+            )
+        )
+        await crud.bump_versions([user_id], session)
+        await session.commit()
@@ -1,3 +1,5 @@
+from typing import List, Literal
+
 from pydantic_settings import BaseSettings
 from pydantic import Field
 
@@ -6,8 +8,50 @@ class APISettings(BaseSettings):
     database: str
     database_user: str
     database_password: str
+    database_dsn: str = ""
     debug: str = "0"
     api_route: str = ""
+    feed_page_size: int = 20
+    feed_max_page_size: int = 100
+    timeline_mode: Literal["pull", "push", "hybrid"] = "pull"
+    fanout_followers_limit: int = 10000
+    fanout_batch_size: int = 1000
+    timeline_backfill_size: int = 100
+    auth_cache_size: int = 10000
+    auth_cache_ttl: float = 60
+    upload_max_size: int = 10 * 1024 * 1024
+    upload_chunk_size: int = 64 * 1024
+    image_workers: int = 2
+    profile_follows_preview: int = 10
+    follows_page_size: int = 50
+    follows_max_page_size: int = 500
+    legacy_full_profile: bool = False
+    like_flush_interval_ms: int = 500
+    feed_likers_sample: int = 10
+    search_candidates: int = 1000
+    search_window: int = 100000
+    search_max_query_length: int = 200
+    db_pool_size: int = 10
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = False
+    db_prepared_statement_cache_size: int = 100
+    db_statement_timeout_ms: int = 0
+    db_repeated_query_threshold: int = 10
+    database_replicas: List[str] = []
+    replica_sticky_seconds: float = 5
+    web_host: str = "0.0.0.0"
+    web_port: int = 8000
+    web_workers: int = 1
+    web_keepalive_timeout: int = 75
+    web_graceful_timeout: int = 30
+    web_backlog: int = 2048
+    cache_url: str = ""
+    cache_ttl: float = 30
+    cache_size: int = 10000
+    openapi_schema_path: str = "openapi.json"
+
 
 Settings = APISettings().model_dump()
 
@@ -16,5 +60,47 @@ DATABASE_USER = Settings.get("database_user")
 DATABASE_PASSWORD = Settings.get("database_password")
 DEBUG = bool(int(Settings.get("debug")))
 DATABASE_URL = "database"
+DATABASE_DSN = Settings.get("database_dsn")
 API_ROUTE = Settings.get("api_route")
-
+FEED_PAGE_SIZE = Settings.get("feed_page_size")
+FEED_MAX_PAGE_SIZE = Settings.get("feed_max_page_size")
+TIMELINE_MODE = Settings.get("timeline_mode")
+FANOUT_FOLLOWERS_LIMIT = Settings.get("fanout_followers_limit")
+FANOUT_BATCH_SIZE = Settings.get("fanout_batch_size")
+TIMELINE_BACKFILL_SIZE = Settings.get("timeline_backfill_size")
+AUTH_CACHE_SIZE = Settings.get("auth_cache_size")
+AUTH_CACHE_TTL = Settings.get("auth_cache_ttl")
+UPLOAD_MAX_SIZE = Settings.get("upload_max_size")
+UPLOAD_CHUNK_SIZE = Settings.get("upload_chunk_size")
+IMAGE_WORKERS = Settings.get("image_workers")
+PROFILE_FOLLOWS_PREVIEW = Settings.get("profile_follows_preview")
+FOLLOWS_PAGE_SIZE = Settings.get("follows_page_size")
+FOLLOWS_MAX_PAGE_SIZE = Settings.get("follows_max_page_size")
+LEGACY_FULL_PROFILE = Settings.get("legacy_full_profile")
+LIKE_FLUSH_INTERVAL_MS = Settings.get("like_flush_interval_ms")
+FEED_LIKERS_SAMPLE = Settings.get("feed_likers_sample")
+SEARCH_CANDIDATES = Settings.get("search_candidates")
+SEARCH_WINDOW = Settings.get("search_window")
+SEARCH_MAX_QUERY_LENGTH = Settings.get("search_max_query_length")
+DB_POOL_SIZE = Settings.get("db_pool_size")
+DB_MAX_OVERFLOW = Settings.get("db_max_overflow")
+DB_POOL_TIMEOUT = Settings.get("db_pool_timeout")
+DB_POOL_RECYCLE = Settings.get("db_pool_recycle")
+DB_POOL_PRE_PING = Settings.get("db_pool_pre_ping")
+DB_PREPARED_STATEMENT_CACHE_SIZE = Settings.get(
+    "db_prepared_statement_cache_size"
+)
+DB_STATEMENT_TIMEOUT_MS = Settings.get("db_statement_timeout_ms")
+DB_REPEATED_QUERY_THRESHOLD = Settings.get("db_repeated_query_threshold")
+DATABASE_REPLICAS = Settings.get("database_replicas")
+REPLICA_STICKY_SECONDS = Settings.get("replica_sticky_seconds")
+WEB_HOST = Settings.get("web_host")
+WEB_PORT = Settings.get("web_port")
+WEB_WORKERS = Settings.get("web_workers")
+WEB_KEEPALIVE_TIMEOUT = Settings.get("web_keepalive_timeout")
+WEB_GRACEFUL_TIMEOUT = Settings.get("web_graceful_timeout")
+WEB_BACKLOG = Settings.get("web_backlog")
+CACHE_URL = Settings.get("cache_url")
+CACHE_TTL = Settings.get("cache_ttl")
+CACHE_SIZE = Settings.get("cache_size")
+OPENAPI_SCHEMA_PATH = Settings.get("openapi_schema_path")
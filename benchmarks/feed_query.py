@@ -0,0 +1,119 @@
+"""Бенчмарк запроса ленты (GET /tweets) на PostgreSQL.
+
+Заполняет пустую БД: один читатель, подписанный на ``--followees``
+авторов, и ``--tweets`` твитов, распределённых между ``--authors``
+авторами. Затем замеряет время первой и «глубокой» страницы ленты
+для запроса с LATERAL по индексу (author_id, id DESC) и для простого
+``author_id IN (...)``.
+
+    python3 benchmarks/feed_query.py --dsn postgresql+asyncpg://u:p@localhost/bench
+
+ВНИМАНИЕ: все таблицы в указанной БД будут пересозданы.
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.relpath("."))
+
+from sqlalchemy import func, select, text  # noqa E402
+from sqlalchemy.ext.asyncio import create_async_engine  # noqa E402
+
+from app.src.db import crud, models  # noqa E402
+
+READER_ID = 1
+
+
+async def seed(engine, authors: int, followees: int, tweets: int) -> None:
+    async with engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.drop_all)
+        await conn.run_sync(models.Base.metadata.create_all)
+        await conn.execute(
+            text(
+                "INSERT INTO users (id, name, api_key) "
+                "SELECT i, 'user ' || i, 'key' || i "
+                "FROM generate_series(1, :n) AS i"
+            ),
+            {"n": authors + 1},
+        )
+        await conn.execute(
+            text(
+                "INSERT INTO followers (user_id, following_id) "
+                "SELECT :reader, i FROM generate_series(2, :n) AS i"
+            ),
+            {"reader": READER_ID, "n": followees + 1},
+        )
+        await conn.execute(
+            text(
+                "INSERT INTO tweets (content, author_id) "
+                "SELECT 'tweet ' || i, 2 + (i::bigint * 7919) % :authors "
+                "FROM generate_series(1, :n) AS i"
+            ),
+            {"authors": authors, "n": tweets},
+        )
+    vacuum = engine.execution_options(isolation_level="AUTOCOMMIT")
+    async with vacuum.connect() as conn:
+        await conn.execute(text("VACUUM ANALYZE"))
+
+
+async def measure(engine, dialect: str, limit: int, before_id, repeat: int):
+    stmt = crud.stmt_feed_ids(READER_ID, dialect, limit, before_id=before_id)
+    timings = []
+    async with engine.connect() as conn:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            (await conn.execute(stmt)).all()
+            timings.append((time.perf_counter() - start) * 1000)
+        sql = stmt.compile(
+            engine.sync_engine, compile_kwargs={"literal_binds": True}
+        )
+        explain = await conn.execute(
+            text(f"EXPLAIN (ANALYZE, BUFFERS) {sql}")
+        )
+        plan = "\n".join(row[0] for row in explain)
+    return timings, plan
+
+
+async def main(args) -> None:
+    engine = create_async_engine(args.dsn)
+    if not args.skip_seed:
+        start = time.perf_counter()
+        await seed(engine, args.authors, args.followees, args.tweets)
+        print(f"seed: {time.perf_counter() - start:.1f}s")
+    async with engine.connect() as conn:
+        max_id = await conn.scalar(select(func.max(models.Tweet.id)))
+    pages = {"first page": None, "deep page": max_id // 2}
+    for dialect, name in (("postgresql", "LATERAL"), ("generic", "IN")):
+        for page, before_id in pages.items():
+            timings, plan = await measure(
+                engine, dialect, args.limit, before_id, args.repeat
+            )
+            print(
+                f"{name:8} {page:11} "
+                f"p50={statistics.median(timings):8.2f}ms "
+                f"max={max(timings):8.2f}ms"
+            )
+            if args.explain:
+                print(plan)
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--dsn",
+        default=os.environ.get("BENCH_DATABASE_URL"),
+        required="BENCH_DATABASE_URL" not in os.environ,
+    )
+    parser.add_argument("--authors", type=int, default=100_000)
+    parser.add_argument("--followees", type=int, default=10_000)
+    parser.add_argument("--tweets", type=int, default=10_000_000)
+    parser.add_argument("--limit", type=int, default=21)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--skip-seed", action="store_true")
+    parser.add_argument("--explain", action="store_true")
+    asyncio.run(main(parser.parse_args()))
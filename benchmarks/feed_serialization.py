@@ -0,0 +1,149 @@
+"""Бенчмарк сборки ответа ленты (GET /tweets) на PostgreSQL.
+
+Сравнивает загрузку ORM-графов твитов с валидацией schemas.Tweet
+и сборку JSON-документов твитов в запросе (get_following_tweet_documents).
+Замеряется время от запроса к БД до готового тела ответа.
+
+    python3 benchmarks/feed_serialization.py --dsn postgresql+asyncpg://u:p@localhost/bench
+
+ВНИМАНИЕ: все таблицы в указанной БД будут пересозданы.
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.relpath("."))
+
+from sqlalchemy import text  # noqa E402
+from sqlalchemy.ext.asyncio import AsyncSession  # noqa E402
+from sqlalchemy.ext.asyncio import create_async_engine  # noqa E402
+from sqlalchemy.orm import sessionmaker  # noqa E402
+
+from app.src.api import schemas  # noqa E402
+from app.src.db import crud, loaders, models  # noqa E402
+
+READER_ID = 1
+
+
+async def seed(engine, users: int, tweets: int, likes: int) -> None:
+    async with engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.drop_all)
+        await conn.run_sync(models.Base.metadata.create_all)
+        await conn.execute(
+            text(
+                "INSERT INTO users (id, name, api_key) "
+                "SELECT i, 'user ' || i, 'key' || i "
+                "FROM generate_series(1, :n) AS i"
+            ),
+            {"n": users},
+        )
+        await conn.execute(
+            text(
+                "INSERT INTO followers (user_id, following_id) "
+                "SELECT :reader, i FROM generate_series(2, :n) AS i"
+            ),
+            {"reader": READER_ID, "n": users},
+        )
+        await conn.execute(
+            text(
+                "INSERT INTO tweets (id, content, author_id) "
+                "SELECT i, repeat('tweet text ', 10) || i, "
+                "2 + i % (:users - 1) FROM generate_series(1, :n) AS i"
+            ),
+            {"users": users, "n": tweets},
+        )
+        await conn.execute(
+            text(
+                "INSERT INTO likes (tweet_id, user_id) "
+                "SELECT t, 1 + (t::bigint * 7919 + l) % :users "
+                "FROM generate_series(1, :n) AS t, "
+                "generate_series(1, :likes) AS l ON CONFLICT DO NOTHING"
+            ),
+            {"users": users, "n": tweets, "likes": likes},
+        )
+        await conn.execute(
+            text(
+                "INSERT INTO images (id, path, status) "
+                "SELECT i, 'images/' || i || '.jpg', 'ready' "
+                "FROM generate_series(1, :n) AS i"
+            ),
+            {"n": tweets // 2},
+        )
+        await conn.execute(
+            text(
+                "INSERT INTO tweetsimages (tweet_id, image_id) "
+                "SELECT i * 2, i FROM generate_series(1, :n) AS i"
+            ),
+            {"n": tweets // 2},
+        )
+    vacuum = engine.execution_options(isolation_level="AUTOCOMMIT")
+    async with vacuum.connect() as conn:
+        await conn.execute(text("VACUUM ANALYZE"))
+
+
+async def orm_page(session, limit: int) -> bytes:
+    tweets = await crud.get_following_tweets(
+        READER_ID, session, limit, options=loaders.FEED
+    )
+    result = schemas.TweetsResult(
+        result=True,
+        tweets=[schemas.Tweet.model_validate(tweet) for tweet in tweets],
+    )
+    return result.model_dump_json(exclude_none=True).encode()
+
+
+async def documents_page(session, limit: int) -> bytes:
+    tweets = await crud.get_following_tweet_documents(
+        READER_ID, session, limit
+    )
+    content = '{"result":true,"tweets":['
+    content += ",".join(tweet.document for tweet in tweets)
+    return (content + "]}").encode()
+
+
+async def measure(session_maker, page, limit: int, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        async with session_maker() as session:
+            start = time.perf_counter()
+            await page(session, limit)
+            timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+async def main(args) -> None:
+    engine = create_async_engine(args.dsn)
+    if not args.skip_seed:
+        start = time.perf_counter()
+        await seed(engine, args.users, args.tweets, args.likes)
+        print(f"seed: {time.perf_counter() - start:.1f}s")
+    session_maker = sessionmaker(engine, class_=AsyncSession)
+    for limit in args.limits:
+        for name, page in (("ORM", orm_page), ("documents", documents_page)):
+            timings = await measure(session_maker, page, limit, args.repeat)
+            print(
+                f"{name:9} limit={limit:<4} "
+                f"p50={statistics.median(timings):8.2f}ms "
+                f"max={max(timings):8.2f}ms"
+            )
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--dsn",
+        default=os.environ.get("BENCH_DATABASE_URL"),
+        required="BENCH_DATABASE_URL" not in os.environ,
+    )
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--tweets", type=int, default=100_000)
+    parser.add_argument("--likes", type=int, default=20)
+    parser.add_argument("--limits", type=int, nargs="+", default=[20, 100])
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--skip-seed", action="store_true")
+    asyncio.run(main(parser.parse_args()))
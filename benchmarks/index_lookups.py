@@ -0,0 +1,190 @@
+"""Бенчмарк индексов горячих запросов на PostgreSQL.
+
+Заполняет пустую БД ``--users`` пользователями, ``--follows`` подписками
+и ``--likes`` лайками, затем замеряет аутентификацию по api-key,
+лайк/снятие лайка и подписку/отписку (вместе с чтением списка
+подписчиков профиля) с индексами моделей и без них.
+
+    python3 benchmarks/index_lookups.py --dsn postgresql+asyncpg://u:p@localhost/bench
+
+ВНИМАНИЕ: все таблицы в указанной БД будут пересозданы.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.relpath("."))
+
+from sqlalchemy import delete, insert, select, text  # noqa E402
+from sqlalchemy.ext.asyncio import create_async_engine  # noqa E402
+
+from app.src.db import models  # noqa E402
+
+# Индексы из моделей, которые сравниваются с их отсутствием
+INDEXES = [
+    "ix_users_api_key",
+    "ix_followers_following_id_user_id",
+    "ix_likes_user_id",
+    "ix_tweetsimages_tweet_id",
+    "ix_tweetsimages_image_id",
+]
+
+
+async def seed(engine, users: int, follows: int, likes: int) -> None:
+    async with engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.drop_all)
+        await conn.run_sync(models.Base.metadata.create_all)
+        await conn.execute(
+            text(
+                "INSERT INTO users (id, name, api_key) "
+                "SELECT i, 'user ' || i, md5(i::text) "
+                "FROM generate_series(1, :n) AS i"
+            ),
+            {"n": users},
+        )
+        await conn.execute(
+            text(
+                "INSERT INTO tweets (id, content, author_id) "
+                "SELECT i, 'tweet ' || i, i FROM generate_series(1, :n) AS i"
+            ),
+            {"n": users},
+        )
+        await conn.execute(
+            text(
+                "INSERT INTO followers (user_id, following_id) "
+                "SELECT 1 + (i::bigint * 7919) % :users, "
+                "1 + (i::bigint * 104729 + 1) % :users "
+                "FROM generate_series(1, :n) AS i ON CONFLICT DO NOTHING"
+            ),
+            {"users": users, "n": follows},
+        )
+        await conn.execute(
+            text("DELETE FROM followers WHERE user_id = following_id")
+        )
+        await conn.execute(
+            text(
+                "INSERT INTO likes (tweet_id, user_id) "
+                "SELECT 1 + (i::bigint * 15485863) % :users, "
+                "1 + (i::bigint * 32452843 + 7) % :users "
+                "FROM generate_series(1, :n) AS i ON CONFLICT DO NOTHING"
+            ),
+            {"users": users, "n": likes},
+        )
+    await analyze(engine)
+
+
+async def analyze(engine) -> None:
+    vacuum = engine.execution_options(isolation_level="AUTOCOMMIT")
+    async with vacuum.connect() as conn:
+        await conn.execute(text("VACUUM ANALYZE"))
+
+
+async def auth(conn, user_id: int) -> None:
+    api_key = hashlib.md5(str(user_id).encode()).hexdigest()
+    await conn.execute(models.User.stmt_user_by_api_key(api_key))
+
+
+async def like_unlike(conn, user_id: int) -> None:
+    tweet_id = user_id % 1000 + 1
+    await conn.execute(models.Like.stmt_like_by_user_tweet(user_id, tweet_id))
+    await conn.execute(
+        insert(models.Like).values(tweet_id=tweet_id, user_id=user_id)
+    )
+    await conn.execute(
+        select(models.Like.tweet_id).where(models.Like.user_id == user_id)
+    )
+    await conn.execute(
+        delete(models.Like).where(
+            models.Like.tweet_id == tweet_id, models.Like.user_id == user_id
+        )
+    )
+
+
+async def follow_unfollow(conn, user_id: int) -> None:
+    following_id = user_id % 1000 + 1
+    await conn.execute(
+        insert(models.Follower).values(
+            user_id=user_id, following_id=following_id
+        )
+    )
+    await conn.execute(
+        select(models.Follower.user_id).where(
+            models.Follower.following_id == following_id
+        )
+    )
+    await conn.execute(
+        delete(models.Follower).where(
+            models.Follower.user_id == user_id,
+            models.Follower.following_id == following_id,
+        )
+    )
+
+
+async def measure(engine, operation, users: int, repeat: int):
+    rnd = random.Random(1)
+    timings = []
+    async with engine.connect() as conn:
+        for _ in range(repeat):
+            user_id = rnd.randint(1001, users)
+            start = time.perf_counter()
+            await operation(conn, user_id)
+            timings.append((time.perf_counter() - start) * 1000)
+        await conn.rollback()
+    return timings
+
+
+async def set_indexes(engine, enabled: bool) -> None:
+    async with engine.begin() as conn:
+        for table in models.Base.metadata.sorted_tables:
+            for index in table.indexes:
+                if index.name not in INDEXES:
+                    continue
+                if enabled:
+                    await conn.run_sync(index.create, checkfirst=True)
+                else:
+                    await conn.run_sync(index.drop, checkfirst=True)
+    await analyze(engine)
+
+
+async def main(args) -> None:
+    engine = create_async_engine(args.dsn)
+    if not args.skip_seed:
+        start = time.perf_counter()
+        await seed(engine, args.users, args.follows, args.likes)
+        print(f"seed: {time.perf_counter() - start:.1f}s")
+    operations = {
+        "auth": auth,
+        "like/unlike": like_unlike,
+        "follow/unfollow": follow_unfollow,
+    }
+    for enabled, name in ((False, "no indexes"), (True, "indexed")):
+        await set_indexes(engine, enabled)
+        for operation_name, operation in operations.items():
+            timings = await measure(engine, operation, args.users, args.repeat)
+            print(
+                f"{name:10} {operation_name:15} "
+                f"p50={statistics.median(timings):8.2f}ms "
+                f"max={max(timings):8.2f}ms"
+            )
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--dsn",
+        default=os.environ.get("BENCH_DATABASE_URL"),
+        required="BENCH_DATABASE_URL" not in os.environ,
+    )
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--follows", type=int, default=5_000_000)
+    parser.add_argument("--likes", type=int, default=5_000_000)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--skip-seed", action="store_true")
+    asyncio.run(main(parser.parse_args()))
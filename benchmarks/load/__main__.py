@@ -0,0 +1,162 @@
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import httpx
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from . import __doc__ as usage
+from .report import build_report, compare_reports, print_report, save_report
+from .scenario import run_load
+from .seed import dataset_size, seed, timeline_filled
+
+
+async def run_seed(args) -> None:
+    engine = create_async_engine(args.dsn)
+    counts = await seed(
+        engine,
+        args.users,
+        args.tweets,
+        following=args.following,
+        likes=args.likes,
+        exponent=args.exponent,
+        seed_value=args.seed,
+        mode=args.mode,
+        fanout_limit=args.fanout_limit,
+    )
+    await engine.dispose()
+    print(counts)
+
+
+def import_app(dsn: str):
+    """Импортирует приложение с БД из dsn. Настройки читаются при
+    импорте, поэтому окружение задаётся до него"""
+    os.environ["DATABASE_DSN"] = dsn
+    for name in ("DATABASE", "DATABASE_USER", "DATABASE_PASSWORD"):
+        os.environ.setdefault(name, "load")
+    from app.src.api.app import app
+    from app.src.api.app_depends import get_static_image_path
+
+    static_path = tempfile.mkdtemp(prefix="load-static-")
+
+    async def get_load_static_path():
+        yield static_path
+
+    app.dependency_overrides[get_static_image_path] = get_load_static_path
+    return app
+
+
+async def load(args, client: httpx.AsyncClient, users: int, tweets: int):
+    start = time.perf_counter()
+    samples = await run_load(
+        client,
+        users,
+        tweets,
+        args.concurrency,
+        args.duration,
+        exponent=args.exponent,
+        seed_value=args.seed,
+    )
+    return samples, time.perf_counter() - start
+
+
+async def run(args) -> None:
+    limits = httpx.Limits(max_connections=args.concurrency)
+    if args.url:
+        users, tweets = args.users, args.tweets
+        async with httpx.AsyncClient(
+            base_url=args.url, limits=limits, timeout=30
+        ) as client:
+            samples, duration = await load(args, client, users, tweets)
+        target = args.url
+    else:
+        app = import_app(args.dsn)
+        from app.src.settings import TIMELINE_MODE
+
+        engine = create_async_engine(args.dsn)
+        users, tweets = await dataset_size(engine)
+        filled = await timeline_filled(engine)
+        await engine.dispose()
+        if TIMELINE_MODE != "pull" and not filled:
+            raise SystemExit(
+                f"TIMELINE_MODE={TIMELINE_MODE}, but timeline_entries is "
+                f"empty: seed the database with --mode {TIMELINE_MODE}"
+            )
+        transport = httpx.ASGITransport(app=app)
+        async with app.router.lifespan_context(app):
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://load", timeout=30
+            ) as client:
+                samples, duration = await load(args, client, users, tweets)
+        target = "asgi"
+    report = build_report(
+        samples,
+        duration,
+        {
+            "target": target,
+            "users": users,
+            "tweets": tweets,
+            "concurrency": args.concurrency,
+            "exponent": args.exponent,
+            "seed": args.seed,
+        },
+    )
+    print_report(report)
+    if args.output:
+        save_report(report, args.output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="python3 -m benchmarks.load",
+        description=usage,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    seed_parser = commands.add_parser("seed", help="fill the database")
+    seed_parser.add_argument("--dsn", required=True)
+    seed_parser.add_argument("--users", type=int, default=10_000)
+    seed_parser.add_argument("--tweets", type=int, default=100_000)
+    seed_parser.add_argument("--following", type=float, default=50)
+    seed_parser.add_argument("--likes", type=float, default=5)
+    seed_parser.add_argument("--exponent", type=float, default=1.0)
+    seed_parser.add_argument("--seed", type=int, default=1)
+    seed_parser.add_argument(
+        "--mode",
+        choices=["pull", "push", "hybrid"],
+        default="pull",
+        help="TIMELINE_MODE of the loaded application",
+    )
+    seed_parser.add_argument(
+        "--fanout-limit",
+        type=int,
+        default=10000,
+        help="FANOUT_FOLLOWERS_LIMIT of the loaded application",
+    )
+
+    run_parser = commands.add_parser("run", help="load the application")
+    target = run_parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--dsn", help="run the app in this process")
+    target.add_argument("--url", help="load a running server")
+    run_parser.add_argument("--users", type=int, default=10_000)
+    run_parser.add_argument("--tweets", type=int, default=100_000)
+    run_parser.add_argument("--concurrency", type=int, default=32)
+    run_parser.add_argument("--duration", type=float, default=30)
+    run_parser.add_argument("--exponent", type=float, default=1.0)
+    run_parser.add_argument("--seed", type=int, default=1)
+    run_parser.add_argument("--output", help="JSON report path")
+
+    compare_parser = commands.add_parser("compare", help="compare reports")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+
+    arguments = parser.parse_args()
+    if arguments.command == "seed":
+        asyncio.run(run_seed(arguments))
+    elif arguments.command == "run":
+        asyncio.run(run(arguments))
+    else:
+        compare_reports(arguments.old, arguments.new)
@@ -0,0 +1,119 @@
+"""Отчёт нагрузочного теста: задержки и RPS по конечным точкам в JSON."""
+
+import json
+import math
+import platform
+import subprocess
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# (конечная точка, код ответа или 0 при ошибке соединения, задержка в мс)
+Sample = Tuple[str, int, float]
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """Перцентиль по ближайшему рангу, values отсортированы"""
+    if not values:
+        return 0.0
+    return values[max(math.ceil(q / 100 * len(values)) - 1, 0)]
+
+
+def summarize(latencies: List[float], statuses: Dict, duration: float):
+    latencies = sorted(latencies)
+    errors = sum(
+        count
+        for status, count in statuses.items()
+        if status == 0 or status >= 500
+    )
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "statuses": {str(status): count for status, count in statuses.items()},
+        "rps": round(len(latencies) / duration, 1),
+        "mean_ms": round(sum(latencies) / max(len(latencies), 1), 2),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "max_ms": round(latencies[-1] if latencies else 0.0, 2),
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            text=True,
+            stderr=subprocess.DEVNULL,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_report(samples: List[Sample], duration: float, meta: dict) -> dict:
+    latencies = defaultdict(list)
+    statuses = defaultdict(lambda: defaultdict(int))
+    for endpoint, status, latency in samples:
+        latencies[endpoint].append(latency)
+        statuses[endpoint][status] += 1
+    total_statuses = defaultdict(int)
+    for endpoint_statuses in statuses.values():
+        for status, count in endpoint_statuses.items():
+            total_statuses[status] += count
+    return {
+        "meta": {
+            **meta,
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "duration_s": round(duration, 2),
+        },
+        "total": summarize(
+            [sample[2] for sample in samples], total_statuses, duration
+        ),
+        "endpoints": {
+            endpoint: summarize(
+                latencies[endpoint], statuses[endpoint], duration
+            )
+            for endpoint in sorted(latencies)
+        },
+    }
+
+
+def print_report(report: dict) -> None:
+    rows = [("total", report["total"]), *report["endpoints"].items()]
+    print(
+        f"{'endpoint':32} {'requests':>8} {'errors':>6} {'rps':>8} "
+        f"{'p50':>8} {'p95':>8} {'p99':>8}"
+    )
+    for name, stats in rows:
+        print(
+            f"{name:32} {stats['requests']:8} {stats['errors']:6} "
+            f"{stats['rps']:8.1f} {stats['p50_ms']:8.2f} "
+            f"{stats['p95_ms']:8.2f} {stats['p99_ms']:8.2f}"
+        )
+
+
+def save_report(report: dict, path: str) -> None:
+    with open(path, "w") as file:
+        json.dump(report, file, indent=2, ensure_ascii=False)
+
+
+def compare_reports(old_path: str, new_path: str) -> None:
+    """Печатает изменение RPS и перцентилей между двумя отчётами"""
+    with open(old_path) as old_file, open(new_path) as new_file:
+        old, new = json.load(old_file), json.load(new_file)
+    print(f"{old['meta'].get('commit')} -> {new['meta'].get('commit')}")
+    print(f"{'endpoint':32} {'rps':>16} {'p50':>16} {'p95':>16} {'p99':>16}")
+    rows = [("total", old["total"], new["total"])]
+    rows += [
+        (name, old["endpoints"][name], stats)
+        for name, stats in new["endpoints"].items()
+        if name in old["endpoints"]
+    ]
+    for name, before, after in rows:
+        cells = []
+        for key in ("rps", "p50_ms", "p95_ms", "p99_ms"):
+            change = (after[key] - before[key]) / (before[key] or 1) * 100
+            cells.append(f"{after[key]:8.1f} {change:+6.1f}%")
+        print(f"{name:32} " + " ".join(cells))
@@ -0,0 +1,243 @@
+"""Сценарий нагрузки: виртуальные пользователи выполняют взвешенную
+смесь запросов ко всем конечным точкам API.
+
+Каждый виртуальный пользователь - отдельная корутина со своим api-key
+(пользователи выбираются по популярности, как в seed.py) и состоянием:
+ETag и курсор ленты, свои твиты, лайки и подписки, чтобы удаления
+и повторные опросы были осмысленными.
+"""
+
+import asyncio
+import io
+import random
+import time
+from typing import Callable, Dict, List, Optional
+
+import httpx
+
+from .report import Sample
+from .seed import WORDS, PowerLaw
+
+# Доли запросов в смеси, примерно как у читающей ленты соцсети
+WEIGHTS: Dict[str, float] = {
+    "GET /tweets": 30,
+    "GET /tweets cursor": 8,
+    "GET /tweets If-None-Match": 15,
+    "GET /tweets/search": 3,
+    "GET /users/me": 8,
+    "GET /users/{id}": 10,
+    "GET /users/{id}/followers": 4,
+    "GET /users/{id}/following": 4,
+    "POST /tweets": 4,
+    "DELETE /tweets/{id}": 2,
+    "POST /tweets/{id}/likes": 6,
+    "DELETE /tweets/{id}/likes": 3,
+    "POST /users/{id}/follow": 2,
+    "DELETE /users/{id}/follow": 1,
+    "POST /medias": 1,
+}
+
+
+def make_image() -> bytes:
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64), (200, 120, 40)).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+class VirtualUser:
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        samples: List[Sample],
+        user_id: int,
+        users: PowerLaw,
+        tweets: int,
+        rnd: random.Random,
+        image: bytes,
+    ) -> None:
+        self.client = client
+        self.samples = samples
+        self.user_id = user_id
+        self.headers = {"api-key": f"key{user_id}"}
+        self.users = users
+        self.tweets = tweets
+        self.rnd = rnd
+        self.image = image
+        self.feed_etag: Optional[str] = None
+        self.next_cursor: Optional[str] = None
+        self.own_tweets: List[int] = []
+        self.liked: List[int] = []
+        self.followed: List[int] = []
+        self.actions: Dict[str, Callable] = {
+            "GET /tweets": self.get_feed,
+            "GET /tweets cursor": self.get_next_page,
+            "GET /tweets If-None-Match": self.poll_feed,
+            "GET /tweets/search": self.search,
+            "GET /users/me": self.get_me,
+            "GET /users/{id}": self.get_user,
+            "GET /users/{id}/followers": self.get_followers,
+            "GET /users/{id}/following": self.get_following,
+            "POST /tweets": self.post_tweet,
+            "DELETE /tweets/{id}": self.delete_tweet,
+            "POST /tweets/{id}/likes": self.like,
+            "DELETE /tweets/{id}/likes": self.unlike,
+            "POST /users/{id}/follow": self.follow,
+            "DELETE /users/{id}/follow": self.unfollow,
+            "POST /medias": self.post_media,
+        }
+
+    async def request(
+        self, name: str, method: str, url: str, **kwargs
+    ) -> Optional[httpx.Response]:
+        headers = {**self.headers, **kwargs.pop("headers", {})}
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(
+                method, url, headers=headers, **kwargs
+            )
+        except httpx.HTTPError:
+            response = None
+        latency = (time.perf_counter() - start) * 1000
+        status = response.status_code if response is not None else 0
+        self.samples.append((name, status, latency))
+        return response
+
+    def other_user(self) -> int:
+        return self.users.sample(1)[0]
+
+    def random_tweet(self) -> int:
+        return self.rnd.randint(1, max(self.tweets, 1))
+
+    async def get_feed(self, name: str) -> None:
+        response = await self.request(name, "GET", "/tweets")
+        if response is not None and response.status_code == 200:
+            self.feed_etag = response.headers.get("etag")
+            self.next_cursor = response.json().get("next_cursor")
+
+    async def get_next_page(self, name: str) -> None:
+        if self.next_cursor is None:
+            return await self.get_feed("GET /tweets")
+        response = await self.request(
+            name, "GET", "/tweets", params={"cursor": self.next_cursor}
+        )
+        if response is not None and response.status_code == 200:
+            self.next_cursor = response.json().get("next_cursor")
+
+    async def poll_feed(self, name: str) -> None:
+        if self.feed_etag is None:
+            return await self.get_feed("GET /tweets")
+        response = await self.request(
+            name, "GET", "/tweets", headers={"if-none-match": self.feed_etag}
+        )
+        if response is not None and response.status_code == 200:
+            self.feed_etag = response.headers.get("etag")
+
+    async def search(self, name: str) -> None:
+        words = " ".join(self.rnd.choices(WORDS, k=self.rnd.randint(1, 2)))
+        await self.request(name, "GET", "/tweets/search", params={"q": words})
+
+    async def get_me(self, name: str) -> None:
+        await self.request(name, "GET", "/users/me")
+
+    async def get_user(self, name: str) -> None:
+        await self.request(name, "GET", f"/users/{self.other_user()}")
+
+    async def get_followers(self, name: str) -> None:
+        await self.request(
+            name, "GET", f"/users/{self.other_user()}/followers"
+        )
+
+    async def get_following(self, name: str) -> None:
+        await self.request(
+            name, "GET", f"/users/{self.other_user()}/following"
+        )
+
+    async def post_tweet(self, name: str) -> None:
+        response = await self.request(
+            name,
+            "POST",
+            "/tweets",
+            json={"tweet_data": f"load test {self.rnd.random()}"},
+        )
+        if response is not None and response.status_code == 201:
+            self.own_tweets.append(response.json()["tweet_id"])
+
+    async def delete_tweet(self, name: str) -> None:
+        if not self.own_tweets:
+            return await self.post_tweet("POST /tweets")
+        tweet_id = self.own_tweets.pop()
+        await self.request(name, "DELETE", f"/tweets/{tweet_id}")
+
+    async def like(self, name: str) -> None:
+        tweet_id = self.random_tweet()
+        response = await self.request(
+            name, "POST", f"/tweets/{tweet_id}/likes"
+        )
+        if response is not None and response.status_code < 300:
+            self.liked.append(tweet_id)
+
+    async def unlike(self, name: str) -> None:
+        if not self.liked:
+            return await self.like("POST /tweets/{id}/likes")
+        tweet_id = self.liked.pop()
+        await self.request(name, "DELETE", f"/tweets/{tweet_id}/likes")
+
+    async def follow(self, name: str) -> None:
+        user_id = self.other_user()
+        response = await self.request(name, "POST", f"/users/{user_id}/follow")
+        if response is not None and response.status_code < 300:
+            self.followed.append(user_id)
+
+    async def unfollow(self, name: str) -> None:
+        if not self.followed:
+            return await self.follow("POST /users/{id}/follow")
+        user_id = self.followed.pop()
+        await self.request(name, "DELETE", f"/users/{user_id}/follow")
+
+    async def post_media(self, name: str) -> None:
+        await self.request(
+            name,
+            "POST",
+            "/medias",
+            files={"file": ("load.jpg", self.image, "image/jpeg")},
+        )
+
+    async def run(self, deadline: float) -> None:
+        names, weights = list(WEIGHTS), list(WEIGHTS.values())
+        while time.perf_counter() < deadline:
+            name = self.rnd.choices(names, weights)[0]
+            await self.actions[name](name)
+
+
+async def run_load(
+    client: httpx.AsyncClient,
+    users: int,
+    tweets: int,
+    concurrency: int,
+    duration: float,
+    exponent: float = 1.0,
+    seed_value: int = 1,
+) -> List[Sample]:
+    """Запускает concurrency виртуальных пользователей на duration
+    секунд, возвращает замеры всех запросов"""
+    rnd = random.Random(seed_value)
+    popularity = PowerLaw(users, exponent, rnd)
+    image = make_image()
+    samples: List[Sample] = []
+    virtual_users = [
+        VirtualUser(
+            client,
+            samples,
+            user_id,
+            popularity,
+            tweets,
+            random.Random(rnd.random()),
+            image,
+        )
+        for user_id in popularity.sample(concurrency)
+    ]
+    deadline = time.perf_counter() + duration
+    await asyncio.gather(*(user.run(deadline) for user in virtual_users))
+    return samples
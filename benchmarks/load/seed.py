@@ -0,0 +1,258 @@
+"""Синтетический социальный граф для нагрузочных тестов.
+
+Популярность пользователей распределена по закону Ципфа: немногие
+пользователи собирают большую часть подписчиков и пишут больше твитов,
+число лайков у твита имеет распределение Парето. Строки генерируются
+потоком и записываются частями через COPY (PostgreSQL) или executemany
+(остальные БД), поэтому память не зависит от размера графа.
+api-key пользователя i - ``key<i>``. Для режимов ленты push и hybrid
+(TIMELINE_MODE) ленты timeline_entries и флаги популярности авторов
+заполняются так же, как их заполнило бы приложение при публикации.
+"""
+
+import itertools
+import random
+import time
+from typing import Iterable, Iterator, List, Sequence, Tuple
+
+from sqlalchemy import func, insert, literal, select, text, union_all, update
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from app.src.db import models
+
+CHUNK_SIZE = 50_000
+WORDS = [
+    "".join(chars)
+    for chars in itertools.islice(
+        itertools.product("bcdfgklmnprstvz", "aeiou", "lmnrst", "aeiou"), 2000
+    )
+]
+
+
+class PowerLaw:
+    """Выбор пользователей 1..n с вероятностью, обратной рангу
+    популярности в степени exponent. Ранги перемешаны, чтобы
+    популярность не зависела от id"""
+
+    def __init__(self, n: int, exponent: float, rnd: random.Random) -> None:
+        self.users = list(range(1, n + 1))
+        rnd.shuffle(self.users)
+        self.cum_weights = list(
+            itertools.accumulate(
+                1 / rank**exponent for rank in range(1, n + 1)
+            )
+        )
+        self.rnd = rnd
+
+    def sample(self, k: int) -> List[int]:
+        return self.rnd.choices(self.users, cum_weights=self.cum_weights, k=k)
+
+
+def chunks(rows: Iterable[Tuple], size: int = CHUNK_SIZE) -> Iterator[List]:
+    rows = iter(rows)
+    while chunk := list(itertools.islice(rows, size)):
+        yield chunk
+
+
+async def copy_rows(
+    conn: AsyncConnection, table, columns: Sequence[str], rows: Iterable
+) -> int:
+    """Записывает строки частями, возвращает их число"""
+    count = 0
+    for chunk in chunks(rows):
+        if conn.dialect.name == "postgresql":
+            raw = await conn.get_raw_connection()
+            await raw.driver_connection.copy_records_to_table(
+                table.name, records=chunk, columns=list(columns)
+            )
+        else:
+            await conn.execute(
+                insert(table), [dict(zip(columns, row)) for row in chunk]
+            )
+        count += len(chunk)
+    return count
+
+
+def user_rows(users: int) -> Iterator[Tuple]:
+    for user_id in range(1, users + 1):
+        yield user_id, f"user {user_id}", f"key{user_id}"
+
+
+def follower_rows(
+    users: int, following: float, popularity: PowerLaw, rnd: random.Random
+) -> Iterator[Tuple]:
+    """Подписки: число подписок пользователя распределено
+    экспоненциально со средним following, цели - по популярности"""
+    follow_id = itertools.count(1)
+    for user_id in range(1, users + 1):
+        count = min(int(rnd.expovariate(1 / following)), users - 1)
+        targets = set(popularity.sample(count)) - {user_id}
+        for target in sorted(targets):
+            yield next(follow_id), user_id, target
+
+
+def tweet_rows(
+    tweets: int,
+    likes: float,
+    users: int,
+    activity: PowerLaw,
+    rnd: random.Random,
+    like_rows: List[Tuple],
+) -> Iterator[Tuple]:
+    """Твиты, лайки к ним добавляются в like_rows. Авторы выбираются
+    по activity, число лайков твита - Парето (alpha=2) со средним
+    likes, лайкающие - равномерно"""
+    like_id = itertools.count(1)
+    tweet_id = 0
+    while tweet_id < tweets:
+        for author_id in activity.sample(min(CHUNK_SIZE, tweets - tweet_id)):
+            tweet_id += 1
+            count = min(int((rnd.paretovariate(2) - 1) * likes), users)
+            likers = {rnd.randint(1, users) for _ in range(count)}
+            like_rows.extend(
+                (next(like_id), tweet_id, user_id) for user_id in likers
+            )
+            words = rnd.choices(WORDS, k=rnd.randint(5, 30))
+            yield tweet_id, " ".join(words), author_id, len(likers)
+
+
+async def fill_timelines(
+    conn: AsyncConnection, mode: str, fanout_limit: int
+) -> int:
+    """Раскладывает все твиты по лентам, как timeline_service.fan_out_tweet:
+    в ленту автора и его подписчиков, в режиме hybrid твиты авторов, у
+    которых подписчиков не меньше fanout_limit, - только в ленту автора,
+    а сами авторы помечаются популярными. Возвращает число записей"""
+    if mode == "pull":
+        return 0
+    followers = models.Follower.__table__
+    tweets = models.Tweet.__table__
+    users = models.User.__table__
+    fanned_out = select(followers.c.user_id, tweets.c.id).join(
+        tweets, tweets.c.author_id == followers.c.following_id
+    )
+    if mode == "hybrid":
+        followers_count = (
+            select(func.count())
+            .where(followers.c.following_id == users.c.id)
+            .scalar_subquery()
+        )
+        await conn.execute(
+            update(users).values(is_popular=followers_count >= fanout_limit)
+        )
+        fanned_out = fanned_out.join(
+            users, users.c.id == followers.c.following_id
+        ).where(~users.c.is_popular)
+    result = await conn.execute(
+        insert(models.TimelineEntry.__table__).from_select(
+            ["user_id", "tweet_id"],
+            union_all(select(tweets.c.author_id, tweets.c.id), fanned_out),
+        )
+    )
+    return result.rowcount
+
+
+async def timeline_filled(engine: AsyncEngine) -> bool:
+    """Заполнены ли в БД ленты timeline_entries (режимы push и hybrid)"""
+    async with engine.connect() as conn:
+        return (
+            await conn.scalar(
+                select(literal(True))
+                .select_from(models.TimelineEntry)
+                .limit(1)
+            )
+            is not None
+        )
+
+
+async def reset_sequences(conn: AsyncConnection) -> None:
+    if conn.dialect.name != "postgresql":
+        return
+    for table in ("users", "followers", "tweets", "likes"):
+        await conn.execute(
+            text(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                f"coalesce((SELECT max(id) FROM {table}), 0) + 1, false)"
+            )
+        )
+
+
+async def seed(
+    engine: AsyncEngine,
+    users: int,
+    tweets: int,
+    following: float = 50,
+    likes: float = 5,
+    exponent: float = 1.0,
+    seed_value: int = 1,
+    mode: str = "pull",
+    fanout_limit: int = 10000,
+) -> dict:
+    """Пересоздаёт таблицы и заполняет их, возвращает число строк.
+    mode и fanout_limit должны совпадать с TIMELINE_MODE и
+    FANOUT_FOLLOWERS_LIMIT приложения, которое будет нагружаться"""
+    rnd = random.Random(seed_value)
+    popularity = PowerLaw(users, exponent, rnd)
+    start = time.perf_counter()
+    counts = {}
+    async with engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.drop_all)
+        await conn.run_sync(models.Base.metadata.create_all)
+        if conn.dialect.name == "postgresql" and (
+            await conn.scalar(text("SHOW is_superuser")) == "on"
+        ):
+            # Без триггеров внешних ключей COPY в несколько раз быстрее,
+            # генератор сам выдаёт только существующие id
+            await conn.execute(
+                text("SET LOCAL session_replication_role = replica")
+            )
+        counts["users"] = await copy_rows(
+            conn,
+            models.User.__table__,
+            ["id", "name", "api_key"],
+            user_rows(users),
+        )
+        counts["followers"] = await copy_rows(
+            conn,
+            models.Follower.__table__,
+            ["id", "user_id", "following_id"],
+            follower_rows(users, following, popularity, rnd),
+        )
+        # Лайки копятся, пока генерируется часть твитов, и пишутся
+        # после неё, чтобы не держать в памяти все лайки
+        like_rows: List[Tuple] = []
+        counts["tweets"] = counts["likes"] = 0
+        for chunk in chunks(
+            tweet_rows(tweets, likes, users, popularity, rnd, like_rows)
+        ):
+            counts["tweets"] += await copy_rows(
+                conn,
+                models.Tweet.__table__,
+                ["id", "content", "author_id", "like_count"],
+                chunk,
+            )
+            counts["likes"] += await copy_rows(
+                conn,
+                models.Like.__table__,
+                ["id", "tweet_id", "user_id"],
+                like_rows,
+            )
+            like_rows.clear()
+        counts["timeline_entries"] = await fill_timelines(
+            conn, mode, fanout_limit
+        )
+        await reset_sequences(conn)
+    if engine.dialect.name == "postgresql":
+        vacuum = engine.execution_options(isolation_level="AUTOCOMMIT")
+        async with vacuum.connect() as conn:
+            await conn.execute(text("VACUUM ANALYZE"))
+    counts["seconds"] = round(time.perf_counter() - start, 1)
+    return counts
+
+
+async def dataset_size(engine: AsyncEngine) -> Tuple[int, int]:
+    """(число пользователей, максимальный id твита) в БД"""
+    async with engine.connect() as conn:
+        users = await conn.scalar(select(func.count(models.User.id)))
+        tweets = await conn.scalar(select(func.max(models.Tweet.id)))
+    return users, tweets or 0
@@ -0,0 +1,120 @@
+"""Бенчмарк накладных расходов middleware на запрос.
+
+Вызывает приложение FastAPI с одним GET-обработчиком напрямую через ASGI,
+без сети и HTTP-клиента, и сравнивает время запроса без middleware,
+с прежним @app.middleware("http") session_close (BaseHTTPMiddleware)
+и с RequestScopeMiddleware. БД не нужна.
+
+    python3 benchmarks/request_scope.py
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.relpath("."))
+
+from fastapi import FastAPI, Request  # noqa E402
+
+from app.src.api.middlewares import RequestScopeMiddleware  # noqa E402
+
+
+def make_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/users/me")
+    async def endpoint():
+        return {"result": True, "user": {"id": 1, "name": "user"}}
+
+    return app
+
+
+def base_http_app() -> FastAPI:
+    app = make_app()
+
+    @app.middleware("http")
+    async def session_close(request: Request, call_next):
+        response = await call_next(request)
+        try:
+            await request.state.session.close()
+        except AttributeError:
+            ...
+        return response
+
+    return app
+
+
+def request_scope_app() -> FastAPI:
+    app = make_app()
+    app.add_middleware(RequestScopeMiddleware)
+    return app
+
+
+async def call(app) -> None:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/users/me",
+        "raw_path": b"/users/me",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"bench"), (b"api-key", b"key")],
+        "client": ("127.0.0.1", 1),
+        "server": ("bench", 80),
+    }
+
+    received = False
+
+    async def receive():
+        nonlocal received
+        if received:
+            # Как сервер: клиент не отключается, пока ответ не отправлен
+            await asyncio.Future()
+        received = True
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message) -> None:
+        pass
+
+    await app(scope, receive, send)
+
+
+async def measure(app, repeat: int):
+    for _ in range(repeat // 10):
+        await call(app)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await call(app)
+        timings.append((time.perf_counter() - start) * 1_000_000)
+    return timings
+
+
+async def main(args) -> None:
+    apps = {
+        "no middleware": make_app(),
+        "BaseHTTPMiddleware": base_http_app(),
+        "RequestScope": request_scope_app(),
+    }
+    baseline = None
+    for name, app in apps.items():
+        timings = await measure(app, args.repeat)
+        p50 = statistics.median(timings)
+        baseline = p50 if baseline is None else baseline
+        print(
+            f"{name:18} p50={p50:7.1f}us "
+            f"mean={statistics.mean(timings):7.1f}us "
+            f"overhead={p50 - baseline:6.1f}us"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20_000)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,107 @@
+"""Бенчмарк пропускной способности сервера (app/serve.py) по числу процессов.
+
+Для каждого значения ``--workers`` запускает ``python serve.py`` с
+WEB_WORKERS=N, нагружает его ``--concurrency`` постоянными соединениями
+из ``--clients`` процессов в течение ``--duration`` секунд и выводит
+запросы в секунду и задержки. Сервер берёт настройки БД из окружения,
+как и в docker-compose; api-key должен принадлежать пользователю в этой
+БД (например, из tests/generate_db.py).
+
+    python3 benchmarks/server_workers.py --api-key <key> --workers 1 2 4
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+
+
+async def load(url: str, api_key: str, connections: int, duration: float):
+    timings = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def connection(client: httpx.AsyncClient) -> None:
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            response = await client.get(url, headers={"api-key": api_key})
+            if response.status_code == 200:
+                timings.append((time.perf_counter() - start) * 1000)
+            else:
+                errors += 1
+
+    limits = httpx.Limits(max_connections=connections)
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        await asyncio.gather(*(connection(client) for _ in range(connections)))
+    return timings, errors
+
+
+def run_client(args) -> tuple:
+    return asyncio.run(load(*args))
+
+
+def wait_ready(url: str, server: subprocess.Popen, timeout: float) -> None:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited with code {server.returncode}")
+        try:
+            httpx.get(url)
+            return
+        except httpx.TransportError:
+            time.sleep(0.2)
+    raise RuntimeError("Server did not start")
+
+
+def measure(args, workers: int) -> None:
+    env = dict(os.environ, WEB_WORKERS=str(workers), WEB_PORT=str(args.port))
+    server = subprocess.Popen(
+        [sys.executable, "serve.py"], cwd=APP_DIR, env=env
+    )
+    base = f"http://127.0.0.1:{args.port}"
+    try:
+        wait_ready(f"{base}/openapi.json", server, timeout=60)
+        connections = max(args.concurrency // args.clients, 1)
+        jobs = [
+            (base + args.path, args.api_key, connections, args.duration)
+        ] * args.clients
+        with multiprocessing.Pool(args.clients) as pool:
+            results = pool.map(run_client, jobs)
+    finally:
+        server.terminate()
+        server.wait()
+    timings = [timing for result in results for timing in result[0]]
+    errors = sum(result[1] for result in results)
+    if not timings:
+        print(f"workers={workers:<3} no successful requests, errors={errors}")
+        return
+    p99 = statistics.quantiles(timings, n=100)[98]
+    print(
+        f"workers={workers:<3} "
+        f"rps={len(timings) / args.duration:9.1f} "
+        f"p50={statistics.median(timings):7.2f}ms "
+        f"p99={p99:7.2f}ms errors={errors}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--api-key", required=True)
+    parser.add_argument("--path", default="/users/me")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--port", type=int, default=8765)
+    arguments = parser.parse_args()
+    for workers in arguments.workers:
+        measure(arguments, workers)
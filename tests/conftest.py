@@ -2,16 +2,27 @@ import asyncio
 import os
 import shutil
 from pathlib import Path
+from contextlib import contextmanager
 from functools import lru_cache
+from typing import Optional
 
 import pytest
 from fastapi.testclient import TestClient
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
-from app.src.db import models
-
-from app.src.api.app_depends import get_session, get_static_image_path
+from app.src.db import database, models
+from app.src.db.instrumentation import QueryStats, instrument_engine
+from app.src.services.cache import InMemoryCacheBackend, RedisCacheBackend
+
+from app.src.api.app_depends import (
+    get_auth_cache,
+    get_like_counter,
+    get_session,
+    get_session_maker,
+    get_static_image_path,
+)
 from tests.config import IMAGE_PATH, REMOVE_FILES, STATIC_PATH, TESTS_DB
 
 
@@ -59,6 +70,8 @@ def environments():
 def db_engine(first_user):
     TEST_DATABASE_URL = f"sqlite+aiosqlite:///{TESTS_DB}"
     _test_engine = create_async_engine(TEST_DATABASE_URL)
+    database.enable_foreign_keys(_test_engine.sync_engine)
+    instrument_engine(_test_engine.sync_engine)
 
     user_A = models.User(id=2, name="TEST2_NAME", api_key="test2")
     user_B = models.User(id=3, name="TEST3_NAME", api_key="test3")
@@ -73,6 +86,40 @@ def db_engine(first_user):
         os.remove(TESTS_DB)
 
 
+@pytest.fixture
+def db_queries(db_engine):
+    """Все запросы приложения к тестовой БД"""
+    stats = QueryStats()
+    event.listen(db_engine.sync_engine, "after_cursor_execute", stats)
+    yield stats
+    event.remove(db_engine.sync_engine, "after_cursor_execute", stats)
+
+
+@pytest.fixture
+def query_budget(db_queries):
+    """Проверяет, что запросы внутри блока укладываются в бюджет:
+    не больше queries запросов и rows строк и ни один запрос
+    не повторяется repeated раз (N+1)"""
+
+    @contextmanager
+    def budget(queries: int, rows: Optional[int] = None, repeated: int = 5):
+        db_queries.reset()
+        yield db_queries
+        executed = "\n".join(
+            f"{count} x {statement}"
+            for statement, count in db_queries.statements.items()
+        )
+        assert (
+            db_queries.queries <= queries
+        ), f"{db_queries.queries} queries > {queries}:\n{executed}"
+        assert (
+            rows is None or db_queries.rows <= rows
+        ), f"{db_queries.rows} rows > {rows}:\n{executed}"
+        assert not db_queries.repeated(repeated), f"N+1:\n{executed}"
+
+    return budget
+
+
 @pytest.fixture
 def session_maker(db_engine):
     return sessionmaker(db_engine, expire_on_commit=True, class_=AsyncSession)
@@ -105,13 +152,30 @@ def static_path():
 
 @lru_cache
 @pytest.fixture
-def app(session_depends, static_path, environments):
+def app(session_depends, session_maker, static_path, environments):
     from app.src.api.app import app as _app
+
     _app.dependency_overrides[get_session] = session_depends
+    _app.dependency_overrides[get_session_maker] = lambda: session_maker
+    get_auth_cache().clear()
+    get_like_counter().clear()
     _app.dependency_overrides[get_static_image_path] = static_path
     yield _app
 
 
+@pytest.fixture(params=["memory", "redis"])
+def cache_backend_factory(request):
+    """Фабрика бэкенда кэша ответов. Для Redis каждый вызов создаёт
+    нового клиента общего сервера fakeredis, как разные процессы
+    приложения (TestClient запускает каждый запрос в своём event loop)"""
+    if request.param == "memory":
+        backend = InMemoryCacheBackend(maxsize=100)
+        return lambda: backend
+    aioredis = pytest.importorskip("fakeredis.aioredis")
+    server = pytest.importorskip("fakeredis").FakeServer()
+    return lambda: RedisCacheBackend(aioredis.FakeRedis(server=server))
+
+
 @pytest.fixture
 def client(app):
     client = TestClient(app=app)
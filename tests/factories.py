@@ -6,6 +6,7 @@ from faker.providers import BaseProvider
 from sqlalchemy import NullPool, create_engine
 from sqlalchemy.orm import scoped_session, sessionmaker
 
+from app.src.db.database import enable_foreign_keys
 from app.src.db.models import (
     Follower,
     Image,
@@ -17,7 +18,10 @@ from app.src.db.models import (
 from tests.config import IMAGE_PATH, TESTS_DB
 
 engine = create_engine(f"sqlite:///{TESTS_DB}", poolclass=NullPool)
-session = scoped_session(sessionmaker(bind=engine))
+enable_foreign_keys(engine)
+# Связи моделей lazy="raise", поэтому объекты фабрик не истекают после
+# commit и связи, переданные фабрике, остаются доступны в тестах
+session = scoped_session(sessionmaker(bind=engine, expire_on_commit=False))
 fake = faker.Faker()
 
 
@@ -75,6 +79,13 @@ class LikeFactory(factory.alchemy.SQLAlchemyModelFactory):
     tweet = factory.SubFactory(TweetFactory)
     user = factory.SubFactory(UserFactory)
 
+    @factory.post_generation
+    def like_count(obj, create, extracted, **kwargs):
+        # Счётчик в приложении обновляет LikeCounter, фабрика - сразу
+        if create:
+            obj.tweet.like_count += 1
+            session.commit()
+
 
 class FollowerFactory(factory.alchemy.SQLAlchemyModelFactory):
     class Meta:
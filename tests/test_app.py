@@ -1,7 +1,22 @@
+import asyncio
+import hashlib
+import json
+from pathlib import Path
+
+import PIL.Image
 import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
 from sqlalchemy import func, select
 
+from app.src.api.app_depends import get_like_counter
+from app.src.api.middlewares import (
+    ContentLengthLimitMiddleware,
+    RequestScopeMiddleware,
+)
 from app.src.db import models
+from app.src.services import image_service
+from tests.config import STATIC_PATH
 from tests.factories import (
     FollowerFactory,
     LikeFactory,
@@ -86,6 +101,9 @@ def test_post_api_tweets_with_media(client, first_user) -> None:
     tweet = session.get(models.Tweet, id)
     assert tweet.content == content
     assert "result" in resp.json()
+    # несуществующие изображения не прикрепляются
+    count = select(func.count()).where(models.TweetsImage.tweet_id == id)
+    assert session.scalar(count) == 0
 
 
 def test_post_api_tweets_create_tweet(client, first_user) -> None:
@@ -563,6 +581,85 @@ def test_get_users_id_follower(
     assert follower_schema in resp.json().get("user").get("followers")
 
 
+def test_get_users_id_counts_and_preview(client, monkeypatch) -> None:
+    monkeypatch.setattr("app.src.api.app.PROFILE_FOLLOWS_PREVIEW", 2)
+    user = UserFactory()
+    followers = [FollowerFactory(following=user).user for _ in range(3)]
+    FollowerFactory(user=user)
+    resp = client.get(f"/users/{user.id}", headers={"api-key": "test"})
+    profile = resp.json()["user"]
+    assert profile["followers_count"] == 3
+    assert profile["following_count"] == 1
+    assert profile["followers"] == [
+        {"id": follower.id, "name": follower.name}
+        for follower in followers[:0:-1]
+    ]
+
+
+@pytest.mark.parametrize("route", ["/users/me", "/users/1"])
+def test_get_users_not_modified(client, route) -> None:
+    resp = client.get(route, headers={"api-key": "test"})
+    etag = resp.headers["ETag"]
+    resp = client.get(
+        route, headers={"api-key": "test", "If-None-Match": etag}
+    )
+    assert resp.status_code == 304
+    client.post("/users/1/follow", headers={"api-key": "test2"})
+    resp = client.get(
+        route, headers={"api-key": "test", "If-None-Match": etag}
+    )
+    assert resp.status_code == 200
+    assert resp.json()["user"]["followers"][0]["id"] == 2
+    assert resp.headers["ETag"] != etag
+
+
+def test_get_users_id_legacy_full_profile(client, monkeypatch) -> None:
+    monkeypatch.setattr("app.src.api.app.LEGACY_FULL_PROFILE", True)
+    monkeypatch.setattr("app.src.api.app.PROFILE_FOLLOWS_PREVIEW", 2)
+    user = UserFactory()
+    FollowerFactory.create_batch(3, following=user)
+    resp = client.get(f"/users/{user.id}", headers={"api-key": "test"})
+    profile = resp.json()["user"]
+    assert len(profile["followers"]) == 3
+    assert "followers_count" not in profile
+
+
+@pytest.mark.parametrize("route", ["followers", "following"])
+def test_get_users_id_follows_pages(client, route) -> None:
+    user = UserFactory()
+    if route == "followers":
+        follows = FollowerFactory.create_batch(5, following=user)
+        expected = [follow.user for follow in reversed(follows)]
+    else:
+        follows = FollowerFactory.create_batch(5, user=user)
+        expected = [follow.following for follow in reversed(follows)]
+    users, cursor = [], None
+    while True:
+        params = {"limit": 2}
+        if cursor is not None:
+            params["cursor"] = cursor
+        resp = client.get(
+            f"/users/{user.id}/{route}",
+            headers={"api-key": "test"},
+            params=params,
+        )
+        assert resp.status_code == 200
+        users += resp.json()["users"]
+        cursor = resp.json().get("next_cursor")
+        if cursor is None:
+            break
+    assert users == [{"id": u.id, "name": u.name} for u in expected]
+
+
+@pytest.mark.parametrize("route", ["followers", "following"])
+def test_get_users_id_follows_not_exist(client, route) -> None:
+    resp = client.get(f"/users/1000/{route}", headers={"api-key": "test"})
+    assert resp.status_code == 404
+    resp = client.get(f"/users/2/{route}", headers={"api-key": "test"})
+    assert resp.status_code == 200
+    assert resp.json()["users"] == []
+
+
 # get api/tweets
 def test_get_tweets(
     client,
@@ -581,6 +678,7 @@ def test_get_tweets_tweet(
 ) -> None:
     like = LikeFactory()
     tweet = like.tweet
+    FollowerFactory(user=session.get(models.User, 1), following=tweet.author)
     resp = client.get(
         "/tweets",
         headers={"api-key": "test"},
@@ -589,7 +687,9 @@ def test_get_tweets_tweet(
         "id": tweet.id,
         "content": tweet.content,
         "attachments": [],
+        "media": [],
         "author": {"id": tweet.author.id, "name": tweet.author.name},
+        "like_count": 1,
         "likes": [{"user_id": like.user_id, "name": like.user.name}],
     }
 
@@ -602,6 +702,7 @@ def test_get_tweets_tweet_with_attachemnts(
     tweet_image = TweetsImageFactory()
     tweet = tweet_image.tweet
     image = tweet_image.image
+    FollowerFactory(user=session.get(models.User, 1), following=tweet.author)
 
     resp = client.get(
         "/tweets",
@@ -611,8 +712,938 @@ def test_get_tweets_tweet_with_attachemnts(
         "id": tweet.id,
         "content": tweet.content,
         "attachments": [image.path],
+        "media": [{"id": image.id, "path": image.path, "status": "pending"}],
         "author": {"id": tweet.author.id, "name": tweet.author.name},
+        "like_count": 0,
         "likes": [],
     }
 
     assert tweet_schema in resp.json().get("tweets")
+
+
+def test_get_tweets_tweet_with_media_variants(client) -> None:
+    tweet_image = TweetsImageFactory(
+        image__status=models.Image.READY,
+        image__thumb_path="thumb.jpg",
+        image__medium_path="medium.jpg",
+    )
+    FollowerFactory(
+        user=session.get(models.User, 1), following=tweet_image.tweet.author
+    )
+    resp = client.get("/tweets", headers={"api-key": "test"})
+    image = tweet_image.image
+    assert resp.json()["tweets"][0]["media"] == [
+        {
+            "id": image.id,
+            "path": image.path,
+            "status": "ready",
+            "thumb_path": "thumb.jpg",
+            "medium_path": "medium.jpg",
+        }
+    ]
+
+
+def test_get_tweets_likers_sample(client, monkeypatch) -> None:
+    monkeypatch.setattr("app.src.api.app.FEED_LIKERS_SAMPLE", 2)
+    tweet = TweetFactory(author=session.get(models.User, 1))
+    likes = LikeFactory.create_batch(3, tweet=tweet)
+    resp = client.get("/tweets", headers={"api-key": "test"})
+    tweet = resp.json()["tweets"][0]
+    assert tweet["like_count"] == 3
+    assert [like["user_id"] for like in tweet["likes"]] == [
+        likes[2].user_id,
+        likes[1].user_id,
+    ]
+
+
+def test_like_count_write_behind(client, session_maker) -> None:
+    tweet = TweetFactory()
+    for api_key in ("test", "test2", "test3"):
+        resp = client.post(
+            f"/tweets/{tweet.id}/likes", headers={"api-key": api_key}
+        )
+        assert resp.status_code == 201
+    client.delete(f"/tweets/{tweet.id}/likes", headers={"api-key": "test"})
+    count = select(models.Tweet.like_count).where(models.Tweet.id == tweet.id)
+    assert session.scalar(count) == 0
+    asyncio.run(get_like_counter().flush(session_maker))
+    assert session.scalar(count) == 2
+
+
+def test_like_count_not_negative(client, session_maker) -> None:
+    # a like from before like_count existed, the column was not recounted
+    like = LikeFactory(user=session.get(models.User, 1))
+    like.tweet.like_count = 0
+    session.commit()
+    client.delete(
+        f"/tweets/{like.tweet_id}/likes", headers={"api-key": "test"}
+    )
+    asyncio.run(get_like_counter().flush(session_maker))
+    count = select(models.Tweet.like_count).where(
+        models.Tweet.id == like.tweet_id
+    )
+    assert session.scalar(count) == 0
+
+
+def test_get_tweets_not_modified(client, db_queries) -> None:
+    follower = FollowerFactory()
+    TweetFactory(author=follower.following)
+    headers = {"api-key": follower.user.api_key}
+    resp = client.get("/tweets", headers=headers)
+    etag = resp.headers["ETag"]
+    assert resp.headers["Cache-Control"] == "private, no-cache"
+    db_queries.reset()
+    resp = client.get("/tweets", headers=headers | {"If-None-Match": etag})
+    assert resp.status_code == 304
+    assert resp.content == b""
+    assert resp.headers["ETag"] == etag
+    # только версия ленты, api-key уже в кэше
+    assert db_queries.queries == 1
+    resp = client.get(
+        "/tweets?limit=1", headers=headers | {"If-None-Match": etag}
+    )
+    assert resp.status_code == 200
+
+
+def test_get_tweets_etag_changes(client, session_maker) -> None:
+    follower = FollowerFactory()
+    author = follower.following
+    headers = {"api-key": follower.user.api_key}
+    etags = [client.get("/tweets", headers=headers).headers["ETag"]]
+
+    def changed() -> bool:
+        resp = client.get(
+            "/tweets", headers=headers | {"If-None-Match": etags[-1]}
+        )
+        etags.append(resp.headers["ETag"])
+        return resp.status_code == 200
+
+    resp = client.post(
+        "/tweets",
+        json={"tweet_data": "new tweet"},
+        headers={"api-key": author.api_key},
+    )
+    tweet_id = resp.json()["tweet_id"]
+    assert changed()
+    assert not changed()
+    client.post(f"/tweets/{tweet_id}/likes", headers={"api-key": "test"})
+    asyncio.run(get_like_counter().flush(session_maker))
+    assert changed()
+    client.post("/users/1/follow", headers=headers)
+    assert changed()
+    client.delete(f"/tweets/{tweet_id}", headers={"api-key": author.api_key})
+    assert changed()
+    assert len(set(etags)) == 5
+
+
+def test_get_tweets_etag_follow_swap(
+    client, monkeypatch, cache_backend_factory
+) -> None:
+    monkeypatch.setattr(
+        "app.src.api.app.get_cache_backend", cache_backend_factory
+    )
+    user = UserFactory()
+    x = UserFactory(version=5)
+    y = UserFactory(version=2)
+    FollowerFactory(user=user, following=x)
+    TweetFactory(author=x)
+    y_tweet = TweetFactory(author=y)
+    headers = {"api-key": user.api_key}
+    etag = client.get("/tweets", headers=headers).headers["ETag"]
+    # follows bump both users: the authors count and the sum of
+    # their versions are the same as before the swap
+    client.delete(f"/users/{x.id}/follow", headers=headers)
+    client.post(f"/users/{y.id}/follow", headers=headers)
+    resp = client.get("/tweets", headers=headers | {"If-None-Match": etag})
+    assert resp.status_code == 200
+    assert resp.headers["ETag"] != etag
+    resp = client.get("/tweets", headers=headers)
+    assert [tweet["id"] for tweet in resp.json()["tweets"]] == [y_tweet.id]
+
+
+def test_get_tweets_cached(
+    client, db_queries, monkeypatch, cache_backend_factory
+) -> None:
+    monkeypatch.setattr(
+        "app.src.api.app.get_cache_backend", cache_backend_factory
+    )
+    follower = FollowerFactory()
+    author = follower.following
+    TweetFactory(author=author)
+    headers = {"api-key": follower.user.api_key}
+    first = client.get("/tweets", headers=headers)
+    db_queries.reset()
+    resp = client.get("/tweets", headers=headers)
+    assert resp.content == first.content
+    assert resp.headers["ETag"] == first.headers["ETag"]
+    # только версия ленты, страница взята из кэша
+    assert db_queries.queries == 1
+    client.post(
+        "/tweets",
+        json={"tweet_data": "new tweet"},
+        headers={"api-key": author.api_key},
+    )
+    assert len(client.get("/tweets", headers=headers).json()["tweets"]) == 2
+
+
+def test_get_users_id_cached(
+    client, db_queries, monkeypatch, cache_backend_factory
+) -> None:
+    monkeypatch.setattr(
+        "app.src.api.app.get_cache_backend", cache_backend_factory
+    )
+    first = client.get("/users/1", headers={"api-key": "test"})
+    db_queries.reset()
+    resp = client.get("/users/1", headers={"api-key": "test"})
+    assert resp.content == first.content
+    # только версия профиля
+    assert db_queries.queries == 1
+    etag = resp.headers["ETag"]
+    resp = client.get(
+        "/users/1", headers={"api-key": "test", "If-None-Match": etag}
+    )
+    assert resp.status_code == 304
+    client.post("/users/1/follow", headers={"api-key": "test2"})
+    # a request that read the profile before the follow commit stores
+    # it after the commit: it goes under the old version
+    cache = cache_backend_factory()
+    asyncio.run(cache.set(f"profile:1:{etag}", first.content, 60))
+    resp = client.get("/users/1", headers={"api-key": "test"})
+    assert resp.json()["user"]["followers_count"] == 1
+    client.delete("/users/1/follow", headers={"api-key": "test2"})
+    resp = client.get("/users/1", headers={"api-key": "test"})
+    assert resp.json()["user"]["followers_count"] == 0
+
+
+class BrokenCache:
+    async def get(self, key):
+        raise ConnectionError("cache is down")
+
+    async def set(self, key, value, ttl):
+        raise ConnectionError("cache is down")
+
+
+def test_cache_backend_errors(client, monkeypatch) -> None:
+    from app.src.api.app_depends import get_metrics
+
+    monkeypatch.setattr(
+        "app.src.api.app.get_cache_backend", lambda: BrokenCache()
+    )
+    get_metrics().clear()
+    assert client.get("/tweets", headers={"api-key": "test"}).is_success
+    resp = client.get("/users/1", headers={"api-key": "test"})
+    assert resp.json()["user"]["id"] == 1
+    lookups = get_metrics().cache_lookups
+    assert lookups["feed", "error"] == 2
+    assert lookups["profile", "error"] == 2
+
+
+def test_get_tweets_limit(
+    client,
+) -> None:
+    user = UserFactory()
+    TweetFactory.create_batch(3, author=user)
+    resp = client.get(
+        "/tweets",
+        headers={"api-key": user.api_key},
+        params={"limit": 2},
+    )
+    assert resp.status_code == 200
+    assert len(resp.json().get("tweets")) == 2
+    assert resp.json().get("next_cursor") is not None
+
+
+def test_get_tweets_pages(
+    client,
+) -> None:
+    user = UserFactory()
+    tweets = TweetFactory.create_batch(5, author=user)
+    expected = sorted((tweet.id for tweet in tweets), reverse=True)
+    received = []
+    params = {"limit": 2}
+    while True:
+        resp = client.get(
+            "/tweets", headers={"api-key": user.api_key}, params=params
+        )
+        assert resp.status_code == 200
+        received.extend(tweet["id"] for tweet in resp.json().get("tweets"))
+        cursor = resp.json().get("next_cursor")
+        if cursor is None:
+            break
+        params = {"limit": 2, "cursor": cursor}
+    assert received == expected
+
+
+def test_get_tweets_before_after_id(
+    client,
+) -> None:
+    user = UserFactory()
+    tweets = TweetFactory.create_batch(5, author=user)
+    ids = sorted(tweet.id for tweet in tweets)
+    resp = client.get(
+        "/tweets",
+        headers={"api-key": user.api_key},
+        params={"before_id": ids[2]},
+    )
+    assert [tweet["id"] for tweet in resp.json().get("tweets")] == [
+        ids[1],
+        ids[0],
+    ]
+    resp = client.get(
+        "/tweets",
+        headers={"api-key": user.api_key},
+        params={"after_id": ids[0], "limit": 2},
+    )
+    assert [tweet["id"] for tweet in resp.json().get("tweets")] == [
+        ids[2],
+        ids[1],
+    ]
+    assert resp.json().get("next_cursor") is not None
+
+
+def test_get_tweets_wrong_cursor(
+    client,
+) -> None:
+    resp = client.get(
+        "/tweets", headers={"api-key": "test"}, params={"cursor": "wrong"}
+    )
+    assert resp.status_code == 400
+    assert resp.json()["result"] is False
+
+
+def test_get_tweets_only_following(
+    client,
+) -> None:
+    follower = FollowerFactory()
+    user = follower.user
+    own_tweet = TweetFactory(author=user)
+    following_tweet = TweetFactory(author=follower.following)
+    other_tweet = TweetFactory()
+    resp = client.get(
+        "/tweets",
+        headers={"api-key": user.api_key},
+    )
+    ids = [tweet["id"] for tweet in resp.json().get("tweets")]
+    assert own_tweet.id in ids
+    assert following_tweet.id in ids
+    assert other_tweet.id not in ids
+
+
+@pytest.mark.parametrize("mode", ["push", "hybrid"])
+def test_get_tweets_timeline_fan_out(client, monkeypatch, mode) -> None:
+    monkeypatch.setattr("app.src.api.app.TIMELINE_MODE", mode)
+    follower = FollowerFactory()
+    resp = client.post(
+        "/tweets",
+        headers={"api-key": follower.following.api_key},
+        json={"tweet_data": fake.paragraph()},
+    )
+    tweet_id = resp.json().get("tweet_id")
+    entries = session.scalars(
+        select(models.TimelineEntry.user_id).where(
+            models.TimelineEntry.tweet_id == tweet_id
+        )
+    ).all()
+    assert sorted(entries) == sorted([follower.user_id, follower.following_id])
+    resp = client.get("/tweets", headers={"api-key": follower.user.api_key})
+    assert [tweet["id"] for tweet in resp.json().get("tweets")] == [tweet_id]
+
+    client.delete(
+        "/tweets/{id}".format(id=tweet_id),
+        headers={"api-key": follower.following.api_key},
+    )
+    count = session.scalar(
+        select(func.count()).where(models.TimelineEntry.tweet_id == tweet_id)
+    )
+    assert count == 0
+
+
+def test_get_tweets_timeline_hybrid_popular_author(
+    client, monkeypatch
+) -> None:
+    monkeypatch.setattr("app.src.api.app.TIMELINE_MODE", "hybrid")
+    monkeypatch.setattr(
+        "app.src.services.timeline_service.FANOUT_FOLLOWERS_LIMIT", 1
+    )
+    follower = FollowerFactory()
+    resp = client.post(
+        "/tweets",
+        headers={"api-key": follower.following.api_key},
+        json={"tweet_data": fake.paragraph()},
+    )
+    tweet_id = resp.json().get("tweet_id")
+    entries = session.scalars(
+        select(models.TimelineEntry.user_id).where(
+            models.TimelineEntry.tweet_id == tweet_id
+        )
+    ).all()
+    assert entries == [follower.following_id]
+    resp = client.get("/tweets", headers={"api-key": follower.user.api_key})
+    assert [tweet["id"] for tweet in resp.json().get("tweets")] == [tweet_id]
+
+
+def test_get_tweets_timeline_follow_backfill(client, monkeypatch) -> None:
+    monkeypatch.setattr("app.src.api.app.TIMELINE_MODE", "push")
+    user = UserFactory()
+    tweet = TweetFactory()
+    client.post(
+        "/users/{id}/follow".format(id=tweet.author_id),
+        headers={"api-key": user.api_key},
+    )
+    resp = client.get("/tweets", headers={"api-key": user.api_key})
+    assert [t["id"] for t in resp.json().get("tweets")] == [tweet.id]
+
+    client.delete(
+        "/users/{id}/follow".format(id=tweet.author_id),
+        headers={"api-key": user.api_key},
+    )
+    resp = client.get("/tweets", headers={"api-key": user.api_key})
+    assert resp.json().get("tweets") == []
+
+
+def test_fan_out_tweet_batches(client, session_maker, monkeypatch) -> None:
+    from app.src.services import timeline_service
+
+    monkeypatch.setattr(
+        "app.src.services.timeline_service.FANOUT_BATCH_SIZE", 2
+    )
+    author = UserFactory()
+    followers = [FollowerFactory(following=author) for _ in range(5)]
+    tweet = TweetFactory(author=author)
+    # the follower followed the author before the fan-out ran
+    asyncio.run(
+        timeline_service.backfill_following(
+            session_maker, followers[2].user_id, author.id, "push"
+        )
+    )
+    asyncio.run(
+        timeline_service.fan_out_tweet(
+            session_maker, tweet.id, author.id, "push"
+        )
+    )
+    asyncio.run(
+        timeline_service.backfill_following(
+            session_maker, followers[2].user_id, author.id, "push"
+        )
+    )
+    entries = session.scalars(
+        select(models.TimelineEntry.user_id).where(
+            models.TimelineEntry.tweet_id == tweet.id
+        )
+    ).all()
+    expected = [author.id] + [follower.user_id for follower in followers]
+    assert sorted(entries) == sorted(expected)
+
+
+def test_auth_cache_hit_without_database(client) -> None:
+    user = UserFactory()
+    api_key = user.api_key
+    resp = client.get("/tweets", headers={"api-key": api_key})
+    assert resp.status_code == 200
+    session.delete(user)
+    session.commit()
+    resp = client.get("/tweets", headers={"api-key": api_key})
+    assert resp.status_code == 200
+
+
+def test_auth_cache_invalidated_on_follow(client) -> None:
+    from app.src.api.app_depends import get_auth_cache
+
+    user = UserFactory()
+    following = UserFactory()
+    client.get("/tweets", headers={"api-key": user.api_key})
+    assert get_auth_cache().get(user.api_key) is not None
+    client.post(
+        "/users/{id}/follow".format(id=following.id),
+        headers={"api-key": user.api_key},
+    )
+    assert get_auth_cache().get(user.api_key) is None
+
+
+def search(client, q, **params):
+    return client.get(
+        "/tweets/search",
+        headers={"api-key": "test"},
+        params={"q": q, **params},
+    )
+
+
+def test_search_tweets(client) -> None:
+    both = TweetFactory(content="Lemon and lime pie")
+    lemon = TweetFactory(content="lemon tea")
+    TweetFactory(content="lime soda")
+    resp = search(client, "LEMON")
+    assert resp.status_code == 200
+    ids = [tweet["id"] for tweet in resp.json()["tweets"]]
+    assert sorted(ids) == sorted([both.id, lemon.id])
+    assert "next_cursor" not in resp.json()
+    resp = search(client, "lime lemon")
+    assert [tweet["id"] for tweet in resp.json()["tweets"]] == [both.id]
+    assert resp.json()["tweets"][0]["content"] == "Lemon and lime pie"
+
+
+def test_search_tweets_ranking(client) -> None:
+    weak = TweetFactory(content="mango smoothie with ice and a long tail")
+    strong = TweetFactory(content="mango mango mango")
+    TweetFactory(content="mango smoothie with ice and a long tail")
+    resp = search(client, "mango")
+    ids = [tweet["id"] for tweet in resp.json()["tweets"]]
+    assert ids[0] == strong.id
+    assert ids.index(weak.id) == 2
+
+
+def test_search_tweets_no_matches(client) -> None:
+    TweetFactory(content="grape")
+    for q in ["melon", "!!! ???"]:
+        resp = search(client, q)
+        assert resp.status_code == 200
+        assert resp.json() == {"result": True, "tweets": []}
+    # query syntax characters are not an error
+    assert len(search(client, '"grape*').json()["tweets"]) == 1
+    assert search(client, "").status_code == 400
+
+
+def test_search_tweets_pagination(client) -> None:
+    tweets = [TweetFactory(content="kiwi " * n) for n in range(1, 6)]
+    ids = []
+    cursor = None
+    for _ in range(3):
+        params = {"limit": 2}
+        if cursor is not None:
+            params["cursor"] = cursor
+        body = search(client, "kiwi", **params).json()
+        ids += [tweet["id"] for tweet in body["tweets"]]
+        cursor = body.get("next_cursor")
+    assert cursor is None
+    assert sorted(ids) == sorted(tweet.id for tweet in tweets)
+    assert ids[0] == tweets[-1].id
+
+
+def test_search_tweets_windows(client, monkeypatch) -> None:
+    monkeypatch.setattr("app.src.api.app.SEARCH_WINDOW", 2)
+    monkeypatch.setattr("app.src.api.app.SEARCH_CANDIDATES", 3)
+    tweets = [TweetFactory(content="plum") for _ in range(4)]
+    TweetFactory.create_batch(5, content="pear")
+    tweets.append(TweetFactory(content="plum"))
+    ids = [tweet["id"] for tweet in search(client, "plum").json()["tweets"]]
+    # only the newest matches are ranked, across several windows
+    assert sorted(ids) == sorted(tweet.id for tweet in tweets[2:])
+
+
+def test_search_tweets_wrong_cursor(client) -> None:
+    for cursor in ["wrong", "WzEsMl0"]:
+        resp = search(client, "kiwi", cursor=cursor)
+        assert resp.status_code == 400
+        assert resp.json()["result"] is False
+
+
+def test_search_tweets_deleted(client) -> None:
+    user = session.get(models.User, 1)
+    tweet = TweetFactory(author=user, content="papaya")
+    assert len(search(client, "papaya").json()["tweets"]) == 1
+    client.delete(f"/tweets/{tweet.id}", headers={"api-key": "test"})
+    assert search(client, "papaya").json()["tweets"] == []
+
+
+# query budget per endpoint: queries and rows
+def test_get_tweets_queries(client, query_budget) -> None:
+    follower = FollowerFactory()
+    for _ in range(3):
+        tweet = TweetFactory(author=follower.following)
+        LikeFactory.create_batch(2, tweet=tweet)
+        TweetsImageFactory(tweet=tweet)
+    # auth, feed version, tweet documents with authors, likes and images
+    with query_budget(3, rows=1 + 1 + 3):
+        resp = client.get(
+            "/tweets", headers={"api-key": follower.user.api_key}
+        )
+    assert len(resp.json().get("tweets")) == 3
+
+
+def test_get_users_me_queries(client, query_budget) -> None:
+    user = UserFactory()
+    for _ in range(3):
+        FollowerFactory(user=user)
+        FollowerFactory(following=user)
+    # auth, version, user, followers with users, following with users
+    with query_budget(5, rows=1 + 1 + 1 + 3 + 3):
+        client.get("/users/me", headers={"api-key": user.api_key})
+
+
+def test_get_users_id_queries(client, query_budget) -> None:
+    user = UserFactory()
+    for _ in range(3):
+        FollowerFactory(user=user)
+        FollowerFactory(following=user)
+    with query_budget(5, rows=1 + 1 + 1 + 3 + 3):
+        client.get(
+            "/users/{id}".format(id=user.id), headers={"api-key": "test"}
+        )
+
+
+def test_search_tweets_queries(client, query_budget) -> None:
+    for _ in range(3):
+        tweet = TweetFactory(content="fig jam")
+        LikeFactory.create_batch(2, tweet=tweet)
+        TweetsImageFactory(tweet=tweet)
+    # auth, newest id, matches in one window, documents of the page
+    with query_budget(4, rows=1 + 1 + 3 + 3):
+        resp = search(client, "fig")
+    assert len(resp.json().get("tweets")) == 3
+
+
+@pytest.mark.parametrize(
+    "method, route",
+    [
+        ("post", "/tweets/{id}/likes"),
+        ("post", "/users/{id}/follow"),
+    ],
+)
+def test_write_queries_load_no_relationships(
+    client, query_budget, method, route
+) -> None:
+    tweet = TweetFactory()
+    LikeFactory.create_batch(3, tweet=tweet)
+    FollowerFactory.create_batch(3, following=tweet.author)
+    target = tweet.id if "likes" in route else tweet.author_id
+    # auth, insert ... on conflict do nothing; follow also bumps
+    # versions of both users, like does it in the like counter flush
+    with query_budget(3 if "follow" in route else 2, rows=1 + 1):
+        resp = client.request(
+            method, route.format(id=target), headers={"api-key": "test"}
+        )
+    assert resp.status_code == 201
+
+
+@pytest.mark.parametrize(
+    "route",
+    ["/tweets/{id}", "/tweets/{id}/likes", "/users/{id}/follow"],
+)
+def test_delete_queries_single_statement(client, query_budget, route) -> None:
+    user = session.get(models.User, 1)
+    tweet = TweetFactory(author=user)
+    LikeFactory(tweet=tweet, user=user)
+    following = FollowerFactory(user=user).following
+    target = following.id if "follow" in route else tweet.id
+    # auth, delete ... returning, versions update except for likes
+    with query_budget(2 if "likes" in route else 3, rows=1 + 1):
+        resp = client.delete(
+            route.format(id=target), headers={"api-key": "test"}
+        )
+    assert resp.status_code == 200
+
+
+def test_query_budget_exceeded(client, query_budget) -> None:
+    with pytest.raises(AssertionError, match="queries > 1"):
+        with query_budget(1):
+            client.get("/users/me", headers={"api-key": "test"})
+
+
+def test_query_budget_repeated_queries(client, query_budget) -> None:
+    # the same statement executed in a loop, as with lazy loading
+    with pytest.raises(AssertionError, match="N\\+1"):
+        with query_budget(100, repeated=3):
+            for _ in range(3):
+                client.get("/users/1", headers={"api-key": "test"})
+
+
+def test_db_debug_headers(client) -> None:
+    resp = client.get("/users/me", headers={"api-key": "test"})
+    assert resp.headers["X-DB-Queries"] == "5"
+    assert int(resp.headers["X-DB-Rows"]) >= 2
+    assert "db;dur=" in resp.headers["Server-Timing"]
+
+
+def test_debug_query_metrics(client) -> None:
+    from app.src.api.app_depends import get_query_metrics
+
+    get_query_metrics().clear()
+    client.get("/users/me", headers={"api-key": "test"})
+    client.get("/users/1", headers={"api-key": "test"})
+    client.get("/users/1", headers={"api-key": "test"})
+    metrics = client.get("/debug/queries").json()
+    assert metrics["GET /users/me"]["requests"] == 1
+    assert metrics["GET /users/{id}"]["requests"] == 2
+    # the api-key is already in the auth cache
+    assert metrics["GET /users/{id}"]["queries"] == 2 * 4
+    assert metrics["GET /users/{id}"]["max_queries"] == 4
+
+
+def test_delete_api_tweets_id_cascade(client) -> None:
+    user = session.get(models.User, 1)
+    tweet = TweetFactory(author=user)
+    LikeFactory.create_batch(2, tweet=tweet)
+    TweetsImageFactory(tweet=tweet)
+    session.add(models.TimelineEntry(user_id=2, tweet_id=tweet.id))
+    session.commit()
+    resp = client.delete(f"/tweets/{tweet.id}", headers={"api-key": "test"})
+    assert resp.status_code == 200
+    for model in (models.Like, models.TweetsImage, models.TimelineEntry):
+        count = select(func.count()).where(model.tweet_id == tweet.id)
+        assert session.scalar(count) == 0
+
+
+def test_post_api_medias_same_name(client) -> None:
+    paths = []
+    for content in (b"first image", b"second image"):
+        resp = client.post(
+            "/medias",
+            headers={"api-key": "test"},
+            files={"file": ("same.jpeg", content, "image/jpeg")},
+        )
+        assert resp.status_code == 201
+        image = session.get(models.Image, resp.json().get("media_id"))
+        assert (Path(STATIC_PATH) / image.path).read_bytes() == content
+        paths.append(image.path)
+    assert paths[0] != paths[1]
+
+
+def test_post_api_medias_deduplicated(client) -> None:
+    img = fake_image()
+    media_ids = []
+    # the extension is detected from the content, not the file name
+    for api_key, name in (
+        ("test", img[1]),
+        ("test2", "other name.png"),
+        ("test", "page.html"),
+    ):
+        resp = client.post(
+            "/medias",
+            headers={"api-key": api_key},
+            files={"file": (name, img[0], "image/jpeg")},
+        )
+        assert resp.status_code == 201
+        media_ids.append(resp.json().get("media_id"))
+    assert len(set(media_ids)) == 1
+    image = session.get(models.Image, media_ids[0])
+    assert image.hash == hashlib.sha256(img[0]).hexdigest()
+    assert image.path.startswith(f"images/sha256/{image.hash[:2]}/")
+    assert image.path.endswith(".jpg")
+    files = [p for p in Path(STATIC_PATH).rglob("*") if p.is_file()]
+    assert sorted(str(p.relative_to(STATIC_PATH)) for p in files) == sorted(
+        [image.path, image.thumb_path, image.medium_path]
+    )
+
+
+def test_post_api_medias_existing_path(client) -> None:
+    content = b"legacy image"
+    file_hash = hashlib.sha256(content).hexdigest()
+    legacy = models.Image(path="legacy.jpeg", hash=file_hash)
+    session.add(legacy)
+    session.commit()
+    resp = client.post(
+        "/medias",
+        headers={"api-key": "test"},
+        files={"file": ("new.jpeg", content, "image/jpeg")},
+    )
+    assert resp.json()["media_id"] == legacy.id
+    # the stored copy is removed, the row keeps its file
+    assert not [p for p in Path(STATIC_PATH).rglob("*") if p.is_file()]
+
+
+def test_post_api_medias_too_large(client, monkeypatch) -> None:
+    monkeypatch.setattr("app.src.services.file_service.UPLOAD_MAX_SIZE", 10)
+    monkeypatch.setattr("app.src.services.file_service.UPLOAD_CHUNK_SIZE", 4)
+    pre_count = session.scalar(select(func.count(models.Image.id)))
+    resp = client.post(
+        "/medias",
+        headers={"api-key": "test"},
+        files={"file": ("big.jpeg", b"0" * 11, "image/jpeg")},
+    )
+    post_count = session.scalar(select(func.count(models.Image.id)))
+    assert resp.status_code == 413
+    assert resp.json()["result"] is False
+    assert pre_count == post_count
+    assert not list(Path(STATIC_PATH).rglob("*.part"))
+
+
+def test_post_api_medias_variants(client) -> None:
+    img = fake_image()
+    resp = client.post(
+        "/medias",
+        headers={"api-key": "test"},
+        files={"file": (img[1], img[0], "image/jpeg")},
+    )
+    assert resp.status_code == 201
+    image = session.get(models.Image, resp.json().get("media_id"))
+    session.refresh(image)
+    assert image.status == models.Image.READY
+    for variant_path, size in (
+        (image.thumb_path, image_service.VARIANTS["thumb"]),
+        (image.medium_path, image_service.VARIANTS["medium"]),
+    ):
+        with PIL.Image.open(Path(STATIC_PATH) / variant_path) as variant:
+            assert variant.width <= size[0] and variant.height <= size[1]
+            assert "exif" not in variant.info
+
+
+def test_post_api_medias_variants_failed(client) -> None:
+    resp = client.post(
+        "/medias",
+        headers={"api-key": "test"},
+        files={"file": ("broken.jpeg", b"not an image", "image/jpeg")},
+    )
+    assert resp.status_code == 201
+    image = session.get(models.Image, resp.json().get("media_id"))
+    session.refresh(image)
+    assert image.status == models.Image.FAILED
+    assert image.thumb_path is None
+
+
+def test_debug_pool_stats(client) -> None:
+    resp = client.get("/debug/pool")
+    assert resp.status_code == 200
+    assert "pool" in resp.json()
+
+
+def test_content_length_limit_middleware() -> None:
+    limited = FastAPI()
+    limited.add_middleware(
+        ContentLengthLimitMiddleware, max_size=10, paths={"/limited"}
+    )
+
+    @limited.post("/limited")
+    @limited.post("/free")
+    async def endpoint(request: Request):
+        return {"size": len(await request.body())}
+
+    limited_client = TestClient(limited)
+    resp = limited_client.post("/limited", content=b"0" * 10)
+    assert resp.status_code == 200
+    resp = limited_client.post("/limited", content=b"0" * 11)
+    assert resp.status_code == 413
+    assert resp.json()["error_type"] == "FileTooLarge"
+    assert limited_client.post("/free", content=b"0" * 11).status_code == 200
+    # chunked body without Content-Length
+    resp = limited_client.post("/limited", content=iter([b"0" * 6] * 2))
+    assert resp.status_code == 413
+    assert resp.json()["error_type"] == "FileTooLarge"
+    resp = limited_client.post("/limited", content=iter([b"0" * 5] * 2))
+    assert resp.json() == {"size": 10}
+
+
+def test_post_api_medias_chunked_too_large(client) -> None:
+    from app.src.settings import UPLOAD_MAX_SIZE
+
+    boundary = "limit"
+    chunk = b"0" * 1024 * 1024
+    body = (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; '
+        f'filename="big.jpeg"\r\nContent-Type: image/jpeg\r\n\r\n'
+    ).encode()
+    resp = client.post(
+        "/medias",
+        headers={
+            "api-key": "test",
+            "content-type": f"multipart/form-data; boundary={boundary}",
+        },
+        # no closing boundary: the body is rejected before it is parsed
+        content=iter([body] + [chunk] * (UPLOAD_MAX_SIZE // len(chunk) + 2)),
+    )
+    assert resp.status_code == 413
+    assert resp.json()["error_message"].startswith("Request is larger")
+    assert not list(Path(STATIC_PATH).rglob("*.part"))
+
+
+class FakeSession:
+    closed = False
+
+    async def close(self) -> None:
+        self.closed = True
+
+
+def test_request_scope_middleware() -> None:
+    scoped = FastAPI()
+    scoped.add_middleware(RequestScopeMiddleware)
+    sessions = []
+    closed = []
+
+    @scoped.get("/ok")
+    @scoped.get("/error")
+    async def endpoint(request: Request):
+        request_scope = request.state.request_scope
+        request_scope.session = FakeSession()
+        request_scope.call_on_close(lambda: closed.append(request.url.path))
+        request_scope.response_headers.append(("Set-Cookie", "a=1"))
+        sessions.append(request_scope.session)
+        if request.url.path == "/error":
+            raise RuntimeError
+        return {"result": True}
+
+    scoped_client = TestClient(scoped, raise_server_exceptions=False)
+    resp = scoped_client.get("/ok")
+    assert resp.status_code == 200
+    assert resp.headers["Server-Timing"].startswith("app;dur=")
+    assert resp.headers["Set-Cookie"] == "a=1"
+    assert scoped_client.get("/error").status_code == 500
+    assert [session.closed for session in sessions] == [True, True]
+    assert closed == ["/ok", "/error"]
+
+
+def test_server_timing_header(client) -> None:
+    resp = client.get("/users/me", headers={"api-key": "test"})
+    assert resp.status_code == 200
+    assert "Server-Timing" in resp.headers
+
+
+def test_metrics(client) -> None:
+    from app.src.api.app_depends import get_metrics
+
+    get_metrics().clear()
+    client.get("/users/1", headers={"api-key": "test"})
+    client.get("/users/1", headers={"api-key": "test"})
+    client.get("/users/1000", headers={"api-key": "test"})
+    client.post(
+        "/medias",
+        headers={"api-key": "test"},
+        files={"file": ("image.jpeg", b"0" * 100, "image/jpeg")},
+    )
+    resp = client.get("/metrics")
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/plain")
+    lines = resp.text.splitlines()
+    route = 'method="GET",route="/users/{id}"'
+    assert f'http_requests_total{{{route},status="200"}} 2' in lines
+    assert f'http_requests_total{{{route},status="404"}} 1' in lines
+    assert f"http_request_duration_seconds_count{{{route}}} 3" in lines
+    assert 'cache_lookups_total{cache="auth",result="hit"} 3' in lines
+    assert "upload_size_bytes_sum 100.0" in lines
+    # the /metrics request itself is being processed
+    assert "http_requests_in_flight 1" in lines
+    assert any(line.startswith("db_pool_size ") for line in lines)
+
+
+def test_openapi_schema_file(app, tmp_path) -> None:
+    from app.src.api.customopenapi import load_openapi, save_openapi
+
+    path = tmp_path / "openapi.json"
+    assert load_openapi(app, str(path)) is None
+    openapi_schema = save_openapi(app, str(path))
+    assert "/tweets" in openapi_schema["paths"]
+    assert load_openapi(app, str(path)) == openapi_schema
+    document = json.loads(path.read_text())
+    document["fingerprint"] = "other code"
+    path.write_text(json.dumps(document))
+    assert load_openapi(app, str(path)) is None
+
+
+def test_openapi_fingerprint_covers_schemas(app, monkeypatch) -> None:
+    from app.src.api.customopenapi import openapi_fingerprint
+
+    fingerprint = openapi_fingerprint(app)
+    read_bytes = Path.read_bytes
+
+    def edited_schemas(path: Path) -> bytes:
+        content = read_bytes(path)
+        return content + b"# edited" if path.name == "schemas.py" else content
+
+    monkeypatch.setattr(Path, "read_bytes", edited_schemas)
+    assert openapi_fingerprint(app) != fingerprint
+
+
+def test_openapi_built_on_first_request(client, app) -> None:
+    app.openapi_schema = None
+    resp = client.get("/openapi.json")
+    assert resp.status_code == 200
+    assert "MediaPost" in resp.json()["components"]["schemas"]
+    assert app.openapi_schema is not None
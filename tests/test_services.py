@@ -0,0 +1,224 @@
+import asyncio
+import io
+
+import pytest
+from fastapi import UploadFile
+
+from app.src.services import cache
+from app.src.services.cache import ApiKeyCache, TTLCache
+from app.src.services.etag import etag_matches, make_etag
+from app.src.services.like_counter import LikeCounter
+from app.src.services.metrics import Histogram, Metrics
+from app.src.services.pagination import (
+    InvalidCursor,
+    decode_cursor,
+    encode_cursor,
+)
+from app.src.api.schemas import User
+
+
+def test_cursor_round_trip() -> None:
+    assert decode_cursor(encode_cursor("before", 10)) == ("before", 10)
+
+
+@pytest.mark.parametrize("cursor", ["", "wrong", "bnVsbA"])
+def test_cursor_invalid(cursor) -> None:
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor)
+
+
+def test_ttl_cache_lru_eviction() -> None:
+    ttl_cache = TTLCache(maxsize=2, ttl=60)
+    ttl_cache.set("a", 1)
+    ttl_cache.set("b", 2)
+    assert ttl_cache.get("a") == 1
+    ttl_cache.set("c", 3)
+    assert ttl_cache.get("b") is None
+    assert ttl_cache.get("a") == 1
+    assert ttl_cache.get("c") == 3
+
+
+def test_ttl_cache_expiration(monkeypatch) -> None:
+    now = 1000.0
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now)
+    ttl_cache = TTLCache(maxsize=2, ttl=10)
+    ttl_cache.set("a", 1)
+    now += 11
+    assert ttl_cache.get("a") is None
+    assert len(ttl_cache) == 0
+
+
+def test_api_key_cache_invalidate_user() -> None:
+    api_key_cache = ApiKeyCache(maxsize=10, ttl=60)
+    api_key_cache.set("key1", User(id=1, name="first"))
+    api_key_cache.set("key2", User(id=1, name="first"))
+    api_key_cache.set("key3", User(id=2, name="second"))
+    api_key_cache.invalidate_user(1)
+    assert api_key_cache.get("key1") is None
+    assert api_key_cache.get("key2") is None
+    assert api_key_cache.get("key3").id == 2
+
+
+def test_api_key_cache_key_moved_to_other_user() -> None:
+    api_key_cache = ApiKeyCache(maxsize=10, ttl=60)
+    api_key_cache.set("key1", User(id=1, name="first"))
+    api_key_cache.set("key1", User(id=2, name="second"))
+    api_key_cache.invalidate_user(1)
+    assert api_key_cache.get("key1").id == 2
+    api_key_cache.invalidate_user(2)
+    assert api_key_cache.get("key1") is None
+    assert api_key_cache._keys_by_user == {}
+
+
+def test_like_counter_requeues_on_failed_flush() -> None:
+    def broken_session_maker():
+        raise ConnectionError("database is down")
+
+    counter = LikeCounter(interval=1)
+    counter.add(1, 1)
+    counter.add(1, 1)
+    counter.add(2, -1)
+    with pytest.raises(ConnectionError):
+        asyncio.run(counter.flush(broken_session_maker))
+    counter.add(1, 1)
+    assert dict(counter._deltas) == {1: 3, 2: -1}
+
+
+@pytest.mark.parametrize(
+    "if_none_match, expected",
+    [
+        (None, False),
+        ("", False),
+        ("*", True),
+        ('"other"', False),
+        ('"other", W/{etag}', True),
+        ("{etag}", True),
+    ],
+)
+def test_etag_matches(if_none_match, expected) -> None:
+    etag = make_etag("feed", 1, 2)
+    if if_none_match is not None:
+        if_none_match = if_none_match.format(etag=etag)
+    assert etag_matches(if_none_match, etag) is expected
+    assert make_etag("feed", 1, 3) != etag
+
+
+def test_cache_backend(cache_backend_factory) -> None:
+    async def scenario():
+        backend = cache_backend_factory()
+        assert await backend.get("a") is None
+        await backend.set("a", b"1", 10)
+        await backend.set("b", b"2", 0.05)
+        assert await backend.get("a") == b"1"
+        await asyncio.sleep(0.1)
+        assert await backend.get("b") is None
+        await backend.delete("a", "missing")
+        assert await backend.get("a") is None
+        await backend.close()
+
+    asyncio.run(scenario())
+
+
+def test_make_cache_backend() -> None:
+    assert cache.make_cache_backend("", 10) is None
+    backend = cache.make_cache_backend("memory://", 10)
+    assert isinstance(backend, cache.InMemoryCacheBackend)
+
+
+def test_histogram_buckets() -> None:
+    histogram = Histogram((1, 10))
+    for value in (0.5, 1, 5, 20):
+        histogram.observe(value)
+    assert list(histogram.samples("size", 'kind="a"')) == [
+        'size_bucket{kind="a",le="1"} 2',
+        'size_bucket{kind="a",le="10"} 3',
+        'size_bucket{kind="a",le="+Inf"} 4',
+        'size_sum{kind="a"} 26.5',
+        'size_count{kind="a"} 4',
+    ]
+
+
+def test_metrics_render() -> None:
+    metrics = Metrics()
+    metrics.request_started()
+    metrics.request_started()
+    metrics.request_finished("GET", "/users/{id}", 200, 0.003)
+    metrics.cache_lookup("feed", True)
+    metrics.cache_lookup("feed", False)
+    metrics.observe_upload(2048)
+    text = metrics.render(
+        {"size": 5, "checkedout": 1},
+        {
+            "GET /users/{id}": {
+                "queries": 4,
+                "rows": 6,
+                "duration_ms": 2.0,
+            }
+        },
+    )
+    lines = text.splitlines()
+    assert (
+        'http_requests_total{method="GET",route="/users/{id}",status="200"} 1'
+        in lines
+    )
+    assert (
+        "http_request_duration_seconds_bucket"
+        '{method="GET",route="/users/{id}",le="0.005"} 1'
+    ) in lines
+    assert "http_requests_in_flight 1" in lines
+    assert 'cache_lookups_total{cache="feed",result="hit"} 1' in lines
+    assert 'cache_lookups_total{cache="feed",result="miss"} 1' in lines
+    assert "upload_size_bytes_sum 2048.0" in lines
+    assert "db_pool_checkedout 1" in lines
+    assert 'db_queries_total{method="GET",route="/users/{id}"} 4' in lines
+    assert "# TYPE http_request_duration_seconds histogram" in lines
+
+
+def test_write_to_disk_zero_max_size(tmp_path, environments) -> None:
+    from app.src.services.file_service import FileTooLarge, write_to_disk
+
+    file = UploadFile(io.BytesIO(b"0"), filename="a.jpg")
+    with pytest.raises(FileTooLarge):
+        asyncio.run(write_to_disk(file, str(tmp_path), max_size=0))
+    assert not [path for path in tmp_path.rglob("*") if path.is_file()]
+
+
+@pytest.mark.parametrize(
+    "head, suffix",
+    [
+        (b"\xff\xd8\xff\xe0\x00\x10JFIF", ".jpg"),
+        (b"\x89PNG\r\n\x1a\n\x00\x00", ".png"),
+        (b"GIF89a\x01\x00", ".gif"),
+        (b"RIFF\x00\x00\x00\x00WEBP", ".webp"),
+        (b"<html><script>", ""),
+        (b"", ""),
+    ],
+)
+def test_image_suffix(environments, head, suffix) -> None:
+    from app.src.services.file_service import image_suffix
+
+    assert image_suffix(head) == suffix
+
+
+@pytest.mark.parametrize("mode", ["RGBA", "LA", "P"])
+def test_make_variants_transparent_background(
+    tmp_path, environments, mode
+) -> None:
+    from PIL import Image
+
+    from app.src.services.image_service import make_variants
+
+    source = Image.new("RGBA", (20, 20), (0, 0, 0, 0))
+    source.paste((255, 0, 0, 255), (0, 0, 10, 20))
+    if mode == "P":
+        source = source.convert("P", palette=Image.ADAPTIVE, colors=2)
+        source.info["transparency"] = source.getpixel((15, 10))
+    else:
+        source = source.convert(mode)
+    source.save(
+        tmp_path / "a.png", transparency=source.info.get("transparency")
+    )
+    variants = make_variants("a.png", str(tmp_path))
+    with Image.open(tmp_path / variants["thumb"]) as thumb:
+        # прозрачная часть - на белом фоне, а не чёрная
+        assert min(thumb.convert("RGB").getpixel((17, 10))) > 240